@@ -44,6 +44,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'catalog.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -65,6 +66,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'catalog.branches.branches',
             ],
         },
     },
@@ -84,6 +86,50 @@ DATABASES = {
 }
 
 
+# The default cache counts hits and misses (see catalog/metrics.py) of the cache it wraps.
+CACHES = {
+    'default': {
+        'BACKEND': 'catalog.metrics.InstrumentedCache',
+        'LOCATION': 'shared',
+    },
+    # One store for all server processes, so that version bumps reach every worker (see catalog/cache.py).
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('REDIS_URL', 'redis://127.0.0.1:6379/1'),
+    },
+}
+
+# Metrics of all server processes are aggregated through this directory (see catalog/metrics.py).
+METRICS_DIR = os.environ.get('METRICS_DIR')
+
+# Addresses allowed to scrape /metrics without a staff login (the Prometheus server).
+METRICS_ALLOWED_IPS = [ip for ip in os.environ.get('METRICS_ALLOWED_IPS', '').split(',') if ip]
+
+
+# Users and their permissions are cached across requests (see catalog/backends.py).
+
+AUTHENTICATION_BACKENDS = [
+    'catalog.backends.CachedModelBackend',
+]
+
+# Seconds a cached user is trusted; bounds how late bulk updates (e.g. deactivations) are seen.
+AUTH_CACHE_TIMEOUT = 60
+
+# Sessions are read from the cache; only writes go to the database.
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
+
+# Book, book list and author pages are cached for all visitors except for the
+# user navigation, which is rendered per request (see catalog/pagecache.py).
+# With PAGE_CACHE_EDGE_INCLUDES it is left to an edge cache as an ESI include.
+PAGE_CACHE_TIMEOUT = 5 * 60
+PAGE_CACHE_EDGE_INCLUDES = False
+
+
+# Withdrawn copies without loan events for this many days are moved to the archive (see catalog/archive.py).
+ARCHIVE_IDLE_DAYS = 365
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
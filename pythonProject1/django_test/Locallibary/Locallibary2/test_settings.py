@@ -0,0 +1,14 @@
+"""
+Settings for running the test suite: `python manage.py test` uses them
+unless DJANGO_SETTINGS_MODULE is set.
+"""
+from .settings import *  # noqa: F401,F403
+
+# PBKDF2 is slow by design; every create_user() and login() would pay for it.
+PASSWORD_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+# TestCase data is uncommitted, so a rebuild thread with its own connection could not read it.
+TYPEAHEAD_BACKGROUND_REBUILD = False
+
+# Each test run gets its own empty cache instead of the shared Redis store.
+CACHES = {**CACHES, 'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}  # noqa: F405
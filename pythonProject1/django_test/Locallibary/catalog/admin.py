@@ -1,5 +1,16 @@
 from django.contrib import admin
-from .models import Author, Genre, Book, BookInstance
+from django.contrib.admin.views.main import ChangeList
+from django.urls import reverse
+from django.utils.html import format_html
+from .models import (
+    ArchivedBookInstance, Author, Genre, Book, BookInstance, Branch, BranchTransfer, CirculationBatch, Fine, FineRate, LoanEvent,
+    LoanCounter, LoanLimit, PeriodicTask, Stocktake, Task,
+)
+from .archive import archive_copies, restore_copies
+from .branches import all_branches, transfer_copies
+from .fines import mark_paid
+from .genres import attach_genre_names, sorted_genres
+from .limits import refresh_counters
 
 
 class BookInstanceInline(admin.TabularInline):
@@ -14,12 +25,34 @@ class BookInline(admin.TabularInline):
     extra = 0
 
 
+class GenreListFilter(admin.SimpleListFilter):
+    """Фильтр по жанру: варианты берутся из реестра жанров, без запроса к catalog_genre"""
+    title = 'жанр'
+    parameter_name = 'genre'
+
+    def lookups(self, request, model_admin):
+        return sorted_genres()
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(genre=self.value())
+        return queryset
+
+
+class BookChangeList(ChangeList):
+    """Жанры всех книг страницы загружаются одним запросом к промежуточной таблице"""
+
+    def get_results(self, request):
+        super().get_results(request)
+        attach_genre_names(self.result_list)
+
+
 class BookAdmin(admin.ModelAdmin):
     # Поля, которые будут отображаться в списке книг
     list_display = ('title', 'display_author', 'display_genre')
 
     # Поля для фильтрации
-    list_filter = ('genre', 'author')
+    list_filter = (GenreListFilter, 'author')
 
     # Поля для поиска
     search_fields = ('title', 'author__first_name', 'author__last_name')
@@ -30,7 +63,7 @@ class BookAdmin(admin.ModelAdmin):
             'fields': ('title', 'author')
         }),
         ('Details', {
-            'fields': ('summary', 'genre')
+            'fields': ('summary', 'isbn', 'genre')
         }),
     )
 
@@ -39,15 +72,17 @@ class BookAdmin(admin.ModelAdmin):
 
     # Предварительная загрузка связанных данных для оптимизации
     def get_queryset(self, request):
-        return super().get_queryset(request).select_related('author').prefetch_related('genre')
+        return super().get_queryset(request).select_related('author')
+
+    def get_changelist(self, request, **kwargs):
+        return BookChangeList
 
     def display_author(self, obj):
         return str(obj.author) if obj.author else 'Не указан'
 
     def display_genre(self, obj):
-        genres = obj.genre.all()
-        if genres:
-            return ', '.join(genre.name for genre in genres)
+        if obj.genre_names:
+            return ', '.join(obj.genre_names)
         return 'Не указаны'
 
     display_author.short_description = 'Автор'
@@ -71,13 +106,13 @@ class GenreAdmin(admin.ModelAdmin):
 @admin.register(BookInstance)
 class BookInstanceAdmin(admin.ModelAdmin):
     # ОБЪЕДИНЕНО: представление списка BookInstance
-    list_display = ('book', 'status', 'borrower', 'due_back', 'id_display')
-    list_filter = ('status', 'due_back')
+    list_display = ('book', 'status', 'borrower', 'due_back', 'branch', 'id_display')
+    list_filter = ('branch', 'status', 'due_back')
     search_fields = ('book__title', 'imprint')
 
     fieldsets = (
         (None, {
-            'fields': ('book', 'imprint', 'id')
+            'fields': ('book', 'imprint', 'id', 'branch')
         }),
         ('Availability', {
             'fields': ('status', 'due_back', 'borrower')
@@ -90,8 +125,163 @@ class BookInstanceAdmin(admin.ModelAdmin):
 
     id_display.short_description = 'ID экземпляра'
 
+    actions = ['archive_selected']
+
+    @admin.action(description='Перенести в архив')
+    def archive_selected(self, request, queryset):
+        """Экземпляры на руках и с неоплаченными штрафами пропускаются"""
+        archived = archive_copies(queryset)
+        self.message_user(request, 'Перенесено в архив экземпляров: %d' % archived)
+
+    def get_actions(self, request):
+        """Добавляет действие перемещения экземпляров для каждого филиала"""
+        actions = super().get_actions(request)
+        for branch in all_branches().values():
+            name = 'transfer_to_%s' % branch.pk
+            actions[name] = (self._transfer_action(branch), name, 'Переместить в филиал «%s»' % branch.name)
+        return actions
+
+    @staticmethod
+    def _transfer_action(branch):
+        def transfer(modeladmin, request, queryset):
+            moved = transfer_copies(list(queryset.values_list('pk', flat=True)), branch, request.user)
+            modeladmin.message_user(request, 'Перемещено экземпляров: %d' % moved)
+        return transfer
+
+
+@admin.register(ArchivedBookInstance)
+class ArchivedBookInstanceAdmin(admin.ModelAdmin):
+    """Архив списанных экземпляров; восстановление возвращает их в обращение"""
+    list_display = ('book', 'status', 'branch', 'archived', 'id')
+    list_filter = ('status', 'branch')
+    list_select_related = ('book', 'branch')
+    search_fields = ('book__title', 'imprint')
+    readonly_fields = ('id', 'book', 'imprint', 'due_back', 'branch', 'status', 'archived', 'history')
+    actions = ['restore_selected']
+
+    @admin.action(description='Вернуть в обращение')
+    def restore_selected(self, request, queryset):
+        restored = restore_copies(queryset)
+        self.message_user(request, 'Возвращено экземпляров: %d' % restored)
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(Branch)
+class BranchAdmin(admin.ModelAdmin):
+    list_display = ('name', 'address')
+    search_fields = ('name',)
+
+
+@admin.register(BranchTransfer)
+class BranchTransferAdmin(admin.ModelAdmin):
+    """Журнал перемещений экземпляров между филиалами"""
+    list_display = ('created', 'book_instance', 'from_branch', 'to_branch', 'requested_by')
+    list_filter = ('from_branch', 'to_branch')
+    list_select_related = ('book_instance__book', 'from_branch', 'to_branch', 'requested_by')
+
+
+@admin.register(LoanEvent)
+class LoanEventAdmin(admin.ModelAdmin):
+    """Журнал выдачи только для чтения: события не изменяются и не удаляются"""
+    list_display = ('created', 'kind', 'book_instance_id', 'book', 'borrower', 'due_back')
+    list_filter = ('kind',)
+    list_select_related = ('book', 'borrower')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(Task)
+class TaskAdmin(admin.ModelAdmin):
+    """Очередь фоновых задач"""
+    list_display = ('name', 'status', 'run_at', 'attempts', 'locked_by', 'finished')
+    list_filter = ('status', 'name')
+    search_fields = ('name', 'dedup_key')
+
+
+@admin.register(PeriodicTask)
+class PeriodicTaskAdmin(admin.ModelAdmin):
+    """Периодические задачи"""
+    list_display = ('name', 'task', 'interval', 'next_run', 'enabled')
+    list_filter = ('enabled',)
+
 
 # Регистрация моделей в админке
 admin.site.register(Book, BookAdmin)
 admin.site.register(Author, AuthorAdmin)
-admin.site.register(Genre, GenreAdmin)
\ No newline at end of file
+admin.site.register(Genre, GenreAdmin)
+
+
+@admin.register(CirculationBatch)
+class CirculationBatchAdmin(admin.ModelAdmin):
+    """Пакеты выдачи/возврата со стойки; хранятся ответы для повторных запросов"""
+    list_display = ('created', 'batch_key', 'action', 'user')
+    list_filter = ('action',)
+    list_select_related = ('user',)
+    readonly_fields = ('batch_key', 'action', 'user', 'created', 'response')
+
+
+@admin.register(FineRate)
+class FineRateAdmin(admin.ModelAdmin):
+    """Тарифы штрафов за просрочку: по жанрам и тариф по умолчанию (без жанра)"""
+    list_display = ('genre', 'daily_rate', 'grace_days', 'max_fine')
+    list_select_related = ('genre',)
+
+
+@admin.register(Fine)
+class FineAdmin(admin.ModelAdmin):
+    """Журнал штрафов; суммы пересчитываются ночным расчетом"""
+    list_display = ('borrower', 'book_instance', 'due_back', 'days_overdue', 'amount', 'computed_on', 'paid')
+    list_filter = ('paid',)
+    list_select_related = ('borrower', 'book_instance__book')
+    readonly_fields = ('book_instance', 'borrower', 'due_back', 'days_overdue', 'amount', 'computed_on', 'paid')
+    search_fields = ('borrower__username',)
+    actions = ['mark_fines_paid']
+
+    @admin.action(description='Отметить как оплаченные')
+    def mark_fines_paid(self, request, queryset):
+        marked = mark_paid(queryset)
+        self.message_user(request, 'Оплачено штрафов: %d' % marked)
+
+
+@admin.register(LoanLimit)
+class LoanLimitAdmin(admin.ModelAdmin):
+    """Лимиты одновременных выдач: по группам и лимит по умолчанию (без группы)"""
+    list_display = ('group', 'max_loans')
+    list_select_related = ('group',)
+
+
+@admin.register(LoanCounter)
+class LoanCounterAdmin(admin.ModelAdmin):
+    """Счетчики выданных экземпляров; ведутся при выдаче и возврате"""
+    list_display = ('borrower', 'active_loans')
+    list_select_related = ('borrower',)
+    readonly_fields = ('borrower', 'active_loans')
+    search_fields = ('borrower__username',)
+    actions = ['recount_loans']
+
+    @admin.action(description='Пересчитать по экземплярам')
+    def recount_loans(self, request, queryset):
+        borrower_ids = list(queryset.values_list('borrower_id', flat=True))
+        refresh_counters(borrower_ids)
+        self.message_user(request, 'Пересчитано счетчиков: %d' % len(borrower_ids))
+
+
+@admin.register(Stocktake)
+class StocktakeAdmin(admin.ModelAdmin):
+    """Инвентаризации; сканы загружаются через stocktake/ или команду stocktake"""
+    list_display = ('created', 'branch', 'scanned', 'missing', 'unexpected', 'mismatched', 'report_link')
+    list_select_related = ('branch',)
+    readonly_fields = ('scanned', 'invalid_lines', 'missing', 'unexpected', 'mismatched', 'reconciled')
+
+    @admin.display(description='Отчет')
+    def report_link(self, obj):
+        return format_html('<a href="{}">CSV</a>', reverse('stocktake-report', args=[obj.pk]))
\ No newline at end of file
@@ -0,0 +1,158 @@
+"""
+Archive tier for withdrawn copies.
+
+Copies that are out of circulation stay in BookInstance forever, where every
+circulation query and index has to step over them. archive_copies() moves
+copies into ArchivedBookInstance in batches: the copy's fines and branch
+transfers go with it into its `history` (they reference the copy and would
+otherwise block or cascade the delete), and the copy rows are deleted from
+the hot table. The loan history stays in LoanEvent, which refers to copies
+by plain id. restore_copies() moves archived copies back with their history.
+
+A copy matches the default policy when it is in maintenance ('m'), not lent
+to anyone, owes no unpaid fine, and was neither added nor had a loan event
+in the last ARCHIVE_IDLE_DAYS (copies added before creation times were
+recorded count as old).
+Copies on loan are never archived.
+
+Like the other bulk circulation operations, both bypass the model signals
+and invalidate the cached counts once per batch.
+"""
+import datetime
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from . import facets
+from .models import ArchivedBookInstance, BookInstance, Branch, BranchTransfer, Fine, LoanEvent
+
+BATCH_SIZE = 1000
+
+FINE_FIELDS = ('borrower_id', 'due_back', 'days_overdue', 'amount', 'computed_on', 'paid')
+TRANSFER_FIELDS = ('from_branch_id', 'to_branch_id', 'created', 'requested_by_id')
+
+
+def idle_days():
+    return getattr(settings, 'ARCHIVE_IDLE_DAYS', 365)
+
+
+def archivable(statuses=('m',), days=None, now=None):
+    """
+    Returns the copies matching the archive policy.
+    """
+    cutoff = (now or timezone.now()) - datetime.timedelta(days=idle_days() if days is None else days)
+    recent = LoanEvent.objects.filter(book_instance_id=OuterRef('pk'), created__gte=cutoff)
+    unpaid = Fine.objects.filter(book_instance=OuterRef('pk'), paid=False)
+    return (
+        BookInstance.objects.filter(status__in=[status for status in statuses if status != 'o'], borrower__isnull=True)
+        .filter(Q(created__isnull=True) | Q(created__lt=cutoff))
+        .filter(~Exists(recent), ~Exists(unpaid))
+    )
+
+
+def _history(copy_ids):
+    history = {copy_id: {'fines': [], 'transfers': []} for copy_id in copy_ids}
+    for row in Fine.objects.filter(book_instance_id__in=copy_ids).order_by('id').values('book_instance_id', *FINE_FIELDS):
+        history[row.pop('book_instance_id')]['fines'].append(row)
+    transfers = BranchTransfer.objects.filter(book_instance_id__in=copy_ids).order_by('id')
+    for row in transfers.values('book_instance_id', *TRANSFER_FIELDS):
+        history[row.pop('book_instance_id')]['transfers'].append(row)
+    return history
+
+
+def _delete_copies(copy_ids):
+    # A queryset delete() would load every copy to send its signals.
+    pk = BookInstance._meta.pk
+    db = transaction.get_connection()
+    with db.cursor() as cursor:
+        cursor.execute(
+            'DELETE FROM %s WHERE %s IN (%s)' % (
+                db.ops.quote_name(BookInstance._meta.db_table), db.ops.quote_name(pk.column),
+                ', '.join(['%s'] * len(copy_ids)),
+            ),
+            [pk.get_db_prep_value(copy_id, db) for copy_id in copy_ids],
+        )
+
+
+def archive_copies(copies):
+    """
+    Moves the copies of the `copies` queryset that are not on loan and owe no unpaid fine to the archive.
+    Returns the number of copies archived.
+    """
+    unpaid = Fine.objects.filter(book_instance=OuterRef('pk'), paid=False)
+    with transaction.atomic():
+        rows = list(
+            copies.select_for_update().exclude(status='o').filter(borrower__isnull=True).filter(~Exists(unpaid))
+            .order_by().values('id', 'book_id', 'imprint', 'due_back', 'branch_id', 'status')
+        )
+        if not rows:
+            return 0
+        copy_ids = [row['id'] for row in rows]
+        history = _history(copy_ids)
+        now = timezone.now()
+        ArchivedBookInstance.objects.bulk_create(
+            [ArchivedBookInstance(archived=now, history=history[row['id']], **row) for row in rows]
+        )
+        Fine.objects.filter(book_instance_id__in=copy_ids).delete()
+        BranchTransfer.objects.filter(book_instance_id__in=copy_ids).delete()
+        _delete_copies(copy_ids)
+    facets.availability_changed(row['book_id'] for row in rows)
+    return len(rows)
+
+
+def archive_matching(statuses=('m',), days=None, batch_size=BATCH_SIZE):
+    """
+    Archives all copies matching the policy, `batch_size` copies per transaction. Returns the number archived.
+    """
+    archived = 0
+    last = None
+    while True:
+        batch = archivable(statuses, days).order_by('pk')
+        if last is not None:
+            batch = batch.filter(pk__gt=last)
+        copy_ids = list(batch.values_list('pk', flat=True)[:batch_size])
+        if not copy_ids:
+            return archived
+        last = copy_ids[-1]
+        archived += archive_copies(BookInstance.objects.filter(pk__in=copy_ids))
+
+
+def restore_copies(archived):
+    """
+    Moves the copies of the `archived` queryset back into circulation with their fines and transfers.
+    Returns the number of copies restored.
+    """
+    with transaction.atomic():
+        copies = list(archived.select_for_update().order_by())
+        if not copies:
+            return 0
+        fines = [(copy.id, fine) for copy in copies for fine in copy.history.get('fines', [])]
+        transfers = [(copy.id, transfer) for copy in copies for transfer in copy.history.get('transfers', [])]
+        # History rows referring to users or branches deleted in the meantime are dropped or detached.
+        users = set(User.objects.filter(
+            pk__in={fine['borrower_id'] for _, fine in fines} | {row['requested_by_id'] for _, row in transfers}
+        ).values_list('pk', flat=True))
+        branch_ids = set(Branch.objects.values_list('pk', flat=True))
+        BookInstance.objects.bulk_create([
+            BookInstance(id=copy.id, book_id=copy.book_id, imprint=copy.imprint, due_back=copy.due_back,
+                         branch_id=copy.branch_id, status=copy.status)
+            for copy in copies
+        ])
+        Fine.objects.bulk_create([
+            Fine(book_instance_id=copy_id, **fine) for copy_id, fine in fines if fine['borrower_id'] in users
+        ])
+        BranchTransfer.objects.bulk_create([
+            BranchTransfer(
+                book_instance_id=copy_id, to_branch_id=row['to_branch_id'], created=row['created'],
+                from_branch_id=row['from_branch_id'] if row['from_branch_id'] in branch_ids else None,
+                requested_by_id=row['requested_by_id'] if row['requested_by_id'] in users else None,
+            )
+            for copy_id, row in transfers if row['to_branch_id'] in branch_ids
+        ])
+        ArchivedBookInstance.objects.filter(pk__in=[copy.pk for copy in copies]).delete()
+    facets.availability_changed(copy.book_id for copy in copies)
+    return len(copies)
+
@@ -0,0 +1,58 @@
+"""
+ASGI application that serves Server-Sent Events streams without a thread per connection.
+
+Django runs every ASGI request in its own thread-sensitive context, which
+keeps a thread alive for as long as the response streams. Requests for views
+marked with @event_stream skip that context, so the (short) synchronous
+middleware work of all streams shares asgiref's single thread while the
+streams themselves are plain coroutines.
+
+Under WSGI every open stream would hold a worker, so event streams are only
+offered (and served) by processes started with get_asgi_application(), or
+where the LIVE_STREAMS setting says so.
+"""
+import django
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.urls import Resolver404, resolve
+
+# Set when this process serves requests through StreamingASGIHandler.
+_serving = False
+
+
+def event_streams_enabled():
+    return getattr(settings, 'LIVE_STREAMS', _serving)
+
+
+def event_stream(view):
+    """
+    Marks an async view whose response is a long-lived event stream.
+    """
+    view.event_stream = True
+    return view
+
+
+class StreamingASGIHandler(ASGIHandler):
+
+    def is_event_stream(self, scope):
+        path = scope['path']
+        root_path = scope.get('root_path', '')
+        if root_path and path.startswith(root_path):
+            path = path[len(root_path):]
+        try:
+            return getattr(resolve(path).func, 'event_stream', False)
+        except Resolver404:
+            return False
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and self.is_event_stream(scope):
+            await self.handle(scope, receive, send)
+        else:
+            await super().__call__(scope, receive, send)
+
+
+def get_asgi_application():
+    global _serving
+    django.setup(set_prefix=False)
+    _serving = True
+    return StreamingASGIHandler()
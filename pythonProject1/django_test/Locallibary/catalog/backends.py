@@ -0,0 +1,79 @@
+"""
+Authentication backend caching users and their permissions across requests.
+
+ModelBackend only caches permissions on the user object, so every request
+loads the user, its permissions and its groups' permissions again. Here the
+user and both permission sets are kept in the Django cache, keyed by the user
+and by two versions: the user's own version (bumped when the user, its
+permissions or its groups change) and a global version (bumped when group
+permissions or groups/permissions themselves change).
+
+The versions are bumped from model signals, which bulk changes such as
+User.objects.update(is_active=False) do not send. The entries therefore
+expire after AUTH_CACHE_TIMEOUT seconds, which bounds how long such a
+change can go unnoticed.
+"""
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import Permission
+from django.core.cache import cache
+
+from .cache import bump_version, get_versions
+
+GLOBAL_VERSION = 'permissions'
+
+
+def _timeout():
+    return getattr(settings, 'AUTH_CACHE_TIMEOUT', 60)
+
+
+def user_version_name(user_id):
+    return 'user:%s' % user_id
+
+
+def invalidate_user(user_id):
+    bump_version(user_version_name(user_id))
+
+
+def invalidate_all():
+    bump_version(GLOBAL_VERSION)
+
+
+def _cache_key(kind, user_id):
+    global_version, user_version = get_versions(GLOBAL_VERSION, user_version_name(user_id))
+    return 'catalog:auth:%s:%s:%s:%s' % (kind, user_id, user_version, global_version)
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    ModelBackend whose get_user() and permission lookups are served from the cache.
+    """
+
+    def get_user(self, user_id):
+        key = _cache_key('user', user_id)
+        user = cache.get(key)
+        if user is None:
+            user = super().get_user(user_id)
+            if user is None:
+                return None
+            cache.set(key, user, _timeout())
+        return user if self.user_can_authenticate(user) else None
+
+    def _get_permissions(self, user_obj, obj, from_name):
+        if not user_obj.is_active or user_obj.is_anonymous or obj is not None:
+            return set()
+
+        perm_cache_name = '_%s_perm_cache' % from_name
+        if not hasattr(user_obj, perm_cache_name):
+            key = _cache_key('%s_perms' % from_name, user_obj.pk)
+            perms = cache.get(key)
+            if perms is None:
+                if user_obj.is_superuser:
+                    queryset = Permission.objects.all()
+                else:
+                    queryset = getattr(self, '_get_%s_permissions' % from_name)(user_obj)
+                queryset = queryset.values_list('content_type__app_label', 'codename').order_by()
+                perms = {'%s.%s' % (app_label, codename) for app_label, codename in queryset}
+                cache.set(key, perms, _timeout())
+            setattr(user_obj, perm_cache_name, perms)
+        return getattr(user_obj, perm_cache_name)
@@ -0,0 +1,85 @@
+"""
+Branch scoping of copy inventory.
+
+The branch a visitor works with is chosen with the `branch` GET parameter
+and remembered in the session; an empty value goes back to all branches.
+Copy querysets are narrowed with scope_copies(), which the branch-leading
+BookInstance indexes serve directly. Copies that predate branches were moved
+to a "Main library" branch by migration 0021; a copy added without a branch
+is only listed under all branches.
+"""
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+
+from . import facets
+from .cache import versioned_key
+from .loans import invalidate_loans
+from .models import BookInstance, Branch, BranchTransfer
+
+VERSION_NAME = 'branches'
+
+SESSION_KEY = 'branch_id'
+
+
+def all_branches():
+    """
+    Returns the {pk: Branch} mapping of all branches (cached; branches rarely change).
+    """
+    key = versioned_key(VERSION_NAME, 'all')
+    branches = cache.get(key)
+    if branches is None:
+        branches = Branch.objects.in_bulk()
+        cache.set(key, branches, None)
+    return branches
+
+
+def current_branch(request):
+    """
+    Returns the branch selected for this request, or None for all branches.
+    """
+    if not hasattr(request, '_catalog_branch'):
+        if 'branch' in request.GET and hasattr(request, 'session'):
+            try:
+                request.session[SESSION_KEY] = int(request.GET['branch'])
+            except ValueError:
+                request.session.pop(SESSION_KEY, None)
+        branch_id = request.session.get(SESSION_KEY) if hasattr(request, 'session') else None
+        request._catalog_branch = all_branches().get(branch_id)
+    return request._catalog_branch
+
+
+def scope_copies(queryset, branch):
+    return queryset if branch is None else queryset.filter(branch=branch)
+
+
+def transfer_copies(copy_ids, to_branch, user=None):
+    """
+    Moves copies to `to_branch`, recording a BranchTransfer for each one. Returns the number of copies moved.
+    """
+    with transaction.atomic():
+        copies = list(
+            BookInstance.objects.select_for_update().filter(pk__in=copy_ids).exclude(branch=to_branch)
+            .only('id', 'book', 'branch', 'borrower')
+        )
+        BranchTransfer.objects.bulk_create([
+            BranchTransfer(book_instance=copy, from_branch_id=copy.branch_id, to_branch=to_branch, requested_by=user)
+            for copy in copies
+        ])
+        # A new version, so a batch or form that read a copy before the move cannot write over it.
+        BookInstance.objects.filter(pk__in=[copy.pk for copy in copies]).update(
+            branch=to_branch, version=F('version') + 1,
+        )
+    facets.availability_changed(copy.book_id for copy in copies)
+    invalidate_loans(copy.borrower_id for copy in copies)
+    return len(copies)
+
+
+def branches(request):
+    """
+    Context processor adding the branch selector data to every template.
+    """
+    return {
+        'branches': sorted(all_branches().values(), key=lambda branch: branch.name),
+        'current_branch': current_branch(request),
+    }
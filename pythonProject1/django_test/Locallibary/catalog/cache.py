@@ -0,0 +1,67 @@
+"""
+Version counters for cache invalidation shared by all worker processes.
+
+Cached data embeds the current version of its namespace in the key (or
+compares it with the version it was built from); bumping the version makes
+every process see the old entries as stale without having to find and
+delete them.
+
+This holds only as long as the default cache is one store for all
+processes: settings.py wraps Redis. With a per-process cache such as
+LocMemCache, which the tests use, a bump reaches only its own process.
+"""
+from functools import partial
+
+from django.core.cache import cache
+from django.db import transaction
+
+VERSION_KEY = 'catalog:version:%s'
+
+
+def get_version(name):
+    return cache.get_or_set(VERSION_KEY % name, 1, None)
+
+
+def get_versions(*names):
+    """
+    Returns the versions of several namespaces with one cache round-trip.
+    """
+    keys = [VERSION_KEY % name for name in names]
+    found = cache.get_many(keys)
+    missing = {key: 1 for key in keys if key not in found}
+    if missing:
+        cache.set_many(missing, None)
+        found.update(missing)
+    return [found[key] for key in keys]
+
+
+def bump_version(name):
+    key = VERSION_KEY % name
+    cache.add(key, 1, None)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # The key was evicted between add() and incr().
+        cache.set(key, 2, None)
+        return 2
+
+
+def _bump_versions(names):
+    for name in names:
+        bump_version(name)
+
+
+def bump_versions_on_commit(names):
+    """
+    Bumps the versions of `names` once the current transaction commits (immediately outside one).
+    """
+    names = list(names)
+    if names:
+        transaction.on_commit(partial(_bump_versions, names))
+
+
+def versioned_key(name, *parts):
+    """
+    Returns a cache key for `parts` in namespace `name` that changes whenever the namespace version is bumped.
+    """
+    return ':'.join(['catalog', name, str(get_version(name))] + [str(part) for part in parts])
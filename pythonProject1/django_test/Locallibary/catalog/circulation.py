@@ -0,0 +1,213 @@
+"""
+Batch check-out, return and renewal of scanned copies for circulation desks.
+
+A batch resolves all copies with one IN query, changes every eligible copy
+with one UPDATE (all copies of a batch get the same new values; one per few
+hundred distinct versions when the copies were read at many) and writes
+the circulation events with one bulk insert, inside a single transaction.
+The batch key supplied by the client is stored, scoped to the user, with
+the response, so a retried request returns the original results instead of
+processing again; a key reused for a different action or different copies
+is rejected. A copy scanned twice, in any spelling of its id, is processed
+once and its result reported for every spelling.
+Checkouts count against the borrower's loan limit (see catalog/limits.py):
+copies beyond it, in request order, are not lent.
+
+Every copy carries a version, incremented by each save and each batch. The
+UPDATE of a batch only matches the copies still at the version it read, so
+a batch never overwrites a change made since; a client may also pass the
+versions it last showed, and copies changed after that are rejected rather
+than renewed or returned over the newer change.
+"""
+import datetime
+import uuid
+from collections import Counter, defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import events, facets, limits, live, loans
+from .models import BookInstance, CirculationBatch, LoanEvent
+
+CHECKOUT = 'checkout'
+RETURN = 'return'
+RENEW = 'renew'
+
+ACTIONS = (CHECKOUT, RETURN, RENEW)
+
+# Status a copy must have for each action, and the event the action produces.
+REQUIRED_STATUS = {CHECKOUT: 'a', RETURN: 'o', RENEW: 'o'}
+EVENT_KIND = {CHECKOUT: LoanEvent.CHECKOUT, RETURN: LoanEvent.RETURN, RENEW: LoanEvent.RENEWAL}
+
+MAX_BATCH_SIZE = 5000
+
+DEFAULT_LOAN_PERIOD = datetime.timedelta(weeks=3)
+
+# The latest due date a checkout or renewal may set, as for a renewal by form.
+MAX_LOAN_PERIOD = datetime.timedelta(weeks=4)
+
+# Leaves room in CirculationBatch.batch_key for the user prefix of the stored key.
+MAX_BATCH_KEY_LENGTH = 64
+
+# Distinct versions per UPDATE; the OR of their conditions must stay within the expression depth of SQLite.
+VERSION_GROUPS_PER_UPDATE = 200
+
+
+class BatchError(ValueError):
+    """
+    Raised for a batch that cannot be processed at all (as opposed to per-copy failures).
+    """
+
+
+def _new_values(action, borrower, due_back):
+    if action == CHECKOUT:
+        return {'status': 'o', 'borrower_id': borrower.pk, 'due_back': due_back}
+    if action == RETURN:
+        return {'status': 'a', 'borrower_id': None, 'due_back': None}
+    return {'due_back': due_back}
+
+
+def _at_versions(copies):
+    """
+    Yields conditions matching `copies` at the versions read, each with at most
+    VERSION_GROUPS_PER_UPDATE terms: WHERE (id IN (...) AND version = v) OR ...
+    """
+    ids_by_version = defaultdict(list)
+    for copy in copies:
+        ids_by_version[copy.version].append(copy.pk)
+    groups = list(ids_by_version.items())
+    for start in range(0, len(groups), VERSION_GROUPS_PER_UPDATE):
+        condition = Q()
+        for version, ids in groups[start:start + VERSION_GROUPS_PER_UPDATE]:
+            condition |= Q(pk__in=ids, version=version)
+        yield condition
+
+
+def apply_batch(action, copy_ids, borrower=None, due_back=None, versions=None):
+    """
+    Applies `action` to the copies and returns {copy id: result} in request order.
+    `versions` optionally maps copy ids to the versions the client last saw.
+    Must be called inside a transaction.
+    """
+    if action not in ACTIONS:
+        raise BatchError('Unknown action %r' % action)
+    if action == CHECKOUT and borrower is None:
+        raise BatchError('A checkout needs a borrower')
+    if len(copy_ids) > MAX_BATCH_SIZE:
+        raise BatchError('At most %d copies per batch' % MAX_BATCH_SIZE)
+    today = datetime.date.today()
+    if due_back is None:
+        due_back = today + DEFAULT_LOAN_PERIOD
+    if action != RETURN and not today <= due_back <= today + MAX_LOAN_PERIOD:
+        raise BatchError('The due date must be between today and %d weeks ahead' % (MAX_LOAN_PERIOD.days // 7))
+
+    # {raw id: parsed id or None}; spellings of the same id share one copy id in `wanted` (in request order).
+    parsed = {}
+    for raw_id in map(str, copy_ids):
+        try:
+            parsed[raw_id] = uuid.UUID(raw_id)
+        except ValueError:
+            parsed[raw_id] = None
+    wanted = list(dict.fromkeys(copy_id for copy_id in parsed.values() if copy_id is not None))
+
+    expected = {}
+    for raw_id, version in (versions or {}).items():
+        try:
+            expected[uuid.UUID(str(raw_id))] = int(version)
+        except (ValueError, TypeError):
+            raise BatchError('Invalid version of %s' % raw_id)
+
+    copies = BookInstance.objects.select_for_update().filter(pk__in=wanted).only(
+        'id', 'book', 'status', 'borrower', 'due_back', 'branch', 'version'
+    )
+    found = {copy.pk: copy for copy in copies}
+
+    results = {}
+    eligible = []
+    for copy_id in wanted:
+        copy = found.get(copy_id)
+        if copy is None:
+            results[copy_id] = {'ok': False, 'error': 'not found'}
+        elif copy.status != REQUIRED_STATUS[action]:
+            results[copy_id] = {'ok': False, 'error': 'status is %s' % copy.get_status_display()}
+        elif expected.get(copy_id, copy.version) != copy.version:
+            results[copy_id] = {'ok': False, 'error': 'changed since read', 'version': copy.version}
+        else:
+            eligible.append(copy)
+
+    if action == CHECKOUT:
+        granted = limits.take_loans(borrower, len(eligible))
+        for copy in eligible[granted:]:
+            results[copy.pk] = {'ok': False, 'error': 'loan limit reached'}
+        eligible = eligible[:granted]
+
+    values = _new_values(action, borrower, due_back)
+    if eligible:
+        updated = sum(
+            BookInstance.objects.filter(condition).update(version=F('version') + 1, **values)
+            for condition in _at_versions(eligible)
+        )
+        if updated != len(eligible):
+            # Only possible where the database ignores select_for_update(); nothing of the batch is kept.
+            raise BatchError('Copies changed while the batch was processed, retry it')
+        if action == RETURN:
+            returned = Counter(copy.borrower_id for copy in eligible)
+            limits.adjust_counters({borrower_id: -count for borrower_id, count in returned.items()})
+        loans.invalidate_loans([borrower and borrower.pk] + [copy.borrower_id for copy in eligible])
+        now = timezone.now()
+        messages = []
+        for copy in eligible:
+            old_borrower_id = copy.borrower_id
+            for name, value in values.items():
+                setattr(copy, name, value)
+            copy.version += 1
+            copy.remember_tracked_values()
+            messages.extend(live.copy_messages(copy, old_borrower_id))
+        events.record(*(events.build_event(copy, EVENT_KIND[action], now) for copy in eligible))
+        facets.availability_changed(copy.book_id for copy in eligible)
+        live.publish_on_commit(messages)
+
+    for copy in eligible:
+        results[copy.pk] = {
+            'ok': True,
+            'status': copy.status,
+            'due_back': copy.due_back.isoformat() if copy.due_back else None,
+            'version': copy.version,
+        }
+    return {
+        raw_id: {'ok': False, 'error': 'invalid id'} if copy_id is None else results[copy_id]
+        for raw_id, copy_id in parsed.items()
+    }
+
+
+def process_batch(batch_key, action, copy_ids, user=None, borrower=None, due_back=None, versions=None):
+    """
+    Processes a batch exactly once per `batch_key` of `user`. Returns (response, replayed).
+    Raises BatchError when the key was already used for a different action or different copies.
+    """
+    if not batch_key or len(batch_key) > MAX_BATCH_KEY_LENGTH:
+        raise BatchError('The batch key must have 1 to %d characters' % MAX_BATCH_KEY_LENGTH)
+    stored_key = '%s:%s' % (user.pk if user is not None else '', batch_key)
+    stored = CirculationBatch.objects.filter(batch_key=stored_key).values_list('response', flat=True).first()
+    if stored is not None:
+        return _replay(stored, action, copy_ids), True
+    try:
+        with transaction.atomic():
+            batch = CirculationBatch.objects.create(batch_key=stored_key, action=action, user=user)
+            batch.response = {
+                'batch_key': batch_key,
+                'action': action,
+                'results': apply_batch(action, copy_ids, borrower, due_back, versions),
+            }
+            batch.save(update_fields=['response'])
+    except IntegrityError:
+        # A concurrent request with the same key won; its response is committed by now.
+        return _replay(CirculationBatch.objects.get(batch_key=stored_key).response, action, copy_ids), True
+    return batch.response, False
+
+
+def _replay(response, action, copy_ids):
+    if response['action'] != action or set(response['results']) != set(map(str, copy_ids)):
+        raise BatchError('The batch key was already used for a different batch')
+    return response
@@ -0,0 +1,64 @@
+"""
+Append-only circulation event log.
+
+Changes to BookInstance are turned into LoanEvent rows, written in the same
+transaction as the change they record (BookInstance.save() wraps the save and
+its post_save handlers in one), so a change is never committed without its
+event nor an event without its change. Circulation batches record all events
+of a batch with one bulk insert.
+"""
+from django.utils import timezone
+
+from .models import LoanEvent
+
+
+def classify_change(old, new):
+    """
+    Returns the LoanEvent kind for a change of tracked values (None if nothing to log).
+    `old` is None for a copy that did not exist before.
+    """
+    old = old or {}
+    old_status = old.get('status')
+    new_status = new.get('status')
+
+    if new_status == 'o':
+        if old_status != 'o' or old.get('borrower_id') != new.get('borrower_id'):
+            return LoanEvent.CHECKOUT
+        if old.get('due_back') != new.get('due_back'):
+            return LoanEvent.RENEWAL
+        return None
+    if old_status == 'o':
+        return LoanEvent.RETURN
+    if old and old_status != new_status:
+        return LoanEvent.STATUS_CHANGE
+    return None
+
+
+def build_event(book_instance, kind, when=None):
+    return LoanEvent(
+        created=when or timezone.now(),
+        kind=kind,
+        book_instance_id=book_instance.id,
+        book_id=book_instance.book_id,
+        borrower_id=book_instance.borrower_id,
+        status=book_instance.status,
+        due_back=book_instance.due_back,
+    )
+
+
+def record_change(book_instance, old):
+    """
+    Logs the change of `book_instance` relative to the `old` tracked values, if it is a circulation event.
+    """
+    new = {name: getattr(book_instance, name) for name in book_instance.TRACKED_FIELDS}
+    kind = classify_change(old, new)
+    if kind is not None:
+        record(build_event(book_instance, kind))
+
+
+def record(*events):
+    """
+    Inserts events, in the transaction of the change they record.
+    """
+    if events:
+        LoanEvent.objects.bulk_create(events, batch_size=500)
@@ -0,0 +1,138 @@
+"""
+Genre/author/availability filters and facet counts for the book list.
+
+Facet counts for a filter combination are computed with one grouped query
+per facet (each facet has its own GROUP BY and LIMIT, which SQLite does not
+allow inside one compound query) and cached under the "facets" version,
+bumped when books, their genres or genre names change.
+
+Copy availability changes with every checkout and return, so it has its own
+versions, bumped by availability_changed(): "availability" for everything
+filtered on availability and "copies:<book id>" for the pages of one book.
+The genre and author counts of the unfiltered combinations do not depend on
+availability and stay cached; the "available now" count of those is kept
+for AVAILABLE_COUNT_TIMEOUT instead of being recounted after every loan.
+"""
+from django.core.cache import cache
+from django.db.models import Count, Exists, OuterRef
+
+from .cache import bump_versions_on_commit, get_versions, versioned_key
+from .genres import genre_names
+from .models import Author, Book, BookInstance
+
+VERSION_NAME = 'facets'
+
+AVAILABILITY_VERSION_NAME = 'availability'
+
+# Only the most frequent options of a facet are shown, however many genres or authors exist.
+FACET_LIMIT = 20
+
+FACET_TIMEOUT = 60 * 60
+
+AVAILABLE_COUNT_TIMEOUT = 60
+
+
+def copies_version_name(book_id):
+    return 'copies:%s' % book_id
+
+
+def availability_changed(book_ids):
+    """
+    Invalidates what shows the availability of copies of `book_ids` (None entries are ignored)
+    once the current transaction commits, so a request reading in the meantime cannot cache the old counts
+    under the new versions.
+    """
+    bump_versions_on_commit(
+        [AVAILABILITY_VERSION_NAME] + [copies_version_name(book_id) for book_id in set(book_ids) - {None}]
+    )
+
+
+def _int_or_none(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_filters(params, branch=None):
+    """
+    Returns the {'genre', 'author', 'available', 'branch'} filters of a request's GET parameters;
+    availability is scoped to `branch` when one is selected.
+    """
+    return {
+        'genre': _int_or_none(params.get('genre')),
+        'author': _int_or_none(params.get('author')),
+        'available': params.get('available') == '1',
+        'branch': branch.pk if branch is not None else None,
+    }
+
+
+def available_copies(branch_id=None):
+    copies = BookInstance.objects.filter(book=OuterRef('pk'), status__exact='a')
+    if branch_id is not None:
+        copies = copies.filter(branch_id=branch_id)
+    return copies
+
+
+def filter_books(queryset, filters):
+    if filters['genre'] is not None:
+        queryset = queryset.filter(genre=filters['genre'])
+    if filters['author'] is not None:
+        queryset = queryset.filter(author=filters['author'])
+    if filters['available']:
+        queryset = queryset.filter(Exists(available_copies(filters['branch'])))
+    return queryset
+
+
+def facet_counts(filters):
+    """
+    Returns the facet options (with book counts) for the books matching `filters`, cached per combination.
+    """
+    combination = (filters['genre'], filters['author'], int(filters['available']), filters['branch'])
+    if filters['available']:
+        key = 'catalog:facets:%s:%s:%s:%s:%s:%s' % (
+            *get_versions(VERSION_NAME, AVAILABILITY_VERSION_NAME), *combination
+        )
+        facets = cache.get(key)
+        if facets is None:
+            facets = _compute_facets(filters)
+            facets['available'] = _available_count(filters)
+            cache.set(key, facets, FACET_TIMEOUT)
+        return facets
+
+    key = versioned_key(VERSION_NAME, *combination)
+    facets = cache.get(key)
+    if facets is None:
+        facets = _compute_facets(filters)
+        cache.set(key, facets, FACET_TIMEOUT)
+    available_key = versioned_key(VERSION_NAME, 'available', *combination)
+    available = cache.get(available_key)
+    if available is None:
+        available = _available_count(filters)
+        cache.set(available_key, available, AVAILABLE_COUNT_TIMEOUT)
+    return dict(facets, available=available)
+
+
+def _available_count(filters):
+    return filter_books(Book.objects.all(), filters).filter(Exists(available_copies(filters['branch']))).count()
+
+
+def _compute_facets(filters):
+    books = filter_books(Book.objects.all(), filters)
+
+    genre_rows = list(
+        Book.genre.through.objects.filter(book__in=books.values('pk'))
+        .values('genre_id').annotate(count=Count('book_id')).order_by('-count', 'genre_id')[:FACET_LIMIT]
+    )
+    names = genre_names()
+
+    author_rows = list(
+        books.exclude(author__isnull=True)
+        .values('author_id').annotate(count=Count('pk')).order_by('-count', 'author_id')[:FACET_LIMIT]
+    )
+    authors = Author.objects.in_bulk([row['author_id'] for row in author_rows])
+
+    return {
+        'genre': [(row['genre_id'], names.get(row['genre_id'], ''), row['count']) for row in genre_rows],
+        'author': [(row['author_id'], str(authors.get(row['author_id'], '')), row['count']) for row in author_rows],
+    }
@@ -6,6 +6,9 @@ import datetime
 
 class RenewBookForm(forms.Form):
     renewal_date = forms.DateField(help_text="Enter a date between now and 4 weeks (default 3).")
+    # The copy's version when the form was shown, and a key that makes a repeated submit harmless.
+    version = forms.IntegerField(widget=forms.HiddenInput, required=False, min_value=0)
+    token = forms.CharField(widget=forms.HiddenInput, required=False, max_length=64)
 
     def clean_renewal_date(self):
         data = self.cleaned_data['renewal_date']
@@ -0,0 +1,68 @@
+"""
+Process-wide registry of genre names.
+
+Genres are few and rarely change, so every process loads the whole
+{pk: name} table once and keeps it until the "genres" cache version is
+bumped by a Genre save or delete (in any process). Genre names of books are
+then resolved from the Book.genre through table alone, without joining
+catalog_genre.
+"""
+import threading
+
+from .cache import get_version
+from .models import Book, Genre
+
+VERSION_NAME = 'genres'
+
+_lock = threading.Lock()
+_state = {'names': None, 'version': None}
+
+
+def genre_names():
+    """
+    Returns the {pk: name} mapping of all genres.
+    """
+    version = get_version(VERSION_NAME)
+    names = _state['names']
+    if names is not None and _state['version'] == version:
+        return names
+    with _lock:
+        if _state['names'] is names:
+            _state['names'] = dict(Genre.objects.values_list('pk', 'name'))
+            _state['version'] = version
+        return _state['names']
+
+
+def sorted_genres():
+    """
+    Returns (pk, name) pairs of all genres ordered by name.
+    """
+    return sorted(genre_names().items(), key=lambda item: item[1])
+
+
+def names_by_book(book_ids):
+    """
+    Returns {book pk: [genre names]} for `book_ids` with one query on the through table.
+    """
+    names = genre_names()
+    result = {book_id: [] for book_id in book_ids}
+    rows = Book.genre.through.objects.filter(book_id__in=list(result)).order_by('id').values_list('book_id', 'genre_id')
+    for book_id, genre_id in rows:
+        if genre_id in names:
+            result[book_id].append(names[genre_id])
+    return result
+
+
+def attach_genre_names(books):
+    """
+    Sets `genre_names` on each of `books`; Book.display_genre() then needs no query.
+    """
+    books = list(books)
+    by_book = names_by_book([book.pk for book in books])
+    for book in books:
+        book.genre_names = by_book[book.pk]
+    return books
+
+
+def reset():
+    _state.update(names=None, version=None)
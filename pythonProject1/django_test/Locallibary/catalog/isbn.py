@@ -0,0 +1,49 @@
+"""
+ISBN-10/ISBN-13 normalization and checksum validation.
+
+Every valid ISBN is normalized to its 13 digit form (ISBN-10 gets the 978
+prefix and a recomputed check digit), which is what Book.isbn13 stores and
+what all lookups use.
+"""
+import re
+
+from django.core.exceptions import ValidationError
+from django.utils.translation import gettext_lazy as _
+
+SEPARATORS_RE = re.compile(r'[\s-]')
+
+
+def isbn10_is_valid(digits):
+    if not re.fullmatch(r'\d{9}[\dX]', digits):
+        return False
+    total = sum((10 - position) * (10 if char == 'X' else int(char)) for position, char in enumerate(digits))
+    return total % 11 == 0
+
+
+def isbn13_check_digit(first_twelve):
+    total = sum(int(char) * (3 if position % 2 else 1) for position, char in enumerate(first_twelve))
+    return str((10 - total % 10) % 10)
+
+
+def isbn13_is_valid(digits):
+    return bool(re.fullmatch(r'97[89]\d{10}', digits)) and isbn13_check_digit(digits[:12]) == digits[12]
+
+
+def normalize_isbn(value):
+    """
+    Returns the ISBN-13 form of an ISBN-10 or ISBN-13 (hyphens and spaces allowed), or None if it is not valid.
+    """
+    if not value:
+        return None
+    digits = SEPARATORS_RE.sub('', str(value)).upper()
+    if len(digits) == 10 and isbn10_is_valid(digits):
+        first_twelve = '978' + digits[:9]
+        return first_twelve + isbn13_check_digit(first_twelve)
+    if len(digits) == 13 and isbn13_is_valid(digits):
+        return digits
+    return None
+
+
+def validate_isbn(value):
+    if value and normalize_isbn(value) is None:
+        raise ValidationError(_('%(value)s is not a valid ISBN-10 or ISBN-13'), params={'value': value})
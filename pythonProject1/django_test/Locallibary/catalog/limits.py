@@ -0,0 +1,131 @@
+"""
+Borrowing limits.
+
+LoanLimit sets how many copies the members of a group may have on loan at
+once (the highest limit of the user's groups applies, else the default
+limit, else there is none). Counting the user's loans on every checkout
+would scan BookInstance and race with concurrent checkouts, so LoanCounter
+keeps each user's number of copies on loan: a checkout takes its loans with
+one conditional UPDATE ... SET active_loans = active_loans + n WHERE
+active_loans <= limit - n, which checks and increments atomically in the
+database, and a return gives them back.
+
+Circulation batches take and give back loans themselves. Changes saved on a
+copy elsewhere (the admin, for instance) are counted by the post_save signal
+without checking the limit. A missing counter row is created from the
+user's copies on loan; refresh_counters() recounts from BookInstance.
+"""
+from django.db import transaction
+from django.db.models import Case, Count, F, Q, When
+from django.db.models.functions import Greatest
+
+from .models import BookInstance, LoanCounter, LoanLimit
+
+
+def loan_limit(user):
+    """
+    Returns the maximum number of concurrent loans of `user`, or None for no limit.
+    """
+    limits = dict(
+        LoanLimit.objects.filter(Q(group__isnull=True) | Q(group__user=user)).values_list('group_id', 'max_loans')
+    )
+    group_limits = [max_loans for group_id, max_loans in limits.items() if group_id is not None]
+    return max(group_limits) if group_limits else limits.get(None)
+
+
+def _loans_by_borrower(borrower_ids):
+    return dict(
+        BookInstance.objects.filter(borrower_id__in=borrower_ids, status='o')
+        .values('borrower_id').annotate(loans=Count('id')).order_by().values_list('borrower_id', 'loans')
+    )
+
+
+def _create_counters(borrower_ids):
+    """
+    Creates the missing counters of `borrower_ids` from their copies on loan. Returns the ids that had a counter.
+    """
+    existing = set(LoanCounter.objects.filter(borrower_id__in=borrower_ids).values_list('borrower_id', flat=True))
+    missing = set(borrower_ids) - existing
+    if missing:
+        loans = _loans_by_borrower(missing)
+        LoanCounter.objects.bulk_create(
+            [LoanCounter(borrower_id=borrower_id, active_loans=loans.get(borrower_id, 0)) for borrower_id in missing],
+            ignore_conflicts=True,
+        )
+    return existing
+
+
+def _take(borrower_id, count, limit):
+    counters = LoanCounter.objects.filter(borrower_id=borrower_id)
+    if limit is not None:
+        counters = counters.filter(active_loans__lte=limit - count)
+    return counters.update(active_loans=F('active_loans') + count) == 1
+
+
+def take_loans(borrower, count):
+    """
+    Counts up to `count` new loans of `borrower` within their limit. Returns the number counted; the caller lends
+    that many copies (in the same transaction) and no more.
+    """
+    if count <= 0:
+        return 0
+    limit = loan_limit(borrower)
+    if _take(borrower.pk, count, limit):
+        return count
+    if borrower.pk not in _create_counters([borrower.pk]) and _take(borrower.pk, count, limit):
+        return count
+    if limit is None:
+        return 0
+    # Not enough room for all of them: take what is left, again with a single conditional update.
+    active = LoanCounter.objects.filter(borrower_id=borrower.pk).values_list('active_loans', flat=True).first()
+    room = limit - (active or 0)
+    if room > 0 and _take(borrower.pk, room, limit):
+        return room
+    return 0
+
+
+def adjust_counters(changes):
+    """
+    Applies {borrower id: change in loans} to the counters with one UPDATE, without checking limits.
+    Must be called after the copies changed: counters created here are counted from them.
+    """
+    changes = {borrower_id: change for borrower_id, change in changes.items() if borrower_id is not None and change}
+    if not changes:
+        return
+    existing = _create_counters(list(changes))
+    if existing:
+        LoanCounter.objects.filter(borrower_id__in=existing).update(active_loans=Greatest(
+            Case(*[When(borrower_id=borrower_id, then=F('active_loans') + changes[borrower_id])
+                   for borrower_id in existing]),
+            0,
+        ))
+
+
+def copy_changed(old, copy):
+    """
+    Counts a saved change of a copy; `old` are its previous tracked values (None for a new copy).
+    """
+    changes = {}
+    if old and old.get('status') == 'o' and old.get('borrower_id') is not None:
+        changes[old['borrower_id']] = -1
+    if copy.status == 'o' and copy.borrower_id is not None:
+        changes[copy.borrower_id] = changes.get(copy.borrower_id, 0) + 1
+    adjust_counters(changes)
+
+
+def refresh_counters(borrower_ids=None):
+    """
+    Recounts the loans of `borrower_ids` (of everyone when None) from BookInstance.
+    """
+    copies = BookInstance.objects.filter(status='o', borrower__isnull=False)
+    counters = LoanCounter.objects.all()
+    if borrower_ids is not None:
+        copies = copies.filter(borrower_id__in=borrower_ids)
+        counters = counters.filter(borrower_id__in=borrower_ids)
+    with transaction.atomic():
+        counters.update(active_loans=0)
+        LoanCounter.objects.bulk_create(
+            (LoanCounter(borrower_id=row['borrower_id'], active_loans=row['loans'])
+             for row in copies.values('borrower_id').annotate(loans=Count('id')).order_by()),
+            update_conflicts=True, unique_fields=['borrower'], update_fields=['active_loans'], batch_size=5000,
+        )
@@ -0,0 +1,148 @@
+"""
+Live copy availability for Server-Sent Events streams.
+
+Copy changes are published, after their transaction commits, to an
+in-process broker under the topics "book:<pk>" and "user:<borrower pk>".
+Each SSE connection is a coroutine waiting on an asyncio queue, so under
+ASGI thousands of idle clients cost no threads: publishing groups the
+subscribers by event loop and hands each loop its whole batch of messages
+with a single call_soon_threadsafe.
+
+The broker is per process, so with several server processes a client only
+sees changes saved by the process it is connected to (and circulation
+tasks run by workers are not seen at all). Clients are expected to reload
+when they receive a "reload" event, which is also sent when a slow client
+falls too far behind.
+"""
+import asyncio
+import threading
+from collections import defaultdict
+from functools import partial
+
+from django.db import transaction
+
+from .models import BookInstance
+
+# Messages kept for a client that does not read them; after that it is asked to reload.
+MAX_PENDING = 100
+
+STATUS_DISPLAY = dict(BookInstance.LOAN_STATUS)
+
+
+def book_topic(book_id):
+    return 'book:%s' % book_id
+
+
+def user_topic(user_id):
+    return 'user:%s' % user_id
+
+
+class Subscription:
+    """
+    The queue of messages for one client, fed from any thread and read on its event loop.
+    """
+    def __init__(self, broker, topics, loop):
+        self.broker = broker
+        self.topics = topics
+        self.loop = loop
+        self.queue = asyncio.Queue(MAX_PENDING)
+        self.overflowed = False
+
+    def deliver(self, message):
+        """
+        Queues `message`; runs on the subscription's event loop.
+        """
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.overflowed = True
+            # Make room for the end-of-stream marker so a waiting get() wakes up.
+            self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+    async def get(self):
+        """
+        Returns the next message, or None when the client has to reload.
+        """
+        return await self.queue.get()
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class Broker:
+    """
+    Topic based publish/subscribe between the threads saving copies and the event loops streaming them.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._topics = defaultdict(set)
+
+    def subscribe(self, *topics, loop=None):
+        subscription = Subscription(self, topics, loop or asyncio.get_running_loop())
+        with self._lock:
+            for topic in topics:
+                self._topics[topic].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for topic in subscription.topics:
+                subscribers = self._topics.get(topic)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._topics[topic]
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(set().union(*self._topics.values()))
+
+    def publish(self, messages):
+        """
+        Delivers (topic, message) pairs to their subscribers. Safe to call from any thread.
+        """
+        by_loop = defaultdict(list)
+        with self._lock:
+            for topic, message in messages:
+                for subscription in self._topics.get(topic, ()):
+                    by_loop[subscription.loop].append((subscription, message))
+        for loop, deliveries in by_loop.items():
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(_deliver_all, deliveries)
+
+
+def _deliver_all(deliveries):
+    for subscription, message in deliveries:
+        subscription.deliver(message)
+
+
+broker = Broker()
+
+
+def copy_messages(book_instance, old_borrower_id=None):
+    """
+    Returns the (topic, message) pairs announcing the current state of a copy.
+    """
+    message = {
+        'copy': str(book_instance.pk),
+        'book': book_instance.book_id,
+        'status': book_instance.status,
+        'status_display': STATUS_DISPLAY.get(book_instance.status, ''),
+        'due_back': book_instance.due_back.isoformat() if book_instance.due_back else None,
+    }
+    messages = [(book_topic(book_instance.book_id), message)]
+    # A returned copy also leaves the loans of its previous borrower.
+    for user_id in {book_instance.borrower_id, old_borrower_id} - {None}:
+        messages.append((user_topic(user_id), message))
+    return messages
+
+
+def publish_on_commit(messages):
+    """
+    Publishes `messages` once the current transaction commits (immediately outside one).
+    """
+    if messages:
+        transaction.on_commit(partial(broker.publish, messages))
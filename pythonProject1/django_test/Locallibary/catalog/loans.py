@@ -0,0 +1,31 @@
+"""
+Versions of the cached pages about a user's loans (see @user_page in catalog/pagecache.py).
+
+The modules that change loans or fines invalidate those pages through here
+rather than through pagecache, which itself depends on some of them. The
+versions are bumped once the current transaction commits: bumped earlier, a
+concurrent request could cache the page from the rows not yet committed
+under the new version, and keep serving it.
+"""
+from .cache import bump_versions_on_commit
+
+# Bumped by the nightly fines run, which changes the balances of many users at once.
+FINES_VERSION_NAME = 'fines'
+
+
+def loans_version_name(user_id):
+    return 'loans:%s' % user_id
+
+
+def invalidate_loans(user_ids):
+    """
+    Invalidates the cached loan pages of `user_ids` (None entries are ignored) when the transaction commits.
+    """
+    bump_versions_on_commit(loans_version_name(user_id) for user_id in set(user_ids) - {None})
+
+
+def invalidate_fines():
+    """
+    Invalidates the cached loan pages of all users when the transaction commits.
+    """
+    bump_versions_on_commit([FINES_VERSION_NAME])
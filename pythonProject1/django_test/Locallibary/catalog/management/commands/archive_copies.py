@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from catalog import archive
+from catalog.models import ArchivedBookInstance, BookInstance
+
+
+class Command(BaseCommand):
+    help = (
+        'Moves copies matching the archive policy (see catalog/archive.py) out of the circulation table, '
+        'or with --restore moves archived copies back.'
+    )
+
+    def add_arguments(self, parser):
+        statuses = [code for code, _ in BookInstance.LOAN_STATUS if code != 'o']
+        parser.add_argument('--status', action='append', choices=statuses,
+                            help='Archive copies with this status (repeatable; default: maintenance).')
+        parser.add_argument('--idle-days', type=int, default=None,
+                            help='Days without loan events before a copy is archived (default: ARCHIVE_IDLE_DAYS).')
+        parser.add_argument('--batch-size', type=int, default=archive.BATCH_SIZE)
+        parser.add_argument('--dry-run', action='store_true', help='Only count the matching copies.')
+        parser.add_argument('--restore', nargs='+', metavar='COPY_ID', help='Restore these archived copies.')
+
+    def handle(self, *args, **options):
+        if options['restore']:
+            restored = archive.restore_copies(ArchivedBookInstance.objects.filter(pk__in=options['restore']))
+            self.stdout.write(self.style.SUCCESS('Restored %d copies.' % restored))
+            return
+        statuses = options['status'] or ['m']
+        if options['dry_run']:
+            count = archive.archivable(statuses, options['idle_days']).count()
+            self.stdout.write(self.style.SUCCESS('%d copies match the archive policy.' % count))
+            return
+        archived = archive.archive_matching(statuses, options['idle_days'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('Archived %d copies.' % archived))
@@ -0,0 +1,65 @@
+import datetime
+import random
+import time
+import uuid
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from catalog.fines import compute_fines
+from catalog.models import Book, BookInstance, Fine, FineRate, Genre
+
+
+class Command(BaseCommand):
+    help = 'Measures the nightly fines run on synthetic overdue loans (all created data is rolled back).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loans', type=int, default=1000000)
+        parser.add_argument('--books', type=int, default=10000)
+        parser.add_argument('--users', type=int, default=20000)
+
+    def handle(self, *args, **options):
+        rng = random.Random(42)
+        today = datetime.date.today()
+        with transaction.atomic():
+            genres = Genre.objects.bulk_create([Genre(name='Bench genre %d' % number) for number in range(10)])
+            FineRate.objects.bulk_create(
+                [FineRate(daily_rate='0.25', grace_days=2, max_fine='20.00')]
+                + [FineRate(genre=genre, daily_rate='0.50', grace_days=0, max_fine='30.00') for genre in genres[:3]]
+            )
+            books = Book.objects.bulk_create(
+                [Book(title='Bench %d' % number, summary='', isbn13='bench%d' % number)
+                 for number in range(options['books'])],
+                batch_size=2000,
+            )
+            Book.genre.through.objects.bulk_create(
+                [Book.genre.through(book_id=book.pk, genre_id=rng.choice(genres).pk) for book in books],
+                batch_size=5000,
+            )
+            users = User.objects.bulk_create(
+                [User(username='bench-%d' % number) for number in range(options['users'])], batch_size=2000
+            )
+            for start in range(0, options['loans'], 50000):
+                BookInstance.objects.bulk_create(
+                    [BookInstance(id=uuid.uuid4(), book_id=rng.choice(books).pk, imprint='', status='o',
+                                  borrower_id=rng.choice(users).pk,
+                                  due_back=today - datetime.timedelta(days=rng.randint(1, 120)))
+                     for _ in range(min(50000, options['loans'] - start))],
+                    batch_size=5000,
+                )
+
+            started = time.perf_counter()
+            written = compute_fines(today)
+            first_run = time.perf_counter() - started
+
+            started = time.perf_counter()
+            compute_fines(today + datetime.timedelta(days=1))
+            second_run = time.perf_counter() - started
+
+            self.stdout.write(self.style.SUCCESS(
+                '%d overdue loans: %d fines in %.1fs, next night (upserts) %.1fs; %d fines in the ledger' % (
+                    options['loans'], written, first_run, second_run, Fine.objects.count(),
+                )
+            ))
+            transaction.set_rollback(True)
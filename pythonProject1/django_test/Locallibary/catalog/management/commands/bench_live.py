@@ -0,0 +1,97 @@
+import asyncio
+import statistics
+import threading
+import time
+import tracemalloc
+
+from asgiref.sync import sync_to_async
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from catalog import live
+from catalog.asgi import StreamingASGIHandler
+from catalog.models import Book
+
+
+class Command(BaseCommand):
+    help = (
+        'Opens many idle availability streams against the ASGI application in-process and measures '
+        'memory per connection and the latency of fanning status changes out to all of them.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=5000)
+        parser.add_argument('--updates', type=int, default=20)
+
+    def handle(self, *args, **options):
+        book = Book.objects.order_by('pk').first()
+        if book is None:
+            raise CommandError('The catalog has no books to stream.')
+        path = reverse('book-availability-stream', args=[book.pk])
+        asyncio.run(self.bench(StreamingASGIHandler(), path, book.pk, options['clients'], options['updates']))
+
+    async def bench(self, app, path, book_id, clients, updates):
+        arrivals = [[] for _ in range(updates)]
+        delivered = [asyncio.Event() for _ in range(updates)]
+        disconnect = asyncio.Event()
+        threads_before = threading.active_count()
+
+        def connect():
+            body_sent = False
+
+            async def receive():
+                nonlocal body_sent
+                if not body_sent:
+                    body_sent = True
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+                await disconnect.wait()
+                return {'type': 'http.disconnect'}
+            return asyncio.ensure_future(app(dict(scope), receive, send))
+
+        async def send(message):
+            if message['type'] == 'http.response.body' and message['body'].startswith(b'event: copy'):
+                n = int(message['body'].rsplit(b'"n": ', 1)[1].split(b'}', 1)[0])
+                arrivals[n].append(time.perf_counter())
+                if len(arrivals[n]) == clients:
+                    delivered[n].set()
+
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+            'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '',
+            'headers': [(b'host', b'localhost'), (b'accept', b'text/event-stream')],
+            'server': ('127.0.0.1', 8000), 'client': ('127.0.0.1', 50000),
+        }
+
+        tracemalloc.start()
+        started = time.perf_counter()
+        connections = [connect() for _ in range(clients)]
+        while live.broker.subscriber_count() < clients:
+            await asyncio.sleep(0.05)
+        connect_seconds = time.perf_counter() - started
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        threads = threading.active_count() - threads_before
+
+        topic = live.book_topic(book_id)
+        fan_out = []
+        client_latencies = []
+        for n in range(updates):
+            published = time.perf_counter()
+            # Published from a worker thread, as a request saving a copy would.
+            await sync_to_async(live.broker.publish, thread_sensitive=False)([(topic, {'n': n})])
+            await delivered[n].wait()
+            fan_out.append((arrivals[n][-1] - published) * 1000)
+            client_latencies.extend((arrival - published) * 1000 for arrival in arrivals[n])
+        client_latencies.sort()
+
+        disconnect.set()
+        await asyncio.gather(*connections)
+
+        self.stdout.write(self.style.SUCCESS(
+            '%d streams: connected in %.1fs, %.1f KB per stream, %d extra threads; '
+            'per-client latency p50 %.1f ms, p99 %.1f ms; full fan-out p50 %.1f ms, max %.1f ms' % (
+                clients, connect_seconds, memory / clients / 1024, threads,
+                statistics.median(client_latencies), client_latencies[int(len(client_latencies) * 0.99) - 1],
+                statistics.median(fan_out), max(fan_out),
+            )
+        ))
@@ -0,0 +1,61 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from catalog.models import Book, Genre
+from catalog.similarity import build_similarity, similar_books
+
+
+class Command(BaseCommand):
+    help = ('Measures "more like this" query latency on synthetic books '
+            '(created in a transaction that is rolled back).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, nargs='+', default=[100000, 1000000],
+                            help='Catalog sizes to benchmark.')
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--vocabulary', type=int, default=20000)
+        parser.add_argument('--genres', type=int, default=20,
+                            help='Genres assigned to the books (one or two each), as in a real catalog.')
+
+    def handle(self, *args, **options):
+        rng = random.Random(42)
+        words = ['word%05d' % number for number in range(options['vocabulary'])]
+        for size in options['books']:
+            with transaction.atomic():
+                books = Book.objects.bulk_create(
+                    (Book(title='Book %d' % number, summary=' '.join(rng.choices(words, k=60)))
+                     for number in range(size)),
+                    batch_size=5000,
+                )
+                genres = Genre.objects.bulk_create(
+                    [Genre(name='Bench genre %d' % number) for number in range(options['genres'])]
+                )
+                if genres:
+                    Book.genre.through.objects.bulk_create(
+                        (Book.genre.through(book_id=book.pk, genre_id=genre.pk)
+                         for book in books for genre in rng.sample(genres, rng.randint(1, min(2, len(genres))))),
+                        batch_size=5000,
+                    )
+                started = time.perf_counter()
+                build_similarity()
+                build_seconds = time.perf_counter() - started
+
+                ids = list(Book.objects.values_list('id', flat=True))
+                timings = []
+                for book in Book.objects.in_bulk(rng.sample(ids, min(options['queries'], len(ids)))).values():
+                    started = time.perf_counter()
+                    similar_books(book)
+                    timings.append((time.perf_counter() - started) * 1000)
+                transaction.set_rollback(True)
+
+            timings.sort()
+            self.stdout.write(
+                '%d books: build %.1fs, query p50 %.1f ms, p95 %.1f ms, max %.1f ms' % (
+                    size, build_seconds, statistics.median(timings),
+                    timings[int(len(timings) * 0.95) - 1], timings[-1],
+                )
+            )
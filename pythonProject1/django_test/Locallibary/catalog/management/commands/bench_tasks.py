@@ -0,0 +1,34 @@
+import io
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+from catalog.models import Task
+from catalog.tasks import enqueue, noop
+
+
+class Command(BaseCommand):
+    help = 'Measures task queue throughput with different numbers of worker processes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tasks', type=int, default=2000)
+        parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+        parser.add_argument('--batch-size', type=int, default=10)
+
+    def handle(self, *args, **options):
+        for workers in options['workers']:
+            Task.objects.filter(name=noop.task_name).delete()
+            Task.objects.bulk_create(
+                [Task(name=noop.task_name, args=[number]) for number in range(options['tasks'])],
+                batch_size=1000,
+            )
+            started = time.perf_counter()
+            call_command('run_worker', processes=workers, once=True, batch_size=options['batch_size'],
+                         stdout=io.StringIO())
+            seconds = time.perf_counter() - started
+            done = Task.objects.filter(name=noop.task_name, status=Task.DONE).count()
+            self.stdout.write('%d workers: %d tasks in %.2fs (%.0f tasks/s)' % (
+                workers, done, seconds, done / seconds,
+            ))
+        Task.objects.filter(name=noop.task_name).delete()
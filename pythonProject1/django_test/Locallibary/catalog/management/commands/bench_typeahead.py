@@ -0,0 +1,44 @@
+import random
+import statistics
+import string
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+
+from catalog.typeahead import PrefixIndex
+
+
+class Command(BaseCommand):
+    help = 'Measures build time, memory and prefix query latency of the typeahead index on synthetic titles.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--titles', type=int, default=1000000)
+        parser.add_argument('--queries', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        rng = random.Random(42)
+        words = [''.join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 9))) for _ in range(50000)]
+        titles = [' '.join(rng.choices(words, k=rng.randint(1, 6))).title() for _ in range(options['titles'])]
+
+        tracemalloc.start()
+        started = time.perf_counter()
+        index = PrefixIndex((title, pk) for pk, title in enumerate(titles, start=1))
+        build_seconds = time.perf_counter() - started
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        timings = []
+        for title in rng.choices(titles, k=options['queries']):
+            prefix = title[:rng.randint(1, 8)]
+            started = time.perf_counter()
+            index.search(prefix)
+            timings.append((time.perf_counter() - started) * 1000000)
+        timings.sort()
+
+        self.stdout.write(
+            '%d entries: build %.1fs, %.0f MB, query p50 %.0f us, p99 %.0f us, max %.0f us' % (
+                len(index), build_seconds, memory / 1024 / 1024, statistics.median(timings),
+                timings[int(len(timings) * 0.99) - 1], timings[-1],
+            )
+        )
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from catalog.recommendations import TOP_K, build_recommendations
+
+
+class Command(BaseCommand):
+    help = 'Refreshes the "patrons who borrowed this also borrowed" table from the circulation event log.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help='Recompute every book instead of only those touched by new checkouts.')
+        parser.add_argument('--top-k', type=int, default=TOP_K,
+                            help='Number of neighbours kept per book.')
+
+    def handle(self, *args, **options):
+        written = build_recommendations(full=options['full'], top_k=options['top_k'])
+        self.stdout.write(self.style.SUCCESS('Wrote %d recommendations.' % written))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from catalog.similarity import build_similarity
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the "more like this" postings and term document frequencies for all books.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help='Number of books vectorized per query.')
+
+    def handle(self, *args, **options):
+        indexed = build_similarity(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS('Indexed %d books.' % indexed))
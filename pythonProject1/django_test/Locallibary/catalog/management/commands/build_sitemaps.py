@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from catalog import sitemaps
+from catalog.views import url_template
+
+
+class Command(BaseCommand):
+    help = 'Writes the sitemap index and gzipped sitemap files of all book and author pages to a directory.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory')
+        parser.add_argument('--base-url', required=True, help='Site root, e.g. https://library.example.com')
+        parser.add_argument('--prefix', default='/sitemaps/',
+                            help='URL path under which the web server serves the directory.')
+
+    def handle(self, *args, **options):
+        base_url = options['base_url'].rstrip('/')
+        templates = {
+            section: base_url + url_template(url_name) for section, (_, url_name) in sitemaps.SECTIONS.items()
+        }
+        written = sitemaps.write_files(options['directory'], base_url, options['prefix'], templates)
+        self.stdout.write(self.style.SUCCESS('Wrote %d sitemap files to %s.' % (written, options['directory'])))
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import (
+    override_settings, setup_databases, setup_test_environment, teardown_databases, teardown_test_environment,
+)
+
+from catalog import querybudget
+
+# The sweep clears the cache before every request; it must not be the shared one.
+SWEEP_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'query-budget'}}
+
+
+class Command(BaseCommand):
+    help = (
+        'Requests every catalog URL against test data seeded at two scales (in a throwaway test database) '
+        'and fails when a query count grows with the data, showing the repeated SQL and where it was triggered.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', type=int, nargs=2, default=querybudget.SCALES, metavar=('SMALL', 'LARGE'))
+        parser.add_argument('--url', action='append', dest='names', help='Only sweep this URL name (repeatable).')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        databases = setup_databases(verbosity=0, interactive=False)
+        try:
+            with override_settings(CACHES=SWEEP_CACHES):
+                results = querybudget.sweep(options['scales'], options['names'])
+        finally:
+            teardown_databases(databases, verbosity=0)
+            teardown_test_environment()
+
+        for name, runs in results.items():
+            self.stdout.write('%-24s %s' % (name, ' -> '.join(
+                '%d queries (HTTP %d)' % (len(log), status) for status, log in runs
+            )))
+        problems = querybudget.failures(results)
+        if problems:
+            raise CommandError('\n\n'.join(problems))
+        self.stdout.write(self.style.SUCCESS('%d URLs swept; no query count grows with the data.' % len(results)))
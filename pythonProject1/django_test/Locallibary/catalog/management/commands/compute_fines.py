@@ -0,0 +1,18 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+
+from catalog.fines import compute_fines
+
+
+class Command(BaseCommand):
+    help = 'Computes the late fees of all overdue loans and refreshes the outstanding balances.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', type=datetime.date.fromisoformat, default=None,
+                            help='Compute the fines as of this date (YYYY-MM-DD) instead of today.')
+        parser.add_argument('--chunk-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        written = compute_fines(options['date'], chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS('Computed %d fines.' % written))
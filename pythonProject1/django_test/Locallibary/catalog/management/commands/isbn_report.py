@@ -0,0 +1,33 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+
+from catalog.isbn import normalize_isbn
+from catalog.models import Book
+
+
+class Command(BaseCommand):
+    help = 'Lists books with invalid ISBNs and groups of books sharing the same normalized ISBN.'
+
+    def handle(self, *args, **options):
+        groups = defaultdict(list)
+        invalid = []
+        books = Book.objects.exclude(isbn__isnull=True).exclude(isbn='').order_by('id')
+        for pk, title, isbn in books.values_list('id', 'title', 'isbn').iterator(chunk_size=5000):
+            isbn13 = normalize_isbn(isbn)
+            if isbn13 is None:
+                invalid.append((pk, title, isbn))
+            else:
+                groups[isbn13].append((pk, title, isbn))
+
+        duplicates = {isbn13: rows for isbn13, rows in groups.items() if len(rows) > 1}
+
+        self.stdout.write('Invalid ISBNs: %d' % len(invalid))
+        for pk, title, isbn in invalid:
+            self.stdout.write('  #%s %s: %r' % (pk, title, isbn))
+
+        self.stdout.write('Duplicated ISBNs: %d' % len(duplicates))
+        for isbn13, rows in sorted(duplicates.items()):
+            self.stdout.write('  %s' % isbn13)
+            for pk, title, isbn in rows:
+                self.stdout.write('    #%s %s (%s)' % (pk, title, isbn))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from catalog.rollups import rollup_loan_events
+
+
+class Command(BaseCommand):
+    help = 'Folds new circulation events into the daily per book/genre/author rollups.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50000,
+                            help='Number of events aggregated per transaction.')
+
+    def handle(self, *args, **options):
+        processed = rollup_loan_events(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('Rolled up %d events.' % processed))
@@ -0,0 +1,42 @@
+import multiprocessing
+import os
+import socket
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+
+def worker_main(name, batch_size, poll_interval, once):
+    django.setup()
+    from catalog.tasks import work
+
+    return work(name, batch_size=batch_size, poll_interval=poll_interval, once=once)
+
+
+class Command(BaseCommand):
+    help = 'Runs task queue workers (see catalog/tasks.py) in a pool of processes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1)
+        parser.add_argument('--batch-size', type=int, default=10,
+                            help='Number of tasks claimed at once by a worker.')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds to wait when no task is due.')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit when no task is due instead of polling forever.')
+
+    def handle(self, *args, **options):
+        prefix = '%s:%s' % (socket.gethostname(), os.getpid())
+        worker_args = [
+            ('%s:%d' % (prefix, number), options['batch_size'], options['poll_interval'], options['once'])
+            for number in range(options['processes'])
+        ]
+        if options['processes'] == 1:
+            processed = [worker_main(*worker_args[0])]
+        else:
+            # Children must not share the parent's database connections.
+            connections.close_all()
+            with multiprocessing.Pool(options['processes']) as pool:
+                processed = pool.starmap(worker_main, worker_args)
+        self.stdout.write(self.style.SUCCESS('Ran %d tasks.' % sum(processed)))
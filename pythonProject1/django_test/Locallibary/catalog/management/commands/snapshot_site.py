@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from catalog import snapshot
+
+
+class Command(BaseCommand):
+    help = (
+        'Renders the index, the book list pages and every book and author page to static HTML files '
+        'in a directory (see catalog/snapshot.py).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory')
+        parser.add_argument('--processes', type=int, default=1)
+        parser.add_argument('--incremental', action='store_true',
+                            help='Re-render only the pages changed since the last snapshot into the directory.')
+        parser.add_argument('--chunk-size', type=int, default=snapshot.CHUNK_SIZE,
+                            help='Books or authors rendered per task.')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        result = snapshot.snapshot(
+            options['directory'], processes=options['processes'], incremental=options['incremental'],
+            chunk_size=options['chunk_size'],
+        )
+        for path in result.failed:
+            self.stderr.write('Failed to render %s' % path)
+        self.stdout.write(self.style.SUCCESS('Rendered %d pages in %.1fs (%d missing, %d failed).' % (
+            result.rendered, time.perf_counter() - started, result.missing, len(result.failed),
+        )))
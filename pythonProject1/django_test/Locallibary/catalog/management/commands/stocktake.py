@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog import stocktake
+from catalog.models import Branch, Stocktake
+
+
+class Command(BaseCommand):
+    help = 'Loads a scan file (one copy UUID per line) into a stocktake, reconciles it and optionally writes the report.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('scan_file')
+        parser.add_argument('--branch', type=int, help='Branch counted (default: the whole library).')
+        parser.add_argument('--stocktake', type=int, help='Add the scans to this stocktake instead of starting one.')
+        parser.add_argument('--report', help='Write the CSV discrepancy report to this file.')
+
+    def handle(self, *args, **options):
+        try:
+            if options['stocktake']:
+                inventory = Stocktake.objects.get(pk=options['stocktake'])
+            else:
+                branch = Branch.objects.get(pk=options['branch']) if options['branch'] else None
+                inventory = Stocktake.objects.create(branch=branch)
+        except (Stocktake.DoesNotExist, Branch.DoesNotExist) as error:
+            raise CommandError(error)
+
+        with open(options['scan_file'], 'rb') as scan_file:
+            stocktake.load_scans(inventory, scan_file)
+        stocktake.reconcile(inventory)
+        if options['report']:
+            with open(options['report'], 'w', newline='', encoding='utf-8') as report:
+                report.writelines(stocktake.report_csv(inventory))
+        self.stdout.write(self.style.SUCCESS(
+            'Stocktake %d: %d scanned (%d invalid lines), %d missing, %d unexpected, %d mismatched.' % (
+                inventory.pk, inventory.scanned, inventory.invalid_lines, inventory.missing, inventory.unexpected,
+                inventory.mismatched,
+            )
+        ))
@@ -0,0 +1,475 @@
+"""
+Operational metrics in the Prometheus text format, served at /metrics.
+
+Requests, their latency and database queries are counted per URL name by
+MetricsMiddleware; cache hits and misses by InstrumentedCache. Every
+thread adds to its own dictionary of samples, so recording takes no lock;
+a scrape sums the dictionaries of all threads.
+
+With METRICS_DIR set (one directory shared by all gunicorn workers), each
+process also writes its samples to <pid>-<start time>.json in that directory
+at most every METRICS_FLUSH_SECONDS and on exit, and a scrape adds up the
+files of all processes. So that counters do not go backwards, the files of
+exited workers are folded into retired.json by the scrape that finds them,
+which keeps the directory at one file per live worker. Empty the directory
+when the service is redeployed.
+
+Metrics are only served to METRICS_ALLOWED_IPS (the Prometheus server;
+none by default, as behind a reverse proxy every request comes from
+loopback) and to staff users.
+
+The circulation gauges are computed by one aggregate query that is cached
+for GAUGE_TIMEOUT seconds and invalidated with the "availability" version, which
+is bumped on every availability change.
+"""
+import atexit
+import datetime
+import json
+import math
+import os
+import threading
+import time
+from collections import defaultdict
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.db import connection
+from django.db.models import Count, Q
+from django.utils.decorators import sync_and_async_middleware
+
+from . import facets
+from .cache import versioned_key
+from .models import BookInstance
+
+REQUESTS = 'catalog_http_requests_total'
+REQUEST_DURATION = 'catalog_http_request_duration_seconds'
+DB_QUERIES = 'catalog_db_queries_total'
+DB_DURATION = 'catalog_db_query_duration_seconds_total'
+CACHE_REQUESTS = 'catalog_cache_requests_total'
+
+METRICS = {
+    REQUESTS: ('counter', 'HTTP requests by URL name, method and status code.'),
+    REQUEST_DURATION: ('histogram', 'Time to produce the response, by URL name.'),
+    DB_QUERIES: ('counter', 'Database queries run while handling requests, by URL name.'),
+    DB_DURATION: ('counter', 'Time spent in database queries while handling requests, by URL name.'),
+    CACHE_REQUESTS: ('counter', 'Cache lookups by result (hit or miss).'),
+}
+
+GAUGES = {
+    'catalog_copies_on_loan': 'Copies currently on loan.',
+    'catalog_copies_overdue': 'Copies on loan past their due date.',
+    'catalog_copies_available': 'Copies available for loan.',
+}
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, math.inf)
+
+GAUGE_TIMEOUT = 60
+
+# Samples of exited processes, merged from their files in METRICS_DIR.
+RETIRED_FILENAME = 'retired.json'
+
+PRUNE_LOCK_FILENAME = 'prune.lock'
+
+PRUNE_LOCK_TIMEOUT = 60
+
+
+class _Samples:
+    """
+    Per-thread samples: {(metric name, labels tuple): value}. Histogram buckets are stored non-cumulative.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._shards = []
+        self._retired = defaultdict(float)
+        self._local = threading.local()
+
+    def shard(self):
+        try:
+            return self._local.samples
+        except AttributeError:
+            samples = self._local.samples = defaultdict(float)
+            with self._lock:
+                self._shards.append((threading.current_thread(), samples))
+            return samples
+
+    def inc(self, name, labels=(), value=1.0):
+        self.shard()[name, labels] += value
+
+    def observe(self, name, labels, value):
+        samples = self.shard()
+        for bound in BUCKETS:
+            if value <= bound:
+                samples[name + '_bucket', labels + (('le', _format_bound(bound)),)] += 1
+                break
+        samples[name + '_sum', labels] += value
+        samples[name + '_count', labels] += 1
+
+    def collect(self):
+        """
+        Returns the sum of the samples of all threads; samples of finished threads are merged once.
+        """
+        total = defaultdict(float)
+        with self._lock:
+            alive = []
+            for thread, samples in self._shards:
+                if thread.is_alive():
+                    alive.append((thread, samples))
+                else:
+                    _add(self._retired, samples)
+            self._shards = alive
+            _add(total, self._retired)
+        for _, samples in alive:
+            _add(total, samples.copy())
+        return total
+
+    def clear(self):
+        with self._lock:
+            for _, samples in self._shards:
+                samples.clear()
+            self._retired.clear()
+
+
+def _add(total, samples):
+    for key, value in samples.items():
+        total[key] += value
+
+
+def _format_bound(bound):
+    return '+Inf' if bound == math.inf else repr(bound)
+
+
+samples = _Samples()
+
+
+def record_request(view, method, status, duration, queries=0, query_time=0.0):
+    labels = (('view', view),)
+    samples.inc(REQUESTS, labels + (('method', method), ('status', str(status))))
+    samples.observe(REQUEST_DURATION, labels, duration)
+    if queries:
+        samples.inc(DB_QUERIES, labels, queries)
+        samples.inc(DB_DURATION, labels, query_time)
+
+
+class _QueryTimer:
+    """
+    Database execute wrapper counting the queries of one request.
+    """
+    def __init__(self):
+        self.queries = 0
+        self.time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.time += time.perf_counter() - started
+
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match is not None else '<unresolved>'
+
+
+@sync_and_async_middleware
+def MetricsMiddleware(get_response):
+    """
+    Records request count, latency and database queries per URL name. Put it first in MIDDLEWARE.
+    """
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            started = time.perf_counter()
+            response = await get_response(request)
+            # Queries of async views run in other threads and are not counted.
+            record_request(_view_name(request), request.method, response.status_code, time.perf_counter() - started)
+            flush()
+            return response
+        return middleware
+
+    def middleware(request):
+        started = time.perf_counter()
+        timer = _QueryTimer()
+        with connection.execute_wrapper(timer):
+            response = get_response(request)
+        record_request(
+            _view_name(request), request.method, response.status_code, time.perf_counter() - started,
+            timer.queries, timer.time,
+        )
+        flush()
+        return response
+    return middleware
+
+
+def _count_lookups(hits, misses):
+    if hits:
+        samples.inc(CACHE_REQUESTS, (('result', 'hit'),), hits)
+    if misses:
+        samples.inc(CACHE_REQUESTS, (('result', 'miss'),), misses)
+
+
+class InstrumentedCache(BaseCache):
+    """
+    Cache backend that counts the hits and misses of another configured cache,
+    whatever its backend: LOCATION names the alias of that cache in CACHES.
+    Keys and versions are passed through unchanged (get_or_set() goes through get()).
+    """
+    _missing = object()
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self._alias = location
+
+    @property
+    def _cache(self):
+        return caches[self._alias]
+
+    def get(self, key, default=None, version=None):
+        value = self._cache.get(key, self._missing, version)
+        if value is self._missing:
+            _count_lookups(0, 1)
+            return default
+        _count_lookups(1, 0)
+        return value
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        found = self._cache.get_many(keys, version)
+        _count_lookups(len(found), len(keys) - len(found))
+        return found
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        return self._cache.add(key, value, timeout, version)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        return self._cache.set(key, value, timeout, version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        return self._cache.set_many(data, timeout, version)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self._cache.touch(key, timeout, version)
+
+    def delete(self, key, version=None):
+        return self._cache.delete(key, version)
+
+    def delete_many(self, keys, version=None):
+        return self._cache.delete_many(keys, version)
+
+    def has_key(self, key, version=None):
+        return self._cache.has_key(key, version)
+
+    def incr(self, key, delta=1, version=None):
+        return self._cache.incr(key, delta, version)
+
+    def decr(self, key, delta=1, version=None):
+        return self._cache.decr(key, delta, version)
+
+    def incr_version(self, key, delta=1, version=None):
+        return self._cache.incr_version(key, delta, version)
+
+    def decr_version(self, key, delta=1, version=None):
+        return self._cache.decr_version(key, delta, version)
+
+    def clear(self):
+        return self._cache.clear()
+
+    def close(self, **kwargs):
+        # The wrapped cache is closed as one of the configured caches.
+        pass
+
+
+_process = {'filename': None, 'last_flush': 0.0}
+
+
+def _metrics_dir():
+    return getattr(settings, 'METRICS_DIR', None)
+
+
+def flush(force=False):
+    """
+    Writes this process's samples to its file in METRICS_DIR, at most every METRICS_FLUSH_SECONDS.
+    """
+    directory = _metrics_dir()
+    now = time.monotonic()
+    if not directory or (not force and now - _process['last_flush'] < getattr(settings, 'METRICS_FLUSH_SECONDS', 1)):
+        return
+    _process['last_flush'] = now
+    if _process['filename'] is None:
+        _process['filename'] = '%d-%d.json' % (os.getpid(), time.time() * 1000)
+        atexit.register(flush, force=True)
+    _write(os.path.join(directory, _process['filename']), samples.collect())
+
+
+def _write(path, collected):
+    rows = [[name, list(labels), value] for (name, labels), value in collected.items()]
+    temporary = '%s.%d.tmp' % (path, threading.get_ident())
+    with open(temporary, 'w') as file:
+        json.dump(rows, file)
+    os.replace(temporary, path)
+
+
+def _read(path, total):
+    """
+    Adds the samples of the file at `path` to `total`. Returns False when it could not be read.
+    """
+    try:
+        with open(path) as file:
+            rows = json.load(file)
+    except (OSError, ValueError):
+        return False
+    for name, labels, value in rows:
+        total[name, tuple(tuple(pair) for pair in labels)] += value
+    return True
+
+
+def _pid_alive(pid):
+    if os.name == 'nt':
+        # os.kill(pid, 0) sends CTRL_C_EVENT on Windows; METRICS_DIR is for gunicorn, which needs POSIX.
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # Exists but belongs to another user, or the platform cannot tell.
+        return True
+    return True
+
+
+def prune(directory):
+    """
+    Folds the files of exited processes into RETIRED_FILENAME and deletes them. Skipped while another
+    process prunes; a lock left behind by a crash is broken after PRUNE_LOCK_TIMEOUT seconds.
+    """
+    dead = []
+    for filename in os.listdir(directory):
+        pid = filename.split('-', 1)[0]
+        if filename.endswith('.json') and pid.isdigit() and int(pid) != os.getpid() and not _pid_alive(int(pid)):
+            dead.append(os.path.join(directory, filename))
+    if not dead:
+        return 0
+
+    lock = os.path.join(directory, PRUNE_LOCK_FILENAME)
+    try:
+        if time.time() - os.path.getmtime(lock) > PRUNE_LOCK_TIMEOUT:
+            os.remove(lock)
+    except OSError:
+        pass
+    try:
+        os.close(os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except FileExistsError:
+        return 0
+    try:
+        retired_path = os.path.join(directory, RETIRED_FILENAME)
+        retired = defaultdict(float)
+        _read(retired_path, retired)
+        merged = [path for path in dead if _read(path, retired)]
+        _write(retired_path, retired)
+        for path in merged:
+            os.remove(path)
+        return len(merged)
+    finally:
+        os.remove(lock)
+
+
+def collect_all():
+    """
+    Returns the samples of this process, plus those of all other processes when METRICS_DIR is set.
+    """
+    directory = _metrics_dir()
+    if not directory:
+        return samples.collect()
+    flush(force=True)
+    prune(directory)
+    total = defaultdict(float)
+    for filename in os.listdir(directory):
+        if filename.endswith('.json'):
+            _read(os.path.join(directory, filename), total)
+    return total
+
+
+def circulation_gauges():
+    """
+    Returns {gauge name: value} from one cached aggregate over the copies.
+    """
+    key = versioned_key(facets.AVAILABILITY_VERSION_NAME, 'circulation-gauges', datetime.date.today().isoformat())
+    gauges = cache.get(key)
+    if gauges is None:
+        counts = BookInstance.objects.aggregate(
+            on_loan=Count('pk', filter=Q(status='o')),
+            overdue=Count('pk', filter=Q(status='o', due_back__lt=datetime.date.today())),
+            available=Count('pk', filter=Q(status='a')),
+        )
+        gauges = {
+            'catalog_copies_on_loan': counts['on_loan'],
+            'catalog_copies_overdue': counts['overdue'],
+            'catalog_copies_available': counts['available'],
+        }
+        cache.set(key, gauges, GAUGE_TIMEOUT)
+    return gauges
+
+
+def can_scrape(request):
+    """
+    Returns whether `request` may read the metrics: from METRICS_ALLOWED_IPS, or by a staff user.
+    """
+    allowed = getattr(settings, 'METRICS_ALLOWED_IPS', ())
+    return request.META.get('REMOTE_ADDR') in allowed or request.user.is_staff
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, _escape(value)) for name, value in labels)
+
+
+def _format_value(value):
+    return repr(int(value)) if value == int(value) else repr(value)
+
+
+def render():
+    """
+    Returns all metrics in the Prometheus text exposition format.
+    """
+    by_metric = defaultdict(list)
+    for (name, labels), value in collect_all().items():
+        by_metric[name].append((labels, value))
+
+    lines = []
+    for metric, (kind, help_text) in METRICS.items():
+        lines.append('# HELP %s %s' % (metric, help_text))
+        lines.append('# TYPE %s %s' % (metric, kind))
+        if kind == 'histogram':
+            lines.extend(_render_histogram(metric, by_metric))
+        else:
+            for labels, value in sorted(by_metric[metric]):
+                lines.append('%s%s %s' % (metric, _format_labels(labels), _format_value(value)))
+
+    for name, value in circulation_gauges().items():
+        lines.append('# HELP %s %s' % (name, GAUGES[name]))
+        lines.append('# TYPE %s gauge' % name)
+        lines.append('%s %s' % (name, value))
+    return '\n'.join(lines) + '\n'
+
+
+def _render_histogram(metric, by_metric):
+    buckets = defaultdict(dict)
+    for labels, value in by_metric[metric + '_bucket']:
+        buckets[labels[:-1]][labels[-1][1]] = value
+    sums = dict(by_metric[metric + '_sum'])
+    counts = dict(by_metric[metric + '_count'])
+    for labels in sorted(counts):
+        cumulative = 0
+        for bound in BUCKETS:
+            le = _format_bound(bound)
+            cumulative += buckets[labels].get(le, 0)
+            yield '%s_bucket%s %s' % (metric, _format_labels(labels + (('le', le),)), _format_value(cumulative))
+        yield '%s_sum%s %s' % (metric, _format_labels(labels), repr(sums.get(labels, 0.0)))
+        yield '%s_count%s %s' % (metric, _format_labels(labels), _format_value(counts[labels]))
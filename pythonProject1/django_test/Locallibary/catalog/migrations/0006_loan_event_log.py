@@ -0,0 +1,60 @@
+# Generated by Django 5.2.8 on 2026-10-18 22:29
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0005_alter_bookinstance_options'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('last_event_id', models.BigIntegerField(default=0)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LoanRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('dimension', models.CharField(choices=[('book', 'Book'), ('genre', 'Genre'), ('author', 'Author')], max_length=6)),
+                ('key', models.BigIntegerField(help_text='Primary key of the book, genre or author')),
+                ('checkouts', models.PositiveIntegerField(default=0)),
+                ('returns', models.PositiveIntegerField(default=0)),
+                ('renewals', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['day'],
+                'indexes': [models.Index(fields=['dimension', 'day'], name='loanrollup_dimension_day_idx')],
+                'constraints': [models.UniqueConstraint(fields=('dimension', 'key', 'day'), name='loanrollup_dimension_key_day_unique')],
+            },
+        ),
+        migrations.CreateModel(
+            name='LoanEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('kind', models.CharField(choices=[('c', 'Checkout'), ('r', 'Return'), ('n', 'Renewal'), ('s', 'Status change')], max_length=1)),
+                ('book_instance_id', models.UUIDField()),
+                ('status', models.CharField(blank=True, choices=[('m', 'Maintenance'), ('o', 'On loan'), ('a', 'Available'), ('r', 'Reserved')], max_length=1)),
+                ('due_back', models.DateField(blank=True, null=True)),
+                ('book', models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='catalog.book')),
+                ('borrower', models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['book_instance_id', 'created'], name='loanevent_copy_created_idx')],
+            },
+        ),
+    ]
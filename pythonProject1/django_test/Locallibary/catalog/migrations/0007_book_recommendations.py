@@ -0,0 +1,28 @@
+# Generated by Django 5.2.8 on 2026-10-18 22:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0006_loan_event_log'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookRecommendation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.PositiveIntegerField(help_text='Number of patrons who borrowed both books')),
+                ('position', models.PositiveSmallIntegerField()),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommendations', to='catalog.book')),
+                ('recommended', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='catalog.book')),
+            ],
+            options={
+                'ordering': ['book', 'position'],
+                'constraints': [models.UniqueConstraint(fields=('book', 'position'), name='bookrecommendation_book_position_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.8 on 2026-10-18 22:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0007_book_recommendations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TermStat',
+            fields=[
+                ('term', models.IntegerField(primary_key=True, serialize=False)),
+                ('books', models.PositiveIntegerField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='BookTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.IntegerField()),
+                ('weight', models.FloatField(help_text='Normalised term frequency of the term in the book')),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='catalog.book')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['term', 'book'], name='bookterm_term_book_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.8 on 2026-10-18 22:35
+
+import catalog.isbn
+from django.db import migrations, models
+
+
+def populate_isbn13(apps, schema_editor):
+    """
+    Normalizes legacy ISBNs. Only the first book of a duplicated ISBN gets isbn13,
+    the others are listed by `manage.py isbn_report`.
+    """
+    Book = apps.get_model('catalog', 'Book')
+    seen = set()
+    books = []
+    for book in Book.objects.exclude(isbn__isnull=True).exclude(isbn='').order_by('id').only('id', 'isbn').iterator():
+        isbn13 = catalog.isbn.normalize_isbn(book.isbn)
+        if isbn13 and isbn13 not in seen:
+            seen.add(isbn13)
+            book.isbn13 = isbn13
+            books.append(book)
+    Book.objects.bulk_update(books, ['isbn13'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0008_similarity_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='isbn13',
+            field=models.CharField(blank=True, editable=False, help_text='ISBN-13 form of the ISBN, used for lookups', max_length=13, null=True, verbose_name='Normalized ISBN'),
+        ),
+        migrations.AlterField(
+            model_name='book',
+            name='isbn',
+            field=models.CharField(blank=True, help_text='13 Character <a href="https://www.isbn-international.org/content/what-isbn">ISBN number</a>', max_length=13, null=True, validators=[catalog.isbn.validate_isbn], verbose_name='ISBN'),
+        ),
+        migrations.RunPython(populate_isbn13, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='book',
+            constraint=models.UniqueConstraint(condition=models.Q(('isbn13__isnull', False)), fields=('isbn13',), name='book_isbn13_unique'),
+        ),
+    ]
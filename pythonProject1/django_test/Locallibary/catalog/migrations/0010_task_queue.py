@@ -0,0 +1,51 @@
+# Generated by Django 5.2.8 on 2026-10-18 22:39
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0009_book_isbn13'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PeriodicTask',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('task', models.CharField(help_text='Registered name of the task function', max_length=200)),
+                ('args', models.JSONField(blank=True, default=list)),
+                ('kwargs', models.JSONField(blank=True, default=dict)),
+                ('interval', models.PositiveIntegerField(help_text='Seconds between runs')),
+                ('next_run', models.DateTimeField(default=django.utils.timezone.now)),
+                ('enabled', models.BooleanField(default=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Task',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='Registered name of the task function', max_length=200)),
+                ('args', models.JSONField(blank=True, default=list)),
+                ('kwargs', models.JSONField(blank=True, default=dict)),
+                ('status', models.CharField(choices=[('q', 'Queued'), ('r', 'Running'), ('d', 'Done'), ('f', 'Failed')], default='q', max_length=1)),
+                ('run_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('dedup_key', models.CharField(blank=True, help_text='At most one queued or running task may have this key', max_length=200, null=True)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('max_attempts', models.PositiveIntegerField(default=5)),
+                ('locked_by', models.CharField(blank=True, max_length=100)),
+                ('locked_at', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['run_at', 'id'],
+                'indexes': [models.Index(fields=['status', 'run_at'], name='task_status_run_at_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('status__in', ['q', 'r'])), fields=('dedup_key',), name='task_dedup_key_pending_unique')],
+            },
+        ),
+    ]
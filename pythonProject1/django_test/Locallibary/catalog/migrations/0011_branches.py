@@ -0,0 +1,75 @@
+# Generated by Django 5.2.8 on 2026-10-18 22:41
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0010_task_queue'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Branch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('address', models.CharField(blank=True, max_length=200)),
+            ],
+            options={
+                'ordering': ['name'],
+            },
+        ),
+        migrations.CreateModel(
+            name='BranchTransfer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'ordering': ['-created'],
+            },
+        ),
+        migrations.AddField(
+            model_name='bookinstance',
+            name='branch',
+            field=models.ForeignKey(blank=True, help_text='Branch currently holding this copy', null=True, on_delete=django.db.models.deletion.PROTECT, to='catalog.branch'),
+        ),
+        migrations.AddIndex(
+            model_name='bookinstance',
+            index=models.Index(fields=['branch', 'status', 'due_back'], name='bookinst_branch_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bookinstance',
+            index=models.Index(fields=['branch', 'book'], name='bookinst_branch_book_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bookinstance',
+            index=models.Index(fields=['branch', 'borrower', 'status'], name='bookinst_branch_borrower_idx'),
+        ),
+        migrations.AddField(
+            model_name='branchtransfer',
+            name='book_instance',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='transfers', to='catalog.bookinstance'),
+        ),
+        migrations.AddField(
+            model_name='branchtransfer',
+            name='from_branch',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='catalog.branch'),
+        ),
+        migrations.AddField(
+            model_name='branchtransfer',
+            name='requested_by',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='branchtransfer',
+            name='to_branch',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='catalog.branch'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.8 on 2026-10-18 22:42
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0011_branches'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CirculationBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('batch_key', models.CharField(help_text='Client supplied idempotency key', max_length=100, unique=True)),
+                ('action', models.CharField(max_length=10)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('response', models.JSONField(blank=True, null=True)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
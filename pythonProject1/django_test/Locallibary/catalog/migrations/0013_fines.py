@@ -0,0 +1,52 @@
+# Generated by Django 5.2.8 on 2026-10-18 23:00
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('catalog', '0012_circulation_batch'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FineBalance',
+            fields=[
+                ('borrower', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='fine_balance', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('outstanding', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='FineRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('daily_rate', models.DecimalField(decimal_places=2, help_text='Fee per day overdue', max_digits=6)),
+                ('grace_days', models.PositiveIntegerField(default=0, help_text='Days overdue before fees start')),
+                ('max_fine', models.DecimalField(blank=True, decimal_places=2, help_text='Cap on the fee of one loan (empty for no cap)', max_digits=8, null=True)),
+                ('genre', models.OneToOneField(blank=True, help_text='Leave empty for the default rate', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='fine_rate', to='catalog.genre')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Fine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('due_back', models.DateField()),
+                ('days_overdue', models.PositiveIntegerField()),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=8)),
+                ('computed_on', models.DateField(help_text='Date the amount was last computed for')),
+                ('paid', models.BooleanField(default=False)),
+                ('book_instance', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='fines', to='catalog.bookinstance')),
+                ('borrower', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='fines', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-due_back'],
+                'indexes': [models.Index(fields=['borrower', 'paid'], name='fine_borrower_paid_idx')],
+                'constraints': [models.UniqueConstraint(fields=('book_instance', 'due_back'), name='fine_loan_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-18 23:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0013_fines'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='author',
+            name='updated',
+            field=models.DateTimeField(auto_now=True, help_text='Last modification, used as the sitemap lastmod'),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='updated',
+            field=models.DateTimeField(auto_now=True, help_text='Last modification, used as the sitemap lastmod'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.8 on 2026-10-18 23:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0014_modification_times'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['title', 'id'], name='book_title_id_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.8 on 2026-10-18 23:33
+
+import django.core.serializers.json
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0015_book_title_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedBookInstance',
+            fields=[
+                ('id', models.UUIDField(help_text='ID the copy had in circulation', primary_key=True, serialize=False)),
+                ('imprint', models.CharField(max_length=200)),
+                ('due_back', models.DateField(blank=True, null=True)),
+                ('status', models.CharField(blank=True, choices=[('m', 'Maintenance'), ('o', 'On loan'), ('a', 'Available'), ('r', 'Reserved')], max_length=1)),
+                ('archived', models.DateTimeField(default=django.utils.timezone.now)),
+                ('history', models.JSONField(blank=True, default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder, help_text='Fines and branch transfers of the copy, restored with it')),
+                ('book', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='archived_copies', to='catalog.book')),
+                ('branch', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='catalog.branch')),
+            ],
+            options={
+                'ordering': ['-archived'],
+            },
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.8 on 2026-10-18 23:39
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0016_archived_copies'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Stocktake',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('scanned', models.PositiveIntegerField(default=0, help_text='Distinct copy ids scanned')),
+                ('invalid_lines', models.PositiveIntegerField(default=0)),
+                ('missing', models.PositiveIntegerField(default=0, help_text='Copies on the shelf in the catalog but not scanned')),
+                ('unexpected', models.PositiveIntegerField(default=0, help_text='Scanned ids that are not copies in circulation')),
+                ('mismatched', models.PositiveIntegerField(default=0, help_text='Scanned copies whose status or branch is wrong')),
+                ('reconciled', models.DateTimeField(blank=True, null=True)),
+                ('branch', models.ForeignKey(blank=True, help_text='Branch counted (empty for the whole library)', null=True, on_delete=django.db.models.deletion.CASCADE, to='catalog.branch')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created'],
+            },
+        ),
+        migrations.CreateModel(
+            name='StocktakeScan',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('copy_id', models.UUIDField()),
+                ('stocktake', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='scans', to='catalog.stocktake')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('stocktake', 'copy_id'), name='stocktakescan_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.8 on 2026-10-19 00:01
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_loans(apps, schema_editor):
+    """
+    Starts the loan counters from the copies currently on loan.
+    """
+    BookInstance = apps.get_model('catalog', 'BookInstance')
+    LoanCounter = apps.get_model('catalog', 'LoanCounter')
+    LoanCounter.objects.bulk_create(
+        (LoanCounter(borrower_id=row['borrower_id'], active_loans=row['loans'])
+         for row in BookInstance.objects.filter(status='o', borrower__isnull=False)
+         .values('borrower_id').annotate(loans=Count('id')).order_by()),
+        batch_size=5000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('catalog', '0017_stocktake'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LoanCounter',
+            fields=[
+                ('borrower', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='loan_counter', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('active_loans', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LoanLimit',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('max_loans', models.PositiveIntegerField(help_text='Copies a patron may have on loan at the same time')),
+                ('group', models.OneToOneField(blank=True, help_text='Leave empty for the default limit', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='loan_limit', to='auth.group')),
+            ],
+        ),
+        migrations.RunPython(count_loans, migrations.RunPython.noop),
+    ]
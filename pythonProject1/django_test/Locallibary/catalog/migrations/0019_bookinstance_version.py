@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-19 00:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0018_loan_limits'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bookinstance',
+            name='version',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Incremented on every change of the copy'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.8 on 2026-10-19 00:19
+
+import catalog.isbn
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0019_bookinstance_version'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='book',
+            name='isbn',
+            field=models.CharField(blank=True, help_text='13 Character <a href="https://www.isbn-international.org/content/what-isbn">ISBN number</a>', max_length=17, null=True, validators=[catalog.isbn.validate_isbn], verbose_name='ISBN'),
+        ),
+    ]
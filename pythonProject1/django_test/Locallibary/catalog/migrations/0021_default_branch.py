@@ -0,0 +1,34 @@
+# Generated by Django 5.2.8 on 2026-10-19 01:10
+
+from django.db import migrations
+
+DEFAULT_BRANCH_NAME = 'Main library'
+
+
+def assign_default_branch(apps, schema_editor):
+    """
+    Moves the copies that predate branches, which no branch listing would show, to a default branch.
+    """
+    Branch = apps.get_model('catalog', 'Branch')
+    BookInstance = apps.get_model('catalog', 'BookInstance')
+    ArchivedBookInstance = apps.get_model('catalog', 'ArchivedBookInstance')
+    unassigned = [
+        BookInstance.objects.filter(branch__isnull=True),
+        ArchivedBookInstance.objects.filter(branch__isnull=True),
+    ]
+    if not any(copies.exists() for copies in unassigned):
+        return
+    branch, _ = Branch.objects.get_or_create(name=DEFAULT_BRANCH_NAME)
+    for copies in unassigned:
+        copies.update(branch=branch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0020_widen_isbn'),
+    ]
+
+    operations = [
+        migrations.RunPython(assign_default_branch, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.8 on 2026-10-19 02:10
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0021_default_branch'),
+    ]
+
+    operations = [
+        # Added without a default first, so existing copies keep an empty creation time.
+        migrations.AddField(
+            model_name='bookinstance',
+            name='created',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.AlterField(
+            model_name='bookinstance',
+            name='created',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False, null=True),
+        ),
+    ]
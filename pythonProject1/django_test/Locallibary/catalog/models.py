@@ -1,9 +1,13 @@
-from django.db import models
+from django.db import models, transaction
 from django.urls import reverse
-from django.db.models import UniqueConstraint
+from django.db.models import Q, UniqueConstraint
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
 import uuid
-from django.contrib.auth.models import User
+from django.contrib.auth.models import Group, User
 from datetime import date
+from django.utils import timezone
+from .isbn import normalize_isbn, validate_isbn
 
 
 class Genre(models.Model):
@@ -32,6 +36,7 @@ class Author(models.Model):
     last_name = models.CharField(max_length=100)
     date_of_birth = models.DateField(null=True, blank=True)
     date_of_death = models.DateField('Died', null=True, blank=True)
+    updated = models.DateTimeField(auto_now=True, help_text='Last modification, used as the sitemap lastmod')
 
     def get_absolute_url(self):
         """
@@ -56,8 +61,21 @@ class Book(models.Model):
     title = models.CharField(max_length=200)
     author = models.ForeignKey('Author', on_delete=models.SET_NULL, null=True)
     summary = models.TextField(max_length=1000, help_text="Enter a brief description of the book")
-    isbn = models.CharField('ISBN', max_length=13,blank=True, null=True, help_text='13 Character <a href="https://www.isbn-international.org/content/what-isbn">ISBN number</a>')
+    # 17 characters: an ISBN-13 written with its four hyphens.
+    isbn = models.CharField('ISBN', max_length=17,blank=True, null=True, validators=[validate_isbn], help_text='13 Character <a href="https://www.isbn-international.org/content/what-isbn">ISBN number</a>')
+    isbn13 = models.CharField('Normalized ISBN', max_length=13, blank=True, null=True, editable=False,
+                              help_text='ISBN-13 form of the ISBN, used for lookups')
     genre = models.ManyToManyField(Genre, help_text="Select a genre for this book")
+    updated = models.DateTimeField(auto_now=True, help_text='Last modification, used as the sitemap lastmod')
+
+    class Meta:
+        constraints = [
+            UniqueConstraint(fields=['isbn13'], condition=Q(isbn13__isnull=False), name='book_isbn13_unique')
+        ]
+        indexes = [
+            # The order of the book list (and of its snapshot pages).
+            models.Index(fields=['title', 'id'], name='book_title_id_idx'),
+        ]
 
     def __str__(self):
         """
@@ -71,9 +89,47 @@ class Book(models.Model):
         """
         return reverse('book-detail', args=[str(self.id)])
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_isbn = instance.__dict__.get('isbn')
+        return instance
+
+    def isbn_changed(self):
+        """
+        Whether the ISBN differs from the stored one. Legacy duplicates keep their empty isbn13 (see
+        migration 0009 and `manage.py isbn_report`) until their ISBN itself is edited.
+        """
+        if self._state.adding:
+            return True
+        return 'isbn' in self.__dict__ and self.isbn != getattr(self, '_loaded_isbn', None)
+
+    def clean(self):
+        """
+        Rejects an ISBN already used by another book (after normalization).
+        """
+        if not self.isbn_changed():
+            return
+        self.isbn13 = normalize_isbn(self.isbn)
+        if self.isbn13 and Book.objects.filter(isbn13=self.isbn13).exclude(pk=self.pk).exists():
+            raise ValidationError({'isbn': 'A book with this ISBN already exists.'})
+
+    def save(self, *args, **kwargs):
+        if self.isbn_changed():
+            self.isbn13 = normalize_isbn(self.isbn)
+        self._loaded_isbn = self.__dict__.get('isbn')
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'updated', *(['isbn13'] if 'isbn' in update_fields else [])}
+        super().save(*args, **kwargs)
+
     def display_genre(self):
         """Создает строку для жанров. Это требуется для отображения в админке."""
-        return ', '.join(genre.name for genre in self.genre.all()[:3])
+        names = getattr(self, 'genre_names', None)
+        if names is None:
+            from .genres import names_by_book  # genres.py imports the models
+            names = self.genre_names = names_by_book([self.pk])[self.pk]
+        return ', '.join(names[:3])
 
     display_genre.short_description = 'Genre'
 
@@ -84,6 +140,20 @@ class Book(models.Model):
     display_author.short_description = 'Author'
 
 
+class Branch(models.Model):
+    """
+    Model representing a physical library branch holding copies of books.
+    """
+    name = models.CharField(max_length=100, unique=True)
+    address = models.CharField(max_length=200, blank=True)
+
+    class Meta:
+        ordering = ['name']
+
+    def __str__(self):
+        return self.name
+
+
 class BookInstance(models.Model):
     """
     Model representing a specific copy of a book (i.e. that can be borrowed from the library).
@@ -94,6 +164,8 @@ class BookInstance(models.Model):
     imprint = models.CharField(max_length=200)
     due_back = models.DateField(null=True, blank=True)
     borrower = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    branch = models.ForeignKey('Branch', on_delete=models.PROTECT, null=True, blank=True,
+                               help_text='Branch currently holding this copy')
 
     @property
     def is_overdue(self):
@@ -109,14 +181,425 @@ class BookInstance(models.Model):
     )
 
     status = models.CharField(max_length=1, choices=LOAN_STATUS, blank=True, default='m', help_text='Book availability')
+    # Compared by conditional updates (see catalog/circulation.py), so concurrent desks never overwrite each other.
+    version = models.PositiveIntegerField(default=0, editable=False, help_text='Incremented on every change of the copy')
+    # Empty for copies added before creation times were recorded.
+    created = models.DateTimeField(default=timezone.now, null=True, editable=False)
+
+    # Fields whose changes are written to the circulation event log or invalidate cached counts.
+    TRACKED_FIELDS = ('status', 'due_back', 'borrower_id', 'book_id', 'branch_id')
 
     class Meta:
         ordering = ["due_back"]
         permissions = (("can_mark_returned", "Set book as returned"),)
+        # Branch-leading indexes keep per-branch listings and counts as cheap as on a single-branch install.
+        indexes = [
+            models.Index(fields=['branch', 'status', 'due_back'], name='bookinst_branch_status_idx'),
+            models.Index(fields=['branch', 'book'], name='bookinst_branch_book_idx'),
+            models.Index(fields=['branch', 'borrower', 'status'], name='bookinst_branch_borrower_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """
+        Remembers the loaded values of the tracked fields so saves can be compared against them.
+        """
+        instance = super().from_db(db, field_names, values)
+        instance.remember_tracked_values()
+        return instance
+
+    def save(self, *args, **kwargs):
+        incremented = not self._state.adding
+        if incremented:
+            # Incremented by the database, so a save racing a batch (or another save) still moves the version on
+            self.version = models.F('version') + 1
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'version'}
+        # The post_save handlers write the circulation event (and counters) in the same transaction as the row.
+        with transaction.atomic(savepoint=False):
+            super().save(*args, **kwargs)
+            if incremented:
+                self.refresh_from_db(fields=['version'])
+
+    def remember_tracked_values(self):
+        self._tracked_values = {
+            name: self.__dict__[name] for name in self.TRACKED_FIELDS if name in self.__dict__
+        }
+
+    @property
+    def tracked_values(self):
+        """
+        Values of the tracked fields as they were last loaded or saved (None for new copies).
+        """
+        return getattr(self, '_tracked_values', None)
 
     def __str__(self):
         """
         String for representing the Model object
         """
         book_title = self.book.title if self.book else 'Unknown Book'
-        return '%s (%s)' % (self.id, book_title)
\ No newline at end of file
+        return '%s (%s)' % (self.id, book_title)
+
+
+class ArchivedBookInstance(models.Model):
+    """
+    Model representing a withdrawn copy moved out of the BookInstance table (see catalog/archive.py).
+    """
+    id = models.UUIDField(primary_key=True, help_text='ID the copy had in circulation')
+    book = models.ForeignKey('Book', on_delete=models.SET_NULL, null=True, related_name='archived_copies')
+    imprint = models.CharField(max_length=200)
+    due_back = models.DateField(null=True, blank=True)
+    branch = models.ForeignKey('Branch', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    status = models.CharField(max_length=1, choices=BookInstance.LOAN_STATUS, blank=True)
+    archived = models.DateTimeField(default=timezone.now)
+    history = models.JSONField(default=dict, blank=True, encoder=DjangoJSONEncoder,
+                               help_text='Fines and branch transfers of the copy, restored with it')
+
+    class Meta:
+        ordering = ['-archived']
+
+    def __str__(self):
+        book_title = self.book.title if self.book else 'Unknown Book'
+        return '%s (%s, archived)' % (self.id, book_title)
+
+
+class LoanEvent(models.Model):
+    """
+    Model representing a single change in the circulation of a copy (append-only).
+    """
+    CHECKOUT = 'c'
+    RETURN = 'r'
+    RENEWAL = 'n'
+    STATUS_CHANGE = 's'
+
+    EVENT_KIND = (
+        (CHECKOUT, 'Checkout'),
+        (RETURN, 'Return'),
+        (RENEWAL, 'Renewal'),
+        (STATUS_CHANGE, 'Status change'),
+    )
+
+    created = models.DateTimeField(default=timezone.now)
+    kind = models.CharField(max_length=1, choices=EVENT_KIND)
+    # Plain references without constraints: the log must survive deletion of the copy, book or user.
+    book_instance_id = models.UUIDField()
+    book = models.ForeignKey('Book', on_delete=models.DO_NOTHING, db_constraint=False, null=True, related_name='+')
+    borrower = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False, null=True, related_name='+')
+    status = models.CharField(max_length=1, choices=BookInstance.LOAN_STATUS, blank=True)
+    due_back = models.DateField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['book_instance_id', 'created'], name='loanevent_copy_created_idx'),
+        ]
+
+    def __str__(self):
+        return '%s %s (%s)' % (self.get_kind_display(), self.book_instance_id, self.created)
+
+
+class LoanRollup(models.Model):
+    """
+    Model representing daily circulation totals for one book, genre or author.
+    """
+    BOOK = 'book'
+    GENRE = 'genre'
+    AUTHOR = 'author'
+
+    DIMENSION = (
+        (BOOK, 'Book'),
+        (GENRE, 'Genre'),
+        (AUTHOR, 'Author'),
+    )
+
+    day = models.DateField()
+    dimension = models.CharField(max_length=6, choices=DIMENSION)
+    key = models.BigIntegerField(help_text='Primary key of the book, genre or author')
+    checkouts = models.PositiveIntegerField(default=0)
+    returns = models.PositiveIntegerField(default=0)
+    renewals = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['day']
+        constraints = [
+            UniqueConstraint(fields=['dimension', 'key', 'day'], name='loanrollup_dimension_key_day_unique')
+        ]
+        indexes = [
+            models.Index(fields=['dimension', 'day'], name='loanrollup_dimension_day_idx'),
+        ]
+
+    def __str__(self):
+        return '%s %s on %s' % (self.dimension, self.key, self.day)
+
+
+class RollupState(models.Model):
+    """
+    Model representing the high-water mark of an incremental rollup job.
+    """
+    name = models.CharField(max_length=50, unique=True)
+    last_event_id = models.BigIntegerField(default=0)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return '%s @ %s' % (self.name, self.last_event_id)
+
+
+class BookRecommendation(models.Model):
+    """
+    Model representing a precomputed "patrons who borrowed this also borrowed" neighbour of a book.
+    """
+    book = models.ForeignKey('Book', on_delete=models.CASCADE, related_name='recommendations')
+    recommended = models.ForeignKey('Book', on_delete=models.CASCADE, related_name='+')
+    score = models.PositiveIntegerField(help_text='Number of patrons who borrowed both books')
+    position = models.PositiveSmallIntegerField()
+
+    class Meta:
+        ordering = ['book', 'position']
+        constraints = [
+            UniqueConstraint(fields=['book', 'position'], name='bookrecommendation_book_position_unique')
+        ]
+
+    def __str__(self):
+        return '%s -> %s (%s)' % (self.book_id, self.recommended_id, self.score)
+
+
+class BookTerm(models.Model):
+    """
+    Model representing one posting of the "more like this" index: a hashed term of a book and its weight.
+    """
+    book = models.ForeignKey('Book', on_delete=models.CASCADE, related_name='+')
+    term = models.IntegerField()
+    weight = models.FloatField(help_text='Normalised term frequency of the term in the book')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['term', 'book'], name='bookterm_term_book_idx'),
+        ]
+
+    def __str__(self):
+        return '%s: %s=%.3f' % (self.book_id, self.term, self.weight)
+
+
+class TermStat(models.Model):
+    """
+    Model representing the number of books containing a hashed term (for IDF weighting).
+    """
+    term = models.IntegerField(primary_key=True)
+    books = models.PositiveIntegerField()
+
+    def __str__(self):
+        return '%s in %s books' % (self.term, self.books)
+
+
+class Task(models.Model):
+    """
+    Model representing a unit of deferred work for the database-backed task queue (see catalog/tasks.py).
+    """
+    QUEUED = 'q'
+    RUNNING = 'r'
+    DONE = 'd'
+    FAILED = 'f'
+
+    TASK_STATUS = (
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    name = models.CharField(max_length=200, help_text='Registered name of the task function')
+    args = models.JSONField(default=list, blank=True)
+    kwargs = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=1, choices=TASK_STATUS, default=QUEUED)
+    run_at = models.DateTimeField(default=timezone.now)
+    dedup_key = models.CharField(max_length=200, null=True, blank=True,
+                                 help_text='At most one queued or running task may have this key')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['run_at', 'id']
+        constraints = [
+            UniqueConstraint(fields=['dedup_key'], condition=Q(status__in=['q', 'r']), name='task_dedup_key_pending_unique')
+        ]
+        indexes = [
+            models.Index(fields=['status', 'run_at'], name='task_status_run_at_idx'),
+        ]
+
+    def __str__(self):
+        return '%s #%s (%s)' % (self.name, self.id, self.get_status_display())
+
+
+class PeriodicTask(models.Model):
+    """
+    Model representing a task that is enqueued again every `interval` seconds.
+    """
+    name = models.CharField(max_length=100, unique=True)
+    task = models.CharField(max_length=200, help_text='Registered name of the task function')
+    args = models.JSONField(default=list, blank=True)
+    kwargs = models.JSONField(default=dict, blank=True)
+    interval = models.PositiveIntegerField(help_text='Seconds between runs')
+    next_run = models.DateTimeField(default=timezone.now)
+    enabled = models.BooleanField(default=True)
+
+    def __str__(self):
+        return '%s every %ss' % (self.name, self.interval)
+
+
+class BranchTransfer(models.Model):
+    """
+    Model representing the move of a copy from one branch to another.
+    """
+    book_instance = models.ForeignKey('BookInstance', on_delete=models.CASCADE, related_name='transfers')
+    from_branch = models.ForeignKey('Branch', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    to_branch = models.ForeignKey('Branch', on_delete=models.CASCADE, related_name='+')
+    created = models.DateTimeField(default=timezone.now)
+    requested_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+
+    class Meta:
+        ordering = ['-created']
+
+    def __str__(self):
+        return '%s: %s -> %s' % (self.book_instance_id, self.from_branch, self.to_branch)
+
+
+class CirculationBatch(models.Model):
+    """
+    Model representing a processed circulation desk batch, kept so that retries with the same key are idempotent.
+    """
+    batch_key = models.CharField(max_length=100, unique=True, help_text='Client supplied idempotency key')
+    action = models.CharField(max_length=10)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    created = models.DateTimeField(default=timezone.now)
+    response = models.JSONField(null=True, blank=True)
+
+    def __str__(self):
+        return '%s (%s)' % (self.batch_key, self.action)
+
+
+class FineRate(models.Model):
+    """
+    Model representing the late fee rate of one genre, or without a genre the default rate.
+    """
+    genre = models.OneToOneField(Genre, on_delete=models.CASCADE, null=True, blank=True, related_name='fine_rate',
+                                 help_text='Leave empty for the default rate')
+    daily_rate = models.DecimalField(max_digits=6, decimal_places=2, help_text='Fee per day overdue')
+    grace_days = models.PositiveIntegerField(default=0, help_text='Days overdue before fees start')
+    max_fine = models.DecimalField(max_digits=8, decimal_places=2, null=True, blank=True,
+                                   help_text='Cap on the fee of one loan (empty for no cap)')
+
+    def clean(self):
+        if self.genre_id is None and FineRate.objects.filter(genre__isnull=True).exclude(pk=self.pk).exists():
+            raise ValidationError({'genre': 'A default rate already exists.'})
+
+    def __str__(self):
+        return '%s: %s/day' % (self.genre or 'Default', self.daily_rate)
+
+
+class Fine(models.Model):
+    """
+    Model representing the late fee of one loan (a copy and the due date it was lent until).
+    """
+    book_instance = models.ForeignKey('BookInstance', on_delete=models.CASCADE, related_name='fines')
+    borrower = models.ForeignKey(User, on_delete=models.CASCADE, related_name='fines')
+    due_back = models.DateField()
+    days_overdue = models.PositiveIntegerField()
+    amount = models.DecimalField(max_digits=8, decimal_places=2)
+    computed_on = models.DateField(help_text='Date the amount was last computed for')
+    paid = models.BooleanField(default=False)
+
+    class Meta:
+        ordering = ['-due_back']
+        constraints = [
+            UniqueConstraint(fields=['book_instance', 'due_back'], name='fine_loan_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['borrower', 'paid'], name='fine_borrower_paid_idx'),
+        ]
+
+    def __str__(self):
+        return '%s: %s' % (self.borrower, self.amount)
+
+
+class FineBalance(models.Model):
+    """
+    Model representing the maintained total of a user's unpaid fines.
+    """
+    borrower = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='fine_balance')
+    outstanding = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+
+    def __str__(self):
+        return '%s: %s' % (self.borrower, self.outstanding)
+
+
+class LoanLimit(models.Model):
+    """
+    Model representing the maximum number of concurrent loans of the members of a group, or without a group the
+    default maximum.
+    """
+    group = models.OneToOneField(Group, on_delete=models.CASCADE, null=True, blank=True, related_name='loan_limit',
+                                 help_text='Leave empty for the default limit')
+    max_loans = models.PositiveIntegerField(help_text='Copies a patron may have on loan at the same time')
+
+    def clean(self):
+        if self.group_id is None and LoanLimit.objects.filter(group__isnull=True).exclude(pk=self.pk).exists():
+            raise ValidationError({'group': 'A default limit already exists.'})
+
+    def __str__(self):
+        return '%s: %d' % (self.group or 'Default', self.max_loans)
+
+
+class LoanCounter(models.Model):
+    """
+    Model representing the maintained number of copies on loan to a user.
+    """
+    borrower = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='loan_counter')
+    active_loans = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return '%s: %d' % (self.borrower, self.active_loans)
+
+
+class Stocktake(models.Model):
+    """
+    Model representing an inventory count: the copies scanned on the shelves compared with BookInstance.
+    """
+    branch = models.ForeignKey('Branch', on_delete=models.CASCADE, null=True, blank=True,
+                               help_text='Branch counted (empty for the whole library)')
+    created = models.DateTimeField(default=timezone.now)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    scanned = models.PositiveIntegerField(default=0, help_text='Distinct copy ids scanned')
+    invalid_lines = models.PositiveIntegerField(default=0)
+    missing = models.PositiveIntegerField(default=0, help_text='Copies on the shelf in the catalog but not scanned')
+    unexpected = models.PositiveIntegerField(default=0, help_text='Scanned ids that are not copies in circulation')
+    mismatched = models.PositiveIntegerField(default=0, help_text='Scanned copies whose status or branch is wrong')
+    reconciled = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created']
+
+    def __str__(self):
+        return 'Stocktake %s of %s' % (self.created.date(), self.branch or 'all branches')
+
+
+class StocktakeScan(models.Model):
+    """
+    Model representing one scanned copy id of a stocktake (staging data, deleted with the stocktake).
+    """
+    # The unique constraint's index leads with the stocktake.
+    stocktake = models.ForeignKey('Stocktake', on_delete=models.CASCADE, related_name='scans', db_index=False)
+    copy_id = models.UUIDField()
+
+    class Meta:
+        constraints = [
+            UniqueConstraint(fields=['stocktake', 'copy_id'], name='stocktakescan_unique'),
+        ]
+
+    def __str__(self):
+        return '%s: %s' % (self.stocktake_id, self.copy_id)
\ No newline at end of file
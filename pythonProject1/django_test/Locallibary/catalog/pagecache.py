@@ -0,0 +1,155 @@
+"""
+Shared page cache for authenticated visitors, with the personal part punched out.
+
+Pages are identical for all visitors except the user navigation of the
+sidebar (user name, My Borrowed, All Borrowed for librarians, login/logout
+links). @shared_page renders a page once with a placeholder in place of that
+fragment (see the {% user_nav %} tag) and caches the body for everyone under
+the URL, the visitor's branch and the versions of the data shown on catalog
+pages, plus those a view adds for its own data (the availability of the
+copies of one book, say). Each request then only renders the small fragment for its user and
+substitutes it into the cached body.
+
+With PAGE_CACHE_EDGE_INCLUDES the placeholder is an ESI include of the
+user_nav view instead, and the body is returned unchanged for an edge cache
+(Varnish, a CDN) to assemble.
+
+Pages about the visitor's own loans are cached whole per user by
+@user_page, under the version of the user's loans (bumped by
+loans.invalidate_loans() whenever a copy lent to or returned by the user
+changes, or their fines change), the fines run, the user's permissions
+(their own and those of all groups) and the books and branches shown, so a repeat visit runs no query at all.
+"""
+import datetime
+import functools
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils.cache import patch_cache_control
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+from django.utils.http import urlencode
+
+from . import backends, branches, facets, genres, typeahead
+from .cache import get_versions
+from .loans import FINES_VERSION_NAME, loans_version_name
+
+FRAGMENT_TEMPLATE = 'catalog/user_nav.html'
+
+PLACEHOLDER = '<!--catalog:user-nav-->'
+
+# Bumped when books, authors, genres or branches change.
+VERSION_NAMES = (facets.VERSION_NAME, typeahead.VERSION_NAME, genres.VERSION_NAME, branches.VERSION_NAME)
+
+def _timeout():
+    return getattr(settings, 'PAGE_CACHE_TIMEOUT', 5 * 60)
+
+
+def _edge_includes():
+    return getattr(settings, 'PAGE_CACHE_EDGE_INCLUDES', False)
+
+
+def page_key(request, extra_versions=()):
+    branch = branches.current_branch(request)
+    path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    versions = get_versions(*VERSION_NAMES, *extra_versions)
+    return 'catalog:page:%s:%s:%s' % ('.'.join(map(str, versions)), branch and branch.pk, path)
+
+
+def book_list_versions(request):
+    # Filtered on availability, the list changes with every checkout and return.
+    return [facets.AVAILABILITY_VERSION_NAME] if request.GET.get('available') == '1' else []
+
+
+def book_detail_versions(request, pk):
+    return [facets.copies_version_name(pk)]
+
+
+def hole(request):
+    """
+    Returns what a shared page contains in place of the user navigation.
+    """
+    if _edge_includes():
+        src = '%s?%s' % (reverse('user-nav'), urlencode({'next': request.path}))
+        return mark_safe('<esi:include src="%s" />' % escape(src))
+    return mark_safe(PLACEHOLDER)
+
+
+def render_user_nav(request, next_path):
+    return render_to_string(FRAGMENT_TEMPLATE, {'nav_next': next_path}, request=request)
+
+
+def _response(request, content, content_type):
+    if _edge_includes():
+        response = HttpResponse(content, content_type=content_type)
+        response['Surrogate-Control'] = 'content="ESI/1.0"'
+        return response
+    return HttpResponse(content.replace(PLACEHOLDER, render_user_nav(request, request.path), 1),
+                        content_type=content_type)
+
+
+def shared_page(view, versions=None):
+    """
+    Caches the GET responses of `view` for all visitors, rendering only the user navigation per request.
+
+    `versions(request, *args, **kwargs)` returns the names of further versions the page is cached under.
+    """
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return view(request, *args, **kwargs)
+        key = page_key(request, versions(request, *args, **kwargs) if versions else ())
+        cached = cache.get(key)
+        if cached is None:
+            request._shared_page = True
+            response = view(request, *args, **kwargs)
+            if hasattr(response, 'render'):
+                response.render()
+            if response.status_code != 200 or response.streaming:
+                return response
+            cached = (response.content.decode(response.charset), response['Content-Type'])
+            cache.set(key, cached, _timeout())
+        return _response(request, *cached)
+    return wrapper
+
+
+def user_page_key(request):
+    user_id = request.user.pk
+    versions = get_versions(
+        loans_version_name(user_id), FINES_VERSION_NAME, backends.user_version_name(user_id),
+        backends.GLOBAL_VERSION, typeahead.VERSION_NAME, branches.VERSION_NAME,
+    )
+    branch = branches.current_branch(request)
+    path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    # Overdue loans are highlighted, so the page also changes at midnight.
+    return 'catalog:user-page:%s:%s:%s:%s:%s' % (
+        user_id, '.'.join(map(str, versions)), datetime.date.today().isoformat(), branch and branch.pk, path,
+    )
+
+
+def user_page(view):
+    """
+    Caches the GET responses of `view` per authenticated user; see loans.invalidate_loans().
+    """
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD') or not request.user.is_authenticated:
+            return view(request, *args, **kwargs)
+        key = user_page_key(request)
+        cached = cache.get(key)
+        if cached is None:
+            response = view(request, *args, **kwargs)
+            if hasattr(response, 'render'):
+                response.render()
+            if response.status_code != 200 or response.streaming:
+                return response
+            cached = (response.content, response['Content-Type'])
+            cache.set(key, cached, _timeout())
+        response = HttpResponse(cached[0], content_type=cached[1])
+        patch_cache_control(response, private=True)
+        return response
+    return wrapper
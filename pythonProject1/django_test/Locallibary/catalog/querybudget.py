@@ -0,0 +1,354 @@
+"""
+Query budgets for views and templates.
+
+QueryLog records every query run on the database connections together with
+where it came from: the template tag or variable being rendered (template
+name, line and source of the tag), or else the innermost frame of the
+project code. query_budget(n), a context manager and decorator, fails when
+a block runs more than `n` queries; check_growth() fails when a request runs
+more queries against more data, which is how an N+1 (a related object or a
+per-row helper fetched in a loop) shows up however small the test data is.
+Both report the repeated SQL and where it was triggered.
+
+sweep() requests every URL of catalog/urls.py (see sweep_requests()) against
+data seeded at two scales, each in a rolled back transaction, with cold
+caches. The check_query_budget command runs it against a throwaway test
+database; QueryBudgetSweepTest runs it with the test suite, and fails when a
+new URL is neither swept nor listed in SKIPPED.
+"""
+import collections
+import contextlib
+import datetime
+import json
+import os
+import re
+import threading
+import traceback
+import types
+import uuid
+
+from django.conf import settings
+from django.contrib.auth.models import Permission, User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connections, transaction
+from django.template.base import Node, TokenType
+from django.test import Client
+from django.urls import reverse
+
+from . import genres, similarity, typeahead
+from .models import (
+    ArchivedBookInstance, Author, Book, BookInstance, BookRecommendation, Genre, LoanRollup, Stocktake,
+    StocktakeScan,
+)
+
+# Rows per collection of the two seeded libraries; the small one stays below every page size.
+SCALES = (2, 6)
+
+# URLs the sweep does not request, with the reason.
+SKIPPED = {
+    'book-availability-stream': 'event stream',
+    'my-loans-stream': 'event stream',
+}
+
+SQL_LENGTH = 300
+
+Query = collections.namedtuple('Query', 'sql origin')
+
+# IN lists and page slices differ with the data; they are the same statement for the report.
+_IN_LIST = re.compile(r'%s(?:, %s)+')
+_SLICE = re.compile(r'\b(LIMIT|OFFSET) \d+')
+
+_local = threading.local()
+_lock = threading.Lock()
+_tracking = {'count': 0, 'render_annotated': None}
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def _render_annotated(node, context):
+    stack = _local.__dict__.setdefault('nodes', [])
+    stack.append(node)
+    try:
+        return _tracking['render_annotated'](node, context)
+    finally:
+        stack.pop()
+
+
+@contextlib.contextmanager
+def _tracking_templates():
+    # Node.render_annotated() renders every tag and variable; while a log is open it also tracks which one.
+    with _lock:
+        if not _tracking['count']:
+            _tracking['render_annotated'] = Node.render_annotated
+            Node.render_annotated = _render_annotated
+        _tracking['count'] += 1
+    try:
+        yield
+    finally:
+        with _lock:
+            _tracking['count'] -= 1
+            if not _tracking['count']:
+                Node.render_annotated = _tracking['render_annotated']
+
+
+def _template_origin():
+    for node in reversed(getattr(_local, 'nodes', ())):
+        token, origin = getattr(node, 'token', None), getattr(node, 'origin', None)
+        if token is None or origin is None:
+            continue
+        source = ('{{ %s }}' if token.token_type == TokenType.VAR else '{%% %s %%}') % token.contents
+        return '%s:%s %s' % (origin.template_name or origin.name, token.lineno, source)
+    return None
+
+
+def _code_origin():
+    root = str(settings.BASE_DIR) + os.sep
+    for frame in reversed(traceback.extract_stack()):
+        if frame.filename.startswith(root) and frame.filename != __file__:
+            return '%s:%d in %s()' % (frame.filename[len(root):], frame.lineno, frame.name)
+    return None
+
+
+def normalize(sql):
+    return _SLICE.sub(r'\1 %s', _IN_LIST.sub('%s, ...', sql))
+
+
+class QueryLog:
+    """
+    Context manager recording the queries run inside it, with their template or code origin.
+    """
+
+    def __init__(self, using=None):
+        self.aliases = [using] if using else list(connections)
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append(Query(sql, _template_origin() or _code_origin()))
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self.queries = []
+        self._stack = contextlib.ExitStack()
+        self._stack.enter_context(_tracking_templates())
+        for alias in self.aliases:
+            self._stack.enter_context(connections[alias].execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+
+    def __len__(self):
+        return len(self.queries)
+
+    def counts(self):
+        """
+        Returns a Counter of the normalized statements.
+        """
+        return collections.Counter(normalize(query.sql) for query in self.queries)
+
+    def origins(self, sql):
+        return collections.Counter(query.origin for query in self.queries if normalize(query.sql) == sql)
+
+    def report(self, statements=None):
+        """
+        Describes the statements (default: those run more than once), most frequent first, with their origins.
+        """
+        counts = self.counts()
+        if statements is None:
+            statements = [sql for sql, count in counts.items() if count > 1]
+        lines = []
+        for sql in sorted(statements, key=lambda sql: -counts[sql]):
+            text = sql if len(sql) <= SQL_LENGTH else sql[:SQL_LENGTH] + '...'
+            lines.append('%d x %s' % (counts[sql], text))
+            for origin, count in self.origins(sql).most_common():
+                lines.append('    %d x from %s' % (count, origin or 'unknown'))
+        return '\n'.join(lines)
+
+
+class query_budget(contextlib.ContextDecorator):
+    """
+    Fails with QueryBudgetExceeded when the block (or decorated function) runs more than `limit` queries.
+    """
+
+    def __init__(self, limit, using=None):
+        self.limit = limit
+        self.using = using
+
+    def __enter__(self):
+        self.log = QueryLog(self.using).__enter__()
+        return self.log
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.log.__exit__(exc_type, exc_value, traceback)
+        if exc_type is None and len(self.log) > self.limit:
+            raise QueryBudgetExceeded('%d queries run, the budget is %d.\n%s' % (
+                len(self.log), self.limit, self.log.report() or self.log.report(self.log.counts()),
+            ))
+
+
+def growth(small, large):
+    """
+    Returns the statements `large` runs more often than `small`.
+    """
+    small_counts = small.counts()
+    return [sql for sql, count in large.counts().items() if count > small_counts[sql]]
+
+
+def check_growth(small, large, label='The block'):
+    """
+    Fails with QueryBudgetExceeded when the `large` log has more queries than the `small` one.
+    """
+    if len(large) > len(small):
+        raise QueryBudgetExceeded('%s runs %d queries against the small data and %d against the large data.\n%s' % (
+            label, len(small), len(large), large.report(growth(small, large)),
+        ))
+
+
+def _isbn(number):
+    digits = '978%09d' % number
+    check = -sum(int(digit) * (3 if position % 2 else 1) for position, digit in enumerate(digits)) % 10
+    return '%s%d' % (digits, check)
+
+
+def seed(scale):
+    """
+    Creates a library where every collection grows with `scale`: authors, genres, books per author, copies per
+    book, loans of the patron, rollups, recommendations, archived copies and stocktake scans.
+    Returns a namespace of the objects the sweep requests refer to.
+    """
+    patron = User.objects.create(username='sweep-patron')
+    librarian = User.objects.create(username='sweep-librarian')
+    librarian.user_permissions.add(Permission.objects.get(codename='can_mark_returned'))
+
+    genre_list = Genre.objects.bulk_create([Genre(name='Genre %d' % n) for n in range(scale)])
+    authors = Author.objects.bulk_create(
+        [Author(first_name='First %d' % n, last_name='Last %d' % n) for n in range(scale)]
+    )
+    books = Book.objects.bulk_create([
+        Book(title='Book %d %d' % (a, b), summary='Summary of book %d by author %d' % (b, a), author=author,
+             isbn=_isbn(a * scale + b), isbn13=_isbn(a * scale + b))
+        for a, author in enumerate(authors) for b in range(scale)
+    ])
+    Book.genre.through.objects.bulk_create([
+        Book.genre.through(book=book, genre=genre) for book in books for genre in genre_list
+    ])
+    copies = BookInstance.objects.bulk_create([
+        BookInstance(book=book, imprint='Imprint %d' % n, status='a') for book in books for n in range(scale)
+    ])
+    today = datetime.date.today()
+    loans = copies[::scale][:scale]
+    for days, copy in enumerate(loans):
+        copy.status, copy.borrower, copy.due_back = 'o', patron, today + datetime.timedelta(days=days - 1)
+    BookInstance.objects.bulk_update(loans, ['status', 'borrower', 'due_back'])
+
+    book = books[0]
+    BookRecommendation.objects.bulk_create([
+        BookRecommendation(book=book, recommended=other, score=scale - n, position=n)
+        for n, other in enumerate(books[1:scale + 1])
+    ])
+    similarity.build_similarity()
+    ArchivedBookInstance.objects.bulk_create([
+        ArchivedBookInstance(id=uuid.uuid4(), book=book, imprint='Archived', status='m') for _ in range(scale)
+    ])
+    LoanRollup.objects.bulk_create([
+        LoanRollup(day=today, dimension=dimension, key=model.pk, checkouts=n + 1)
+        for dimension, objects in ((LoanRollup.BOOK, books), (LoanRollup.GENRE, genre_list),
+                                   (LoanRollup.AUTHOR, authors))
+        for n, model in enumerate(objects[:scale])
+    ])
+    inventory = Stocktake.objects.create(created_by=librarian)
+    StocktakeScan.objects.bulk_create([StocktakeScan(stocktake=inventory, copy_id=copy.pk) for copy in copies[-scale:]])
+    return types.SimpleNamespace(
+        patron=patron, librarian=librarian, book=book, author=book.author, loans=loans,
+        isbns=[other.isbn for other in books], stocktake=inventory, scans=[str(copy.pk) for copy in copies[-scale:]],
+    )
+
+
+def sweep_requests(data):
+    """
+    Returns {url name: (user, method, path, client keyword arguments)} of the requests made by the sweep.
+    """
+    def as_json(payload):
+        return {'data': json.dumps(payload), 'content_type': 'application/json'}
+
+    librarian, patron = data.librarian, data.patron
+    return {
+        'index': (None, 'get', reverse('index'), {}),
+        'books': (None, 'get', reverse('books'), {}),
+        'book-detail': (patron, 'get', reverse('book-detail', args=[data.book.pk]), {'data': {'archived': 1}}),
+        'renew-book-librarian': (librarian, 'get', reverse('renew-book-librarian', args=[data.loans[0].pk]), {}),
+        'authors': (None, 'get', reverse('authors'), {}),
+        'author-detail': (None, 'get', reverse('author-detail', args=[data.author.pk]), {}),
+        'author-books': (None, 'get', reverse('author-books', args=[data.author.pk]), {}),
+        'my-borrowed': (patron, 'get', reverse('my-borrowed'), {}),
+        'all-borrowed': (librarian, 'get', reverse('all-borrowed'), {}),
+        'isbn-resolve-batch': (None, 'post', reverse('isbn-resolve-batch'), as_json({'isbns': data.isbns})),
+        'isbn-resolve': (None, 'get', reverse('isbn-resolve', args=[data.isbns[-1]]), {}),
+        'typeahead': (None, 'get', reverse('typeahead'), {'data': {'q': 'Boo'}}),
+        'circulation-batch': (librarian, 'post', reverse('circulation-batch'), as_json({
+            'batch_key': 'sweep', 'action': 'renew', 'copies': [str(copy.pk) for copy in data.loans],
+        })),
+        'user-nav': (patron, 'get', reverse('user-nav'), {'data': {'next': reverse('books')}}),
+        'stocktake-upload': (librarian, 'post', reverse('stocktake-upload'), {'data': {
+            'stocktake': data.stocktake.pk, 'file': SimpleUploadedFile('scans.txt', '\n'.join(data.scans).encode()),
+        }}),
+        'stocktake-report': (librarian, 'get', reverse('stocktake-report', args=[data.stocktake.pk]), {}),
+        'sitemap-index': (None, 'get', reverse('sitemap-index'), {}),
+        'sitemap-section': (None, 'get', reverse('sitemap-section', args=['books', 1]), {}),
+        'loan-report': (librarian, 'get', reverse('loan-report'), {'data': {'dimension': LoanRollup.BOOK}}),
+    }
+
+
+def _request(user, method, path, kwargs):
+    client = Client()
+    if user is not None:
+        client.force_login(user)
+    # Cold caches, so both scales run the same cache misses.
+    cache.clear()
+    genres.reset()
+    typeahead.reset()
+    with QueryLog() as log:
+        response = getattr(client, method)(path, **kwargs)
+        if response.streaming:
+            b''.join(response.streaming_content)
+    return response.status_code, log
+
+
+def sweep(scales=SCALES, names=None):
+    """
+    Requests the swept URLs (or only `names`) once per scale. Each scale is seeded in a transaction that is
+    rolled back, and each request runs in its own rolled back savepoint.
+    Returns {url name: [(status code, QueryLog) per scale]}.
+    """
+    results = collections.defaultdict(list)
+    for scale in scales:
+        with transaction.atomic():
+            data = seed(scale)
+            for name, (user, method, path, kwargs) in sweep_requests(data).items():
+                if names and name not in names:
+                    continue
+                with transaction.atomic():
+                    results[name].append(_request(user, method, path, kwargs))
+                    transaction.set_rollback(True)
+            transaction.set_rollback(True)
+    return dict(results)
+
+
+def failures(results):
+    """
+    Returns a description of each swept URL that failed or whose query count grows with the data.
+    """
+    problems = []
+    for name, runs in results.items():
+        errors = [status for status, _ in runs if status >= 400]
+        if errors:
+            problems.append('%s responds with HTTP %d.' % (name, errors[0]))
+            continue
+        try:
+            check_growth(runs[0][1], runs[-1][1], name)
+        except QueryBudgetExceeded as error:
+            problems.append(str(error))
+    return problems
@@ -0,0 +1,113 @@
+"""
+"Patrons who borrowed this also borrowed" recommendations.
+
+The book x book co-occurrence matrix is never materialised in Python: it is
+computed by the database as a self-join of the distinct (borrower, book)
+pairs from the circulation event log, ranked with a window function, and only
+the top-K neighbours per book are inserted into BookRecommendation. Serving is
+one indexed lookup on (book, position).
+
+An incremental refresh recomputes only the books of the patrons who borrowed
+something since the last run (tracked with a RollupState high-water mark
+that, like the rollups, only moves over settled events).
+"""
+from django.db import connection, transaction
+
+from .models import Book, BookRecommendation, LoanEvent, RollupState
+from .rollups import settled_event_id
+
+STATE_NAME = 'book_recommendations'
+
+TOP_K = 10
+
+PAIRS_SQL = """
+    pairs AS (
+        SELECT DISTINCT borrower_id, book_id
+        FROM {event}
+        WHERE kind = %s AND borrower_id IS NOT NULL AND id <= %s
+          AND book_id IN (SELECT id FROM {book})
+    )
+"""
+
+AFFECTED_SQL = """
+    SELECT book_id FROM pairs
+    WHERE borrower_id IN (SELECT borrower_id FROM {event} WHERE kind = %s AND id > %s AND id <= %s)
+"""
+
+INSERT_SQL = """
+    INSERT INTO {recommendation} (book_id, recommended_id, score, position)
+    WITH {pairs}
+    SELECT book_id, recommended_id, score, position FROM (
+        SELECT a.book_id AS book_id, b.book_id AS recommended_id, COUNT(*) AS score,
+               ROW_NUMBER() OVER (PARTITION BY a.book_id ORDER BY COUNT(*) DESC, b.book_id) AS position
+        FROM pairs a
+        INNER JOIN pairs b ON a.borrower_id = b.borrower_id AND a.book_id <> b.book_id
+        {where}
+        GROUP BY a.book_id, b.book_id
+    ) ranked
+    WHERE position <= %s
+"""
+
+DELETE_SQL = """
+    WITH {pairs}
+    DELETE FROM {recommendation}
+    WHERE book_id IN ({affected})
+"""
+
+
+def _tables():
+    return {
+        'event': connection.ops.quote_name(LoanEvent._meta.db_table),
+        'book': connection.ops.quote_name(Book._meta.db_table),
+        'recommendation': connection.ops.quote_name(BookRecommendation._meta.db_table),
+    }
+
+
+def build_recommendations(full=False, top_k=TOP_K):
+    """
+    Refreshes the top-K neighbour table from the circulation event log.
+    With `full` every book is recomputed, otherwise only books touched by new checkouts.
+    Returns the number of recommendation rows written.
+    """
+    with transaction.atomic():
+        state, _ = RollupState.objects.select_for_update().get_or_create(name=STATE_NAME)
+        upper = settled_event_id(state.last_event_id)
+        if upper <= state.last_event_id and not full:
+            return 0
+
+        tables = _tables()
+        pairs = PAIRS_SQL.format(**tables)
+        pairs_params = [LoanEvent.CHECKOUT, upper]
+        affected = AFFECTED_SQL.format(**tables)
+        affected_params = [LoanEvent.CHECKOUT, state.last_event_id, upper]
+
+        with connection.cursor() as cursor:
+            if full:
+                BookRecommendation.objects.all().delete()
+                where, where_params = '', []
+            else:
+                cursor.execute(
+                    DELETE_SQL.format(pairs=pairs, affected=affected, **tables),
+                    pairs_params + affected_params,
+                )
+                where, where_params = 'WHERE a.book_id IN (%s)' % affected, affected_params
+            cursor.execute(
+                INSERT_SQL.format(pairs=pairs, where=where, **tables),
+                pairs_params + where_params + [top_k],
+            )
+            written = cursor.rowcount
+
+        state.last_event_id = upper
+        state.save(update_fields=['last_event_id', 'updated'])
+    return written
+
+
+def recommended_books(book, limit=5):
+    """
+    Returns the books most often borrowed by patrons who borrowed `book`.
+    """
+    return [
+        recommendation.recommended
+        for recommendation in BookRecommendation.objects.filter(book=book)
+        .select_related('recommended')[:limit]
+    ]
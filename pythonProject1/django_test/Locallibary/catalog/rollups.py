@@ -0,0 +1,115 @@
+"""
+Incremental daily rollups of the circulation event log.
+
+Every run aggregates the LoanEvent rows above the stored high-water mark into
+LoanRollup (per book, genre and author and per day) and moves the mark forward
+in the same transaction, so a run is cheap no matter how long the history is.
+
+Event ids are assigned on insert but become visible on commit, so on
+PostgreSQL a transaction may commit a lower id after a higher one has been
+folded. Runs (and the recommendations refresh) therefore stop at the first
+event created less than ROLLUP_SETTLE_SECONDS ago: a lower id still
+uncommitted by then would belong to a transaction open for longer than
+that, which circulation never keeps.
+"""
+import datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Q
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import LoanEvent, LoanRollup, RollupState
+
+STATE_NAME = 'loan_events'
+
+# LoanRollup dimension -> LoanEvent lookup giving the key of the row.
+DIMENSION_KEYS = {
+    LoanRollup.BOOK: 'book_id',
+    LoanRollup.GENRE: 'book__genre',
+    LoanRollup.AUTHOR: 'book__author_id',
+}
+
+COUNTERS = {
+    'checkouts': Count('id', filter=Q(kind=LoanEvent.CHECKOUT)),
+    'returns': Count('id', filter=Q(kind=LoanEvent.RETURN)),
+    'renewals': Count('id', filter=Q(kind=LoanEvent.RENEWAL)),
+}
+
+
+def _settled_before():
+    return timezone.now() - datetime.timedelta(seconds=getattr(settings, 'ROLLUP_SETTLE_SECONDS', 5 * 60))
+
+
+def settled_event_id(after=0):
+    """
+    Returns the id up to which the events above `after` can be folded: the last one before the first event
+    created less than ROLLUP_SETTLE_SECONDS ago (`after` when there is none).
+    """
+    events = LoanEvent.objects.filter(id__gt=after)
+    first_unsettled = events.filter(created__gte=_settled_before()).values_list('id', flat=True).first()
+    if first_unsettled is not None:
+        events = events.filter(id__lt=first_unsettled)
+    return events.aggregate(upper=Max('id'))['upper'] or after
+
+
+def rollup_loan_events(batch_size=50000):
+    """
+    Folds all new settled events into the rollups, `batch_size` events per transaction.
+    Returns the number of events processed.
+    """
+    processed = 0
+    while True:
+        with transaction.atomic():
+            state, _ = RollupState.objects.select_for_update().get_or_create(name=STATE_NAME)
+            ids = list(
+                LoanEvent.objects.filter(id__gt=state.last_event_id, id__lte=settled_event_id(state.last_event_id))
+                .order_by('id').values_list('id', flat=True)[:batch_size]
+            )
+            if not ids:
+                return processed
+            _apply(LoanEvent.objects.filter(id__gt=state.last_event_id, id__lte=ids[-1]))
+            state.last_event_id = ids[-1]
+            state.save(update_fields=['last_event_id', 'updated'])
+        processed += len(ids)
+
+
+def _apply(events):
+    totals = {}
+    for dimension, key in DIMENSION_KEYS.items():
+        rows = (
+            events.exclude(**{key + '__isnull': True})
+            .annotate(day=TruncDate('created'))
+            .values('day', key)
+            .annotate(**COUNTERS)
+            .order_by()
+        )
+        for row in rows:
+            if row['checkouts'] or row['returns'] or row['renewals']:
+                totals[(dimension, row[key], row['day'])] = row
+
+    if not totals:
+        return
+
+    existing = LoanRollup.objects.filter(
+        dimension__in={dimension for dimension, _, _ in totals},
+        key__in={key for _, key, _ in totals},
+        day__in={day for _, _, day in totals},
+    )
+    to_update = []
+    for rollup in existing:
+        row = totals.pop((rollup.dimension, rollup.key, rollup.day), None)
+        if row is not None:
+            for counter in COUNTERS:
+                setattr(rollup, counter, getattr(rollup, counter) + row[counter])
+            to_update.append(rollup)
+
+    LoanRollup.objects.bulk_update(to_update, list(COUNTERS), batch_size=1000)
+    LoanRollup.objects.bulk_create(
+        [
+            LoanRollup(dimension=dimension, key=key, day=day, **{counter: row[counter] for counter in COUNTERS})
+            for (dimension, key, day), row in totals.items()
+        ],
+        batch_size=1000,
+    )
@@ -0,0 +1,138 @@
+"""
+Signal handlers of the catalog application (connected in CatalogConfig.ready).
+"""
+from django.contrib.auth.models import Group, Permission, User
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from . import backends, branches, events, facets, genres, limits, live, loans, similarity, typeahead
+from .cache import bump_version
+from .models import Author, Book, BookInstance, Branch, Genre
+
+# Shown for each copy on the book detail page; status and branch also decide its availability.
+COPY_DETAIL_FIELDS = ('status', 'book_id', 'branch_id', 'due_back')
+
+
+@receiver(post_save, sender=BookInstance)
+def book_instance_saved(sender, instance, created, raw=False, **kwargs):
+    """
+    Writes loan workflow and admin changes of a copy to the circulation event log,
+    invalidates what shows its availability when that or its details changed, counts loans
+    given or ended against the borrowers' loan counters, invalidates the cached
+    loan pages of its borrowers and publishes the change to live availability
+    streams.
+    """
+    if raw:
+        return
+    old = None if created else instance.tracked_values
+    events.record_change(instance, old)
+    if any((old or {}).get(name) != getattr(instance, name) for name in COPY_DETAIL_FIELDS):
+        facets.availability_changed([instance.book_id, (old or {}).get('book_id')])
+    if any((old or {}).get(name) != getattr(instance, name) for name in ('status', 'borrower_id')):
+        limits.copy_changed(old, instance)
+    if any((old or {}).get(name) != getattr(instance, name) for name in BookInstance.TRACKED_FIELDS):
+        loans.invalidate_loans([instance.borrower_id, (old or {}).get('borrower_id')])
+    if any((old or {}).get(name) != getattr(instance, name) for name in ('status', 'due_back', 'borrower_id')):
+        live.publish_on_commit(live.copy_messages(instance, (old or {}).get('borrower_id')))
+    instance.remember_tracked_values()
+
+
+@receiver(post_delete, sender=BookInstance)
+def book_instance_deleted(sender, instance, **kwargs):
+    if instance.status == 'o':
+        limits.adjust_counters({instance.borrower_id: -1})
+    loans.invalidate_loans([instance.borrower_id])
+    facets.availability_changed([instance.book_id])
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+@receiver(post_save, sender=Genre)
+@receiver(post_delete, sender=Genre)
+def invalidate_facets(sender, raw=False, **kwargs):
+    if not raw:
+        bump_version(facets.VERSION_NAME)
+
+
+@receiver(post_save, sender=Book)
+def index_saved_book(sender, instance, raw=False, **kwargs):
+    """
+    Refreshes the "more like this" postings of a saved book.
+    """
+    if not raw:
+        similarity.index_book(instance)
+
+
+@receiver(m2m_changed, sender=Book.genre.through)
+def index_book_genres(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Refreshes the postings of the books whose genres changed and invalidates the facets.
+    """
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    bump_version(facets.VERSION_NAME)
+    if not reverse:
+        similarity.index_book(instance)
+    elif pk_set:
+        for book in Book.objects.filter(pk__in=pk_set):
+            similarity.index_book(book)
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+@receiver(post_save, sender=Author)
+@receiver(post_delete, sender=Author)
+def invalidate_typeahead(sender, raw=False, **kwargs):
+    if not raw:
+        bump_version(typeahead.VERSION_NAME)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, raw=False, **kwargs):
+    if not raw:
+        backends.invalidate_user(instance.pk)
+
+
+@receiver(m2m_changed, sender=User.user_permissions.through)
+@receiver(m2m_changed, sender=User.groups.through)
+def invalidate_user_permissions(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Invalidates the cached permissions of users whose permissions or groups changed.
+    """
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        backends.invalidate_user(instance.pk)
+    elif pk_set:
+        for user_id in pk_set:
+            backends.invalidate_user(user_id)
+    else:
+        # A permission or group was cleared of all its users.
+        backends.invalidate_all()
+
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+def invalidate_group_permissions(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        backends.invalidate_all()
+
+
+@receiver(post_delete, sender=Group)
+@receiver(post_delete, sender=Permission)
+def invalidate_all_permissions(sender, **kwargs):
+    backends.invalidate_all()
+
+
+@receiver(post_save, sender=Genre)
+@receiver(post_delete, sender=Genre)
+def invalidate_genres(sender, raw=False, **kwargs):
+    if not raw:
+        bump_version(genres.VERSION_NAME)
+
+
+@receiver(post_save, sender=Branch)
+@receiver(post_delete, sender=Branch)
+def invalidate_branches(sender, raw=False, **kwargs):
+    if not raw:
+        bump_version(branches.VERSION_NAME)
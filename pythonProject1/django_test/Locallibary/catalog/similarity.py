@@ -0,0 +1,144 @@
+"""
+"More like this" content similarity over Book.summary, Book.title and Book.genre.
+
+Every book is turned into a sparse vector of hashed terms (sublinear term
+frequency, L2-normalised) stored as postings in BookTerm. A query weights the
+terms of the book with IDF from TermStat, keeps the strongest of the weighted
+terms (so a boosted genre term shared by thousands of books does not get in
+on its raw weight) and lets the database compute all dot products in one
+grouped query over the term index.
+
+Postings are refreshed whenever a book or its genres are saved. Document
+frequencies only drift slowly, so TermStat is rebuilt by `build_similarity`.
+"""
+import heapq
+import math
+import re
+import zlib
+from collections import Counter
+
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Case, Count, F, FloatField, Sum, Value, When
+
+from .genres import attach_genre_names, names_by_book
+from .models import Book, BookTerm, TermStat
+
+DIMENSIONS = 1 << 22
+
+# Only the strongest IDF-weighted terms of the query book are matched, which bounds the work per query.
+QUERY_TERMS = 20
+
+GENRE_BOOST = 2.0
+
+BOOK_COUNT_KEY = 'catalog:similarity:books'
+
+STOP_WORDS = frozenset("""
+    a an and are as at be but by for from has have he her his in is it its of on or she that the their them
+    they this to was were which who will with about after all also been into more not one over than then
+    there these when would
+""".split())
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def term_id(token):
+    return zlib.crc32(token.encode('utf-8')) % DIMENSIONS
+
+
+def vectorize(title, summary, genre_names):
+    """
+    Returns the normalised {term: weight} vector of a book.
+    """
+    words = [
+        word for word in WORD_RE.findall(('%s %s' % (title, summary)).lower())
+        if len(word) > 2 and word not in STOP_WORDS
+    ]
+    counts = Counter(term_id(word) for word in words)
+    vector = {term: 1.0 + math.log(count) for term, count in counts.items()}
+    for name in genre_names:
+        term = term_id('genre:' + name.lower())
+        vector[term] = vector.get(term, 0.0) + GENRE_BOOST
+
+    norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+    if not norm:
+        return {}
+    return {term: weight / norm for term, weight in vector.items()}
+
+
+def index_book(book):
+    """
+    Replaces the postings of one book (called when a book or its genres are saved).
+    """
+    vector = vectorize(book.title, book.summary, names_by_book([book.pk])[book.pk])
+    with transaction.atomic():
+        BookTerm.objects.filter(book=book).delete()
+        BookTerm.objects.bulk_create(
+            [BookTerm(book=book, term=term, weight=weight) for term, weight in vector.items()]
+        )
+
+
+def build_similarity(chunk_size=2000):
+    """
+    Rebuilds all postings and the document frequencies. Returns the number of books indexed.
+    """
+    indexed = 0
+    with transaction.atomic():
+        BookTerm.objects.all().delete()
+        # Postings are written with executemany(): model instances would dominate the rebuild time.
+        insert = 'INSERT INTO %s (book_id, term, weight) VALUES (%%s, %%s, %%s)' % (
+            connection.ops.quote_name(BookTerm._meta.db_table)
+        )
+        last_id = 0
+        with connection.cursor() as cursor:
+            while True:
+                books = list(
+                    Book.objects.filter(id__gt=last_id).order_by('id')
+                    .only('id', 'title', 'summary')[:chunk_size]
+                )
+                if not books:
+                    break
+                postings = []
+                for book in attach_genre_names(books):
+                    vector = vectorize(book.title, book.summary, book.genre_names)
+                    postings.extend((book.id, term, weight) for term, weight in vector.items())
+                cursor.executemany(insert, postings)
+                indexed += len(books)
+                last_id = books[-1].id
+
+        TermStat.objects.all().delete()
+        TermStat.objects.bulk_create(
+            (TermStat(term=row['term'], books=row['books'])
+             for row in BookTerm.objects.values('term').annotate(books=Count('id')).order_by()),
+            batch_size=5000,
+        )
+    cache.delete(BOOK_COUNT_KEY)
+    return indexed
+
+
+def similar_books(book, limit=5):
+    """
+    Returns up to `limit` books whose summary and genres are most similar to `book`.
+    """
+    postings = dict(BookTerm.objects.filter(book=book).values_list('term', 'weight'))
+    if not postings:
+        return []
+
+    total = cache.get_or_set(BOOK_COUNT_KEY, Book.objects.count, 3600)
+    frequencies = dict(TermStat.objects.filter(term__in=postings).values_list('term', 'books'))
+    idf = {term: math.log((1 + total) / (1 + frequencies.get(term, 0))) + 1.0 for term in postings}
+    weights = {term: weight * idf[term] * idf[term] for term, weight in postings.items()}
+    query = {term: weights[term] for term in heapq.nlargest(QUERY_TERMS, weights, key=weights.get)}
+
+    scores = (
+        BookTerm.objects.filter(term__in=query).exclude(book=book)
+        .values('book')
+        .annotate(score=Sum(F('weight') * Case(
+            *[When(term=term, then=Value(weight)) for term, weight in query.items()],
+            output_field=FloatField(),
+        )))
+        .order_by('-score', 'book')[:limit]
+    )
+    ids = [row['book'] for row in scores]
+    books = Book.objects.in_bulk(ids)
+    return [books[book_id] for book_id in ids if book_id in books]
@@ -0,0 +1,127 @@
+"""
+Sitemaps of all book and author pages, streamed without loading model instances.
+
+Each section (books, authors) is split into files by primary key range:
+file N holds the rows with pk in [(N - 1) * SITEMAP_URLS_PER_FILE + 1,
+N * SITEMAP_URLS_PER_FILE], so a file never exceeds the 50,000 URL limit of
+the sitemap protocol and is read with one range scan of (id, updated)
+pairs. URLs are built from a %-template of the URL pattern instead of
+reverse() per row. The index (non-empty files and their newest
+modification) comes from one grouped query per section and is cached for
+INDEX_TIMEOUT seconds.
+
+`manage.py build_sitemaps` writes the same files gzipped to a directory, to
+be served directly by the web server.
+"""
+import gzip
+import os
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F, Max
+
+from .models import Author, Book
+
+SECTIONS = {
+    'books': (Book, 'book-detail'),
+    'authors': (Author, 'author-detail'),
+}
+
+INDEX_KEY = 'catalog:sitemap-index:%d'
+INDEX_TIMEOUT = 60 * 60
+
+# Lines written to the response (or file) at a time.
+WRITE_BATCH = 1000
+
+XML_HEADER = '<?xml version="1.0" encoding="UTF-8"?>\n'
+NAMESPACE = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+
+
+def urls_per_file():
+    return getattr(settings, 'SITEMAP_URLS_PER_FILE', 50000)
+
+
+def _lastmod(value):
+    return value.isoformat(timespec='seconds') if value is not None else None
+
+
+def index_entries(refresh=False):
+    """
+    Returns [(section, file number, lastmod)] of all non-empty sitemap files.
+    """
+    per_file = urls_per_file()
+    key = INDEX_KEY % per_file
+    entries = None if refresh else cache.get(key)
+    if entries is None:
+        entries = []
+        for section, (model, _) in SECTIONS.items():
+            files = (
+                model.objects.annotate(file=(F('id') - 1) / per_file + 1).order_by().values('file')
+                .annotate(lastmod=Max('updated')).order_by('file')
+            )
+            entries.extend((section, row['file'], _lastmod(row['lastmod'])) for row in files)
+        cache.set(key, entries, INDEX_TIMEOUT)
+    return entries
+
+
+def render_index(file_url):
+    """
+    Yields the sitemap index; `file_url(section, number)` returns the absolute URL of a file.
+    """
+    yield XML_HEADER + '<sitemapindex xmlns="%s">\n' % NAMESPACE
+    for section, number, lastmod in index_entries():
+        entry = '<sitemap><loc>%s</loc>' % escape(file_url(section, number))
+        if lastmod:
+            entry += '<lastmod>%s</lastmod>' % lastmod
+        yield entry + '</sitemap>\n'
+    yield '</sitemapindex>\n'
+
+
+def render_section(section, number, url_template):
+    """
+    Yields one sitemap file in chunks; `url_template` is an absolute URL with %s in place of the pk.
+    """
+    model, _ = SECTIONS[section]
+    per_file = urls_per_file()
+    rows = (
+        model.objects.filter(id__gt=(number - 1) * per_file, id__lte=number * per_file)
+        .order_by('id').values_list('id', 'updated')
+    )
+    template = escape(url_template)
+    yield XML_HEADER + '<urlset xmlns="%s">\n' % NAMESPACE
+    lines = []
+    for pk, updated in rows.iterator(chunk_size=5000):
+        lines.append('<url><loc>%s</loc><lastmod>%s</lastmod></url>\n' % (template % pk, _lastmod(updated)))
+        if len(lines) == WRITE_BATCH:
+            yield ''.join(lines)
+            lines = []
+    yield ''.join(lines) + '</urlset>\n'
+
+
+def write_files(directory, base_url, file_url_prefix, url_templates):
+    """
+    Writes sitemap.xml and the gzipped section files into `directory`. Returns the number of files written.
+    `url_templates` maps each section to its absolute URL template.
+    """
+    os.makedirs(directory, exist_ok=True)
+    written = []
+    for section, number, _ in index_entries(refresh=True):
+        filename = 'sitemap-%s-%d.xml.gz' % (section, number)
+        with gzip.open(os.path.join(directory, filename + '.tmp'), 'wt', encoding='utf-8') as file:
+            file.writelines(render_section(section, number, url_templates[section]))
+        os.replace(os.path.join(directory, filename + '.tmp'), os.path.join(directory, filename))
+        written.append(filename)
+
+    def file_url(section, number):
+        return '%s%ssitemap-%s-%d.xml.gz' % (base_url, file_url_prefix, section, number)
+
+    with open(os.path.join(directory, 'sitemap.xml.tmp'), 'w', encoding='utf-8') as file:
+        file.writelines(render_index(file_url))
+    os.replace(os.path.join(directory, 'sitemap.xml.tmp'), os.path.join(directory, 'sitemap.xml'))
+
+    # Files of ranges that no longer have rows.
+    for filename in os.listdir(directory):
+        if filename.startswith('sitemap-') and filename.endswith('.xml.gz') and filename not in written:
+            os.remove(os.path.join(directory, filename))
+    return len(written) + 1
@@ -0,0 +1,254 @@
+"""
+Static HTML snapshot of the public catalog pages, for serving from a CDN or
+a plain web server when the application is down or under heavy load.
+
+The pages are rendered by the views themselves (for an anonymous visitor
+without a branch) and written under the output directory by URL path:
+/catalog/book/5/ becomes catalog/book/5/index.html. Page N > 1 of the book
+list is written to catalog/books/page-N.html; the web server maps
+/catalog/books/?page=N to it.
+
+The work is cut into tasks of `chunk_size` objects (by primary key, from
+one id scan) or book list pages, and a pool of processes renders them; every
+process keeps its compiled templates (Django's cached template loader) for
+all its tasks. The book list is not paginated with OFFSET: the first
+(title, id) of every page is collected in the same ordered scan, so each
+page is one index range read however deep it is.
+
+An incremental snapshot re-renders the index and the book list, and only the
+detail pages of books and authors changed since the previous snapshot: rows
+whose `updated` is newer, books with loan events since then, the authors of
+changed books, the books of changed authors and the pages whose rendering
+failed last time (kept in the state file). Loan events are followed up to
+the last settled one (see catalog/rollups.py), so an event committed late
+is still seen. Changes that touch neither (templates, genre names,
+recommendations) need a full snapshot. Pages of deleted objects are left in
+place; snapshot into an empty directory to drop them.
+"""
+import json
+import logging
+import multiprocessing
+import os
+from collections import namedtuple
+
+import django
+from django.contrib.auth.models import AnonymousUser
+from django.core.paginator import Page
+from django.db import connections
+from django.http import Http404
+from django.test import RequestFactory
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import views
+from .models import Author, Book, LoanEvent
+from .rollups import settled_event_id
+
+logger = logging.getLogger(__name__)
+
+STATE_FILE = '.snapshot.json'
+
+CHUNK_SIZE = 1000
+PAGES_PER_TASK = 200
+
+Result = namedtuple('Result', 'rendered missing failed')
+
+
+class _BookListPage(views.BookListView):
+    """
+    BookListView for one snapshot page, which starts at a known (title, id) instead of an OFFSET.
+    """
+    def paginate_queryset(self, queryset, page_size):
+        number, title, pk = self.kwargs['page']
+        if pk is None:
+            books = []
+        else:
+            books = list(queryset.filter(title__gte=title).exclude(title=title, id__lt=pk)[:page_size])
+        paginator = self.get_paginator(queryset, page_size)
+        paginator.count = self.kwargs['count']
+        return paginator, Page(books, number, paginator), books, paginator.num_pages > 1
+
+
+_views = {
+    'index': views.index,
+    'books': _BookListPage.as_view(),
+    'book': views.BookDetailView.as_view(),
+    'author': views.AuthorDetailView.as_view(),
+}
+
+_worker = {}
+
+
+def list_page_filename(number):
+    return 'catalog/books/index.html' if number == 1 else 'catalog/books/page-%d.html' % number
+
+
+def _filename(path):
+    return path.lstrip('/') + 'index.html'
+
+
+def _init_worker(directory):
+    django.setup()
+    _worker['directory'] = directory
+    _worker['factory'] = RequestFactory()
+    _worker['templates'] = {
+        'book': views.url_template('book-detail'),
+        'author': views.url_template('author-detail'),
+    }
+
+
+def _render(kind, path, filename, **kwargs):
+    request = _worker['factory'].get(path)
+    request.user = AnonymousUser()
+    request.session = {}
+    response = _views[kind](request, **kwargs)
+    if hasattr(response, 'render'):
+        response.render()
+    target = os.path.join(_worker['directory'], filename)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(target + '.tmp', 'wb') as file:
+        file.write(response.content)
+    os.replace(target + '.tmp', target)
+
+
+def _run_task(task):
+    """
+    Renders the pages of one task. Returns (rendered, missing, [paths that failed], [(kind, pk) that failed]).
+    """
+    kind, items, extra = task
+    if kind == 'index':
+        pages = [(reverse('index'), _filename(reverse('index')), {})]
+    elif kind == 'books':
+        path = reverse('books')
+        pages = [(path, list_page_filename(page[0]), {'page': page, 'count': extra}) for page in items]
+    else:
+        template = _worker['templates'][kind]
+        pages = [(template % pk, _filename(template % pk), {'pk': pk}) for pk in items]
+
+    rendered = missing = 0
+    failed = []
+    failed_objects = []
+    for path, filename, kwargs in pages:
+        try:
+            _render(kind, path, filename, **kwargs)
+        except Http404:
+            missing += 1
+        except Exception:
+            logger.exception('Snapshot of %s failed', path)
+            failed.append(path)
+            if 'pk' in kwargs:
+                failed_objects.append((kind, kwargs['pk']))
+        else:
+            rendered += 1
+    return rendered, missing, failed, failed_objects
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _list_pages():
+    """
+    Returns the (number, first title, first id) of every book list page and the number of books.
+    """
+    per_page = views.BookListView.paginate_by
+    pages = []
+    count = 0
+    for title, pk in Book.objects.order_by('title', 'id').values_list('title', 'id').iterator(chunk_size=10000):
+        if count % per_page == 0:
+            pages.append((len(pages) + 1, title, pk))
+        count += 1
+    return pages or [(1, None, None)], count
+
+
+def _changed(state):
+    """
+    Returns the sorted pks of the books and the authors changed since the snapshot of `state`.
+    """
+    since = parse_datetime(state['started'])
+    failed = state.get('failed', {})
+    changed_authors = Author.objects.filter(updated__gte=since)
+    book_ids = set(Book.objects.filter(updated__gte=since).values_list('id', flat=True))
+    book_ids.update(
+        LoanEvent.objects.filter(id__gt=state['last_event_id'], book__isnull=False)
+        .order_by().values_list('book_id', flat=True).distinct()
+    )
+    # Book pages show the author's name.
+    book_ids.update(Book.objects.filter(author__in=changed_authors).values_list('id', flat=True))
+    book_ids.update(failed.get('book', ()))
+    author_ids = set(changed_authors.values_list('id', flat=True))
+    author_ids.update(
+        Book.objects.filter(updated__gte=since, author__isnull=False)
+        .order_by().values_list('author_id', flat=True).distinct()
+    )
+    author_ids.update(failed.get('author', ()))
+    return sorted(book_ids), sorted(author_ids)
+
+
+def tasks(state=None, chunk_size=CHUNK_SIZE):
+    """
+    Returns the rendering tasks: everything, or with the `state` of a previous snapshot only what changed.
+    """
+    pages, count = _list_pages()
+    result = [('index', None, None)]
+    result.extend(('books', chunk, count) for chunk in _chunks(pages, PAGES_PER_TASK))
+    if state is None:
+        book_ids = list(Book.objects.order_by('id').values_list('id', flat=True).iterator(chunk_size=10000))
+        author_ids = list(Author.objects.order_by('id').values_list('id', flat=True))
+    else:
+        book_ids, author_ids = _changed(state)
+    result.extend(('book', chunk, None) for chunk in _chunks(book_ids, chunk_size))
+    result.extend(('author', chunk, None) for chunk in _chunks(author_ids, chunk_size))
+    return result
+
+
+def read_state(directory):
+    try:
+        with open(os.path.join(directory, STATE_FILE)) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def snapshot(directory, processes=1, incremental=False, chunk_size=CHUNK_SIZE):
+    """
+    Writes the snapshot into `directory`; incremental re-renders only what changed since the last one
+    (everything if there was none). Returns a Result.
+    """
+    os.makedirs(directory, exist_ok=True)
+    previous = read_state(directory) if incremental else None
+    # Taken before rendering, so changes made meanwhile are picked up by the next snapshot.
+    state = {
+        'started': timezone.now().isoformat(),
+        'last_event_id': settled_event_id(previous['last_event_id'] if previous else 0),
+        'failed': {'book': [], 'author': []},
+    }
+    work = tasks(previous, chunk_size)
+
+    rendered = missing = 0
+    failed = []
+
+    def collect(results):
+        nonlocal rendered, missing
+        for task_rendered, task_missing, task_failed, task_failed_objects in results:
+            rendered += task_rendered
+            missing += task_missing
+            failed.extend(task_failed)
+            for kind, pk in task_failed_objects:
+                state['failed'][kind].append(pk)
+
+    if processes == 1:
+        _init_worker(directory)
+        collect(map(_run_task, work))
+    else:
+        # Children must not share the parent's database connections.
+        connections.close_all()
+        with multiprocessing.Pool(processes, initializer=_init_worker, initargs=(directory,)) as pool:
+            collect(pool.imap_unordered(_run_task, work))
+
+    with open(os.path.join(directory, STATE_FILE + '.tmp'), 'w') as file:
+        json.dump(state, file)
+    os.replace(os.path.join(directory, STATE_FILE + '.tmp'), os.path.join(directory, STATE_FILE))
+    return Result(rendered, missing, failed)
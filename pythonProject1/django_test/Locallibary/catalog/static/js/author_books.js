@@ -0,0 +1,21 @@
+// "Load more" for an author's books: appends the next page from the author books endpoint.
+$(function () {
+  var button = $('#load-more-books');
+  var books = $('#author-books');
+
+  button.on('click', function (event) {
+    event.preventDefault();
+    $.getJSON(button.data('url'), {page: button.data('page')}, function (data) {
+      $.each(data.books, function (_, book) {
+        books.append($('<hr>'));
+        books.append($('<p>').append($('<strong>').text('Title: '), $('<a>').attr('href', book.url).text(book.title)));
+        books.append($('<p>').append($('<strong>').text('Summary: '), document.createTextNode(book.summary)));
+      });
+      if (data.next_page) {
+        button.data('page', data.next_page).attr('href', '?page=' + data.next_page);
+      } else {
+        button.remove();
+      }
+    });
+  });
+});
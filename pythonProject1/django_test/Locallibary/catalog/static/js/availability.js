@@ -0,0 +1,36 @@
+// Live copy status on the book detail and "My borrowed" pages, fed by the catalog availability streams.
+$(function () {
+  // The pages only name a stream when the server can hold it open (under ASGI).
+  var loans = $('.live-loans[data-stream]');
+  if (loans.length && window.EventSource) {
+    // Any change to the user's loans adds or removes a row, so the list is simply reloaded.
+    var loanSource = new EventSource(loans.data('stream'));
+    var reload = function () {
+      loanSource.close();
+      window.location.reload();
+    };
+    loanSource.addEventListener('copy', reload);
+    loanSource.addEventListener('reload', reload);
+  }
+
+  var copies = $('.live-copies[data-stream]');
+  if (!copies.length || !window.EventSource) {
+    return;
+  }
+  var source = new EventSource(copies.data('stream'));
+  var statusClasses = {a: 'text-success', d: 'text-danger'};
+
+  source.addEventListener('copy', function (event) {
+    var copy = JSON.parse(event.data);
+    var element = copies.find('[data-copy-id="' + copy.copy + '"]');
+    element.find('.copy-status')
+      .removeClass('text-success text-danger text-warning')
+      .addClass(statusClasses[copy.status] || 'text-warning')
+      .text(copy.status_display);
+    element.find('.copy-due').prop('hidden', copy.status === 'a').find('span').text(copy.due_back || '');
+  });
+  source.addEventListener('reload', function () {
+    source.close();
+    window.location.reload();
+  });
+});
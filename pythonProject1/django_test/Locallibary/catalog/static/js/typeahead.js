@@ -0,0 +1,27 @@
+// Suggestions for the sidebar search box, served by the catalog typeahead endpoint.
+$(function () {
+  var input = $('#typeahead');
+  var results = $('#typeahead-results');
+  var pending = null;
+  var timer = null;
+
+  input.on('input', function () {
+    clearTimeout(timer);
+    timer = setTimeout(function () {
+      var query = input.val();
+      if (pending) {
+        pending.abort();
+      }
+      if (!query) {
+        results.empty();
+        return;
+      }
+      pending = $.getJSON(input.data('url'), {q: query}, function (data) {
+        results.empty();
+        $.each(data.results, function (_, item) {
+          results.append($('<li>').append($('<a>').attr('href', item.url).text(item.label)));
+        });
+      });
+    }, 100);
+  });
+});
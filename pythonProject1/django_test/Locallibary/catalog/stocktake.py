@@ -0,0 +1,159 @@
+"""
+Inventory stocktake: scanned copy ids reconciled against BookInstance.
+
+A scan file (one copy UUID per line, millions of lines) is streamed into the
+StocktakeScan staging table in sorted chunks written with one executemany()
+each; duplicate scans are ignored by the unique (stocktake, copy id) index, so a
+stocktake can be uploaded shelf by shelf. Nothing is held in memory but the
+current chunk.
+
+The comparison is done by the database with anti-joins against that index:
+
+* missing: copies that should be on the shelf (available or reserved, in the
+  stocktake's branch) but were not scanned;
+* unexpected: scanned ids that are not copies in circulation (for instance
+  archived or unknown copies);
+* mismatched: scanned copies recorded as on loan or in maintenance, or as
+  held by another branch.
+
+The report streams the discrepancies as CSV rows straight from the cursor.
+"""
+import csv
+import uuid
+
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from .models import ArchivedBookInstance, BookInstance, StocktakeScan
+
+CHUNK_SIZE = 100000
+
+# Statuses of copies expected on the shelves.
+ON_SHELF = ('a', 'r')
+
+MISSING = 'missing'
+UNEXPECTED = 'unexpected'
+MISMATCHED = 'mismatched'
+
+INSERT = 'INSERT INTO %s (stocktake_id, copy_id) VALUES (%%s, %%s) ON CONFLICT (stocktake_id, copy_id) DO NOTHING'
+
+REPORT_HEADER = ('discrepancy', 'copy id', 'book', 'status', 'branch')
+
+
+def _write_chunk(stocktake, copy_ids):
+    # Inserted in key order, the chunk fills neighbouring pages of the unique index instead of random ones.
+    copy_ids.sort()
+    if connection.vendor in ('sqlite', 'postgresql'):
+        db = transaction.get_connection()
+        # What UUIDField.get_db_prep_value() returns, without its per-value overhead.
+        native = db.features.has_native_uuid_field
+        with db.cursor() as cursor:
+            cursor.executemany(
+                INSERT % db.ops.quote_name(StocktakeScan._meta.db_table),
+                [(stocktake.pk, copy_id if native else copy_id.hex) for copy_id in copy_ids],
+            )
+    else:
+        StocktakeScan.objects.bulk_create(
+            [StocktakeScan(stocktake=stocktake, copy_id=copy_id) for copy_id in copy_ids], ignore_conflicts=True,
+        )
+
+
+def load_scans(stocktake, lines, chunk_size=CHUNK_SIZE):
+    """
+    Adds the copy ids of `lines` (str or bytes, one UUID per line) to the stocktake's scans.
+    Returns the number of invalid lines; blank lines are skipped.
+    """
+    invalid = 0
+    chunk = []
+    with transaction.atomic():
+        for line in lines:
+            if isinstance(line, bytes):
+                line = line.decode('ascii', 'replace')
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                chunk.append(uuid.UUID(line))
+            except ValueError:
+                invalid += 1
+                continue
+            if len(chunk) == chunk_size:
+                _write_chunk(stocktake, chunk)
+                chunk = []
+        if chunk:
+            _write_chunk(stocktake, chunk)
+        stocktake.scanned = stocktake.scans.count()
+        stocktake.invalid_lines += invalid
+        stocktake.save(update_fields=['scanned', 'invalid_lines'])
+    return invalid
+
+
+def _scanned(stocktake, copy_id):
+    return Exists(StocktakeScan.objects.filter(stocktake=stocktake, copy_id=copy_id))
+
+
+def missing_copies(stocktake):
+    copies = BookInstance.objects.filter(status__in=ON_SHELF)
+    if stocktake.branch_id is not None:
+        copies = copies.filter(branch_id=stocktake.branch_id)
+    return copies.filter(~_scanned(stocktake, OuterRef('pk')))
+
+
+def unexpected_scans(stocktake):
+    return stocktake.scans.filter(~Exists(BookInstance.objects.filter(pk=OuterRef('copy_id'))))
+
+
+def mismatched_copies(stocktake):
+    wrong = ~Q(status__in=ON_SHELF)
+    if stocktake.branch_id is not None:
+        wrong |= ~Q(branch_id=stocktake.branch_id)
+    return BookInstance.objects.filter(_scanned(stocktake, OuterRef('pk'))).filter(wrong)
+
+
+def reconcile(stocktake):
+    """
+    Counts the discrepancies of the stocktake and stores them on it.
+    """
+    stocktake.missing = missing_copies(stocktake).count()
+    stocktake.unexpected = unexpected_scans(stocktake).count()
+    stocktake.mismatched = mismatched_copies(stocktake).count()
+    stocktake.reconciled = timezone.now()
+    stocktake.save(update_fields=['missing', 'unexpected', 'mismatched', 'reconciled'])
+    return stocktake
+
+
+def discrepancies(stocktake):
+    """
+    Yields (discrepancy, copy id, book title, status, branch name) rows, streamed from the database.
+    """
+    statuses = dict(BookInstance.LOAN_STATUS)
+    columns = ('id', 'book__title', 'status', 'branch__name')
+    for kind, copies in ((MISSING, missing_copies(stocktake)), (MISMATCHED, mismatched_copies(stocktake))):
+        for copy_id, title, status, branch in copies.order_by().values_list(*columns).iterator(chunk_size=5000):
+            yield kind, copy_id, title, statuses.get(status, status), branch
+    scans = unexpected_scans(stocktake).annotate(
+        archived=Exists(ArchivedBookInstance.objects.filter(pk=OuterRef('copy_id')))
+    )
+    for copy_id, archived in scans.order_by().values_list('copy_id', 'archived').iterator(chunk_size=5000):
+        yield UNEXPECTED, copy_id, None, 'Archived' if archived else 'Unknown', None
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+def report_csv(stocktake, batch=1000):
+    """
+    Yields the discrepancy report as CSV text, `batch` rows at a time.
+    """
+    writer = csv.writer(_Echo())
+    yield writer.writerow(REPORT_HEADER)
+    lines = []
+    for row in discrepancies(stocktake):
+        lines.append(writer.writerow(row))
+        if len(lines) == batch:
+            yield ''.join(lines)
+            lines = []
+    yield ''.join(lines)
@@ -0,0 +1,260 @@
+"""
+Database-backed task queue for deferred catalog work.
+
+Tasks are rows of the Task table, so no broker is needed. Workers
+(`manage.py run_worker`) claim due tasks with SELECT ... FOR UPDATE SKIP
+LOCKED where the database supports it, and otherwise (SQLite) with a
+conditional UPDATE that only one worker can win. Failed tasks are retried
+with exponential backoff, a dedup_key keeps one pending copy of a task, and
+PeriodicTask rows are turned into tasks when they are due.
+
+While a task runs, a heartbeat thread refreshes its locked_at; tasks whose
+lock has not been refreshed for LOCK_TIMEOUT belonged to a dead worker and
+are requeued (or failed, once out of attempts) by requeue_stale(). A worker
+only records the outcome of a task it still holds the lock of, so one that
+was presumed dead cannot overwrite the result of the run that replaced it.
+
+Task functions are registered with the @task decorator:
+
+    @task
+    def send_overdue_emails():
+        ...
+
+    enqueue(send_overdue_emails, dedup_key='overdue-emails')
+"""
+import contextlib
+import datetime
+import logging
+import threading
+import time
+import traceback
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .archive import archive_matching
+from .fines import compute_fines
+from .models import PeriodicTask, Task
+from .recommendations import build_recommendations
+from .rollups import rollup_loan_events
+from .similarity import build_similarity
+
+logger = logging.getLogger(__name__)
+
+registry = {}
+
+MAX_BACKOFF = 60 * 60
+
+# Tasks whose lock was not refreshed for this long are assumed to belong to a dead worker.
+LOCK_TIMEOUT = datetime.timedelta(minutes=30)
+
+
+def _heartbeat_interval():
+    return getattr(settings, 'TASK_HEARTBEAT_INTERVAL', LOCK_TIMEOUT.total_seconds() / 3)
+
+
+def task(func):
+    """
+    Registers `func` as a task under its dotted name.
+    """
+    func.task_name = '%s.%s' % (func.__module__, func.__name__)
+    registry[func.task_name] = func
+    return func
+
+
+def enqueue(func, *args, run_at=None, dedup_key=None, max_attempts=5, **kwargs):
+    """
+    Queues a call of a registered task. With `dedup_key`, returns the already pending task instead of
+    queueing a second one.
+    """
+    name = getattr(func, 'task_name', func)
+    if name not in registry:
+        raise KeyError('Unknown task %r' % name)
+    try:
+        with transaction.atomic():
+            return Task.objects.create(
+                name=name, args=list(args), kwargs=kwargs, run_at=run_at or timezone.now(),
+                dedup_key=dedup_key, max_attempts=max_attempts,
+            )
+    except IntegrityError:
+        if dedup_key is None:
+            raise
+        return Task.objects.filter(dedup_key=dedup_key, status__in=[Task.QUEUED, Task.RUNNING]).first()
+
+
+def claim(worker, limit=10):
+    """
+    Marks up to `limit` due tasks as running for `worker` and returns them.
+    """
+    now = timezone.now()
+    due = Task.objects.filter(status=Task.QUEUED, run_at__lte=now).order_by('run_at', 'id')
+
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            tasks = list(due.select_for_update(skip_locked=True)[:limit])
+            Task.objects.filter(pk__in=[t.pk for t in tasks]).update(
+                status=Task.RUNNING, locked_by=worker, locked_at=now
+            )
+    else:
+        # Another worker may claim the same candidates; the status check makes each claim atomic.
+        tasks = []
+        for candidate in due[:limit]:
+            claimed = Task.objects.filter(pk=candidate.pk, status=Task.QUEUED).update(
+                status=Task.RUNNING, locked_by=worker, locked_at=now
+            )
+            if claimed:
+                tasks.append(candidate)
+
+    for claimed_task in tasks:
+        claimed_task.status, claimed_task.locked_by, claimed_task.locked_at = Task.RUNNING, worker, now
+    return tasks
+
+
+def heartbeat(claimed_task):
+    """
+    Refreshes the lock of a running task. Returns False when its worker no longer holds the lock.
+    """
+    return bool(Task.objects.filter(
+        pk=claimed_task.pk, status=Task.RUNNING, locked_by=claimed_task.locked_by,
+    ).update(locked_at=timezone.now()))
+
+
+@contextlib.contextmanager
+def _heartbeats(claimed_task):
+    stop = threading.Event()
+
+    def beat():
+        try:
+            while not stop.wait(_heartbeat_interval()):
+                if not heartbeat(claimed_task):
+                    return
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=beat, name='heartbeat-%s' % claimed_task.pk, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def run(claimed_task):
+    """
+    Runs a claimed task and records its outcome, scheduling a retry with backoff on failure.
+    Returns False when the outcome was not recorded because the worker had lost the lock of the task.
+    """
+    claimed_task.attempts += 1
+    try:
+        with _heartbeats(claimed_task):
+            registry[claimed_task.name](*claimed_task.args, **claimed_task.kwargs)
+    except Exception:
+        claimed_task.last_error = traceback.format_exc()
+        if claimed_task.attempts < claimed_task.max_attempts:
+            claimed_task.status = Task.QUEUED
+            claimed_task.run_at = timezone.now() + datetime.timedelta(
+                seconds=min(2 ** claimed_task.attempts, MAX_BACKOFF)
+            )
+        else:
+            claimed_task.status = Task.FAILED
+            claimed_task.finished = timezone.now()
+        logger.warning('Task %s failed (attempt %d)', claimed_task, claimed_task.attempts)
+    else:
+        claimed_task.status = Task.DONE
+        claimed_task.finished = timezone.now()
+    recorded = Task.objects.filter(
+        pk=claimed_task.pk, status=Task.RUNNING, locked_by=claimed_task.locked_by,
+    ).update(
+        attempts=claimed_task.attempts, status=claimed_task.status, run_at=claimed_task.run_at,
+        last_error=claimed_task.last_error, finished=claimed_task.finished, locked_by='', locked_at=None,
+    )
+    if not recorded:
+        logger.warning('Task %s was taken from worker %s while it ran', claimed_task, claimed_task.locked_by)
+    claimed_task.locked_by = ''
+    claimed_task.locked_at = None
+    return bool(recorded)
+
+
+def schedule_periodic():
+    """
+    Enqueues the periodic tasks that are due. Returns the number of tasks enqueued.
+    """
+    now = timezone.now()
+    enqueued = 0
+    for periodic in PeriodicTask.objects.filter(enabled=True, next_run__lte=now):
+        # Only the worker that moves next_run forward enqueues the run.
+        advanced = PeriodicTask.objects.filter(pk=periodic.pk, next_run=periodic.next_run).update(
+            next_run=now + datetime.timedelta(seconds=periodic.interval)
+        )
+        if advanced and periodic.task in registry:
+            enqueue(periodic.task, *periodic.args, dedup_key='periodic:%s' % periodic.name, **periodic.kwargs)
+            enqueued += 1
+    return enqueued
+
+
+def requeue_stale():
+    """
+    Returns tasks of workers that died while running them to the queue, counting the interrupted run
+    as an attempt; tasks that have no attempt left are failed. Returns the number of tasks released.
+    """
+    now = timezone.now()
+    stale = Task.objects.filter(status=Task.RUNNING, locked_at__lt=now - LOCK_TIMEOUT)
+    failed = stale.filter(attempts__gte=F('max_attempts') - 1).update(
+        status=Task.FAILED, locked_by='', locked_at=None, attempts=F('attempts') + 1, finished=now,
+        last_error='Worker stopped responding while running the task',
+    )
+    return failed + stale.update(status=Task.QUEUED, locked_by='', locked_at=None, attempts=F('attempts') + 1)
+
+
+def work(worker, batch_size=10, poll_interval=1.0, once=False):
+    """
+    Main loop of one worker process. With `once`, returns when no task is due.
+    Returns the number of tasks run.
+    """
+    processed = 0
+    while True:
+        schedule_periodic()
+        tasks = claim(worker, batch_size)
+        for claimed_task in tasks:
+            run(claimed_task)
+        processed += len(tasks)
+        if not tasks:
+            if once:
+                return processed
+            requeue_stale()
+            time.sleep(poll_interval)
+
+
+@task
+def noop(*args, **kwargs):
+    """
+    Does nothing; used by `bench_tasks` to measure queue throughput.
+    """
+
+
+@task
+def rollup_loans():
+    rollup_loan_events()
+
+
+@task
+def refresh_recommendations():
+    build_recommendations()
+
+
+@task
+def rebuild_similarity():
+    build_similarity()
+
+
+@task
+def compute_nightly_fines():
+    compute_fines()
+
+
+@task
+def archive_withdrawn_copies():
+    archive_matching()
@@ -0,0 +1,18 @@
+from django import template
+
+from catalog import pagecache
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def user_nav(context):
+    """
+    Renders the user navigation of the sidebar, or its placeholder in a page cached by @shared_page.
+    """
+    request = context.get('request')
+    if getattr(request, '_shared_page', False):
+        return pagecache.hole(request)
+    fragment = context.template.engine.get_template(pagecache.FRAGMENT_TEMPLATE)
+    with context.push(nav_next=request.path if request is not None else ''):
+        return fragment.render(context)
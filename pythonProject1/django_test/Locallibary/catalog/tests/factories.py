@@ -0,0 +1,99 @@
+"""
+Test data factories for the catalog models.
+
+Each factory fills the required fields with unique defaults, so a test only
+names the fields it is about. The plural factories write all rows with one
+bulk_create(); like the other bulk operations they skip save() and the
+model signals, so use them for fixtures rather than for the behaviour under
+test. Create fixtures in setUpTestData(): TestCase wraps each class and each
+test in a transaction, and the rows are written once per class.
+"""
+import datetime
+import itertools
+
+from django.contrib.auth.models import Permission, User
+
+from catalog.isbn import normalize_isbn
+from catalog.models import Author, Book, BookInstance, Genre
+
+PASSWORD = '12345'
+
+_sequence = itertools.count(1)
+
+
+def create_user(username=None, permissions=(), **fields):
+    """
+    Creates a user with the PASSWORD password and the permissions named by codename.
+    """
+    created = User.objects.create_user(username=username or 'user%d' % next(_sequence), password=PASSWORD, **fields)
+    if permissions:
+        created.user_permissions.add(*Permission.objects.filter(codename__in=permissions))
+    return created
+
+
+def create_librarian(username='librarian', **fields):
+    return create_user(username, permissions=['can_mark_returned'], **fields)
+
+
+def create_genre(**fields):
+    fields.setdefault('name', 'Genre %d' % next(_sequence))
+    return Genre.objects.create(**fields)
+
+
+def create_author(**fields):
+    fields.setdefault('first_name', 'First')
+    fields.setdefault('last_name', 'Author %d' % next(_sequence))
+    return Author.objects.create(**fields)
+
+
+def _book(author, fields):
+    fields.setdefault('title', 'Book %d' % next(_sequence))
+    fields.setdefault('summary', 'Summary')
+    fields['isbn13'] = normalize_isbn(fields.get('isbn'))
+    return Book(author=author, **fields)
+
+
+def create_book(author=None, genres=(), **fields):
+    """
+    Creates a book (by a new author unless one is given) in `genres`.
+    """
+    created = _book(author or create_author(), fields)
+    created.save()
+    if genres:
+        created.genre.set(genres)
+    return created
+
+
+def create_books(count, author=None, genres=(), **fields):
+    """
+    Creates `count` books by one author with one INSERT (and one more for their genres).
+    """
+    author = author or create_author()
+    created = Book.objects.bulk_create([_book(author, dict(fields)) for _ in range(count)])
+    if genres:
+        Book.genre.through.objects.bulk_create(
+            [Book.genre.through(book=created_book, genre=each) for created_book in created for each in genres]
+        )
+    return created
+
+
+def create_copy(book, **fields):
+    fields.setdefault('imprint', 'Imprint')
+    fields.setdefault('status', 'a')
+    return BookInstance.objects.create(book=book, **fields)
+
+
+def create_copies(book, count, **fields):
+    """
+    Creates `count` copies of `book` with one INSERT. A callable field value is called with the copy's index.
+    """
+    fields.setdefault('imprint', 'Imprint')
+    fields.setdefault('status', 'a')
+    return BookInstance.objects.bulk_create([
+        BookInstance(book=book, **{name: value(n) if callable(value) else value for name, value in fields.items()})
+        for n in range(count)
+    ])
+
+
+def due_in(days):
+    return datetime.date.today() + datetime.timedelta(days=days)
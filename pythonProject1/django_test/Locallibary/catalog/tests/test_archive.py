@@ -0,0 +1,125 @@
+import datetime
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from catalog import archive
+from catalog.models import (
+    ArchivedBookInstance, Author, Book, BookInstance, Branch, BranchTransfer, Fine, LoanEvent,
+)
+
+
+class ArchiveTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.patron = User.objects.create_user(username='patron', password='12345')
+        cls.branch = Branch.objects.create(name='Main')
+        cls.other_branch = Branch.objects.create(name='North')
+        author = Author.objects.create(first_name='John', last_name='Smith')
+        cls.book = Book.objects.create(title='Book', summary='Summary', author=author)
+
+    def setUp(self):
+        cache.clear()
+
+    def copy(self, status='m', **kwargs):
+        # Added long before the idle period, unless a test says otherwise.
+        kwargs.setdefault('created', timezone.now() - datetime.timedelta(days=400))
+        return BookInstance.objects.create(book=self.book, imprint='Imprint', status=status, **kwargs)
+
+    def test_policy(self):
+        withdrawn = self.copy()
+        self.copy('a')
+        self.copy('o', borrower=self.patron, due_back=datetime.date.today())
+        recently_used = self.copy()
+        LoanEvent.objects.create(kind=LoanEvent.STATUS_CHANGE, book_instance_id=recently_used.pk, book=self.book)
+        owing = self.copy()
+        Fine.objects.create(book_instance=owing, borrower=self.patron, due_back=datetime.date(2026, 1, 1),
+                            days_overdue=3, amount=Decimal('1.50'), computed_on=datetime.date(2026, 1, 4))
+
+        self.assertEqual(list(archive.archivable()), [withdrawn])
+        self.assertEqual(set(archive.archivable(days=0)), {withdrawn, recently_used})
+        self.assertEqual(len(archive.archivable(['m', 'a', 'o'])), 2)
+
+    def test_new_copies_are_not_archived(self):
+        new = self.copy(created=timezone.now())
+        legacy = self.copy(created=None)
+
+        self.assertEqual(list(archive.archivable()), [legacy])
+        archive.archive_matching()
+        self.assertTrue(BookInstance.objects.filter(pk=new.pk).exists())
+
+    def test_archive_and_restore_with_history(self):
+        copy = self.copy(branch=self.branch)
+        BranchTransfer.objects.create(book_instance=copy, from_branch=self.other_branch, to_branch=self.branch,
+                                      requested_by=self.patron)
+        Fine.objects.create(book_instance=copy, borrower=self.patron, due_back=datetime.date(2026, 1, 1),
+                            days_overdue=3, amount=Decimal('1.50'), computed_on=datetime.date(2026, 1, 4), paid=True)
+
+        self.assertEqual(archive.archive_matching(batch_size=1), 1)
+        self.assertFalse(BookInstance.objects.filter(pk=copy.pk).exists())
+        self.assertFalse(Fine.objects.exists())
+        self.assertFalse(BranchTransfer.objects.exists())
+        archived = ArchivedBookInstance.objects.get(pk=copy.pk)
+        self.assertEqual((archived.book, archived.branch, archived.status), (self.book, self.branch, 'm'))
+        self.assertEqual(len(archived.history['fines']), 1)
+
+        self.other_branch.delete()
+        self.assertEqual(archive.restore_copies(ArchivedBookInstance.objects.all()), 1)
+        self.assertFalse(ArchivedBookInstance.objects.exists())
+        restored = BookInstance.objects.get(pk=copy.pk)
+        self.assertEqual((restored.imprint, restored.branch, restored.status), ('Imprint', self.branch, 'm'))
+        fine = Fine.objects.get()
+        self.assertEqual((fine.book_instance_id, fine.amount, fine.due_back, fine.paid),
+                         (copy.pk, Decimal('1.50'), datetime.date(2026, 1, 1), True))
+        transfer = BranchTransfer.objects.get()
+        self.assertEqual((transfer.from_branch, transfer.to_branch, transfer.requested_by),
+                         (None, self.branch, self.patron))
+
+    def test_batches(self):
+        copies = [self.copy() for _ in range(5)]
+        self.assertEqual(archive.archive_matching(batch_size=2), 5)
+        self.assertEqual(set(ArchivedBookInstance.objects.values_list('pk', flat=True)), {c.pk for c in copies})
+        self.assertFalse(BookInstance.objects.exists())
+
+    def test_copies_on_loan_are_never_archived(self):
+        lent = self.copy('o', borrower=self.patron, due_back=datetime.date.today())
+        self.assertEqual(archive.archive_copies(BookInstance.objects.all()), 0)
+        self.assertTrue(BookInstance.objects.filter(pk=lent.pk).exists())
+
+    def test_loan_history_survives(self):
+        copy = self.copy()
+        LoanEvent.objects.create(kind=LoanEvent.RETURN, book_instance_id=copy.pk, book=self.book,
+                                 created=timezone.now() - datetime.timedelta(days=400))
+        archive.archive_matching()
+        self.assertEqual(LoanEvent.objects.filter(book_instance_id=copy.pk).count(), 1)
+
+    def test_book_page_optionally_shows_archived_copies(self):
+        copy = self.copy()
+        archive.archive_matching()
+        url = reverse('book-detail', args=[self.book.pk])
+        self.assertNotIn(str(copy.pk), self.client.get(url).content.decode())
+        response = self.client.get(url, {'archived': 1})
+        self.assertIn(str(copy.pk), response.content.decode())
+
+    def test_availability_counts_are_invalidated(self):
+        self.copy('a')
+        available = lambda: self.client.get(reverse('books'), {'available': 1}).context['available_facet']['count']
+        self.assertEqual(available(), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            archive.archive_matching(['a'], days=0)
+        self.assertEqual(available(), 0)
+
+    def test_command(self):
+        copy = self.copy()
+        call_command('archive_copies', '--dry-run', stdout=open('/dev/null', 'w'))
+        self.assertTrue(BookInstance.objects.filter(pk=copy.pk).exists())
+        call_command('archive_copies', stdout=open('/dev/null', 'w'))
+        self.assertTrue(ArchivedBookInstance.objects.filter(pk=copy.pk).exists())
+        call_command('archive_copies', '--restore', str(copy.pk), stdout=open('/dev/null', 'w'))
+        self.assertTrue(BookInstance.objects.filter(pk=copy.pk).exists())
@@ -0,0 +1,78 @@
+from django.contrib.auth.models import Group, Permission, User
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+
+class PermissionCacheTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='librarian', password='12345')
+        cls.permission = Permission.objects.get(codename='can_mark_returned')
+        cls.group = Group.objects.create(name='Librarians')
+
+    def setUp(self):
+        cache.clear()
+        self.client.login(username='librarian', password='12345')
+
+    def auth_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.client.get(url)
+        return resp, [query['sql'] for query in queries if 'auth_' in query['sql']]
+
+    def test_repeat_requests_do_not_load_user_or_permissions(self):
+        self.auth_queries(reverse('index'))
+        resp, queries = self.auth_queries(reverse('index'))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(queries, [])
+
+    def test_first_request_populates_the_cache(self):
+        _, queries = self.auth_queries(reverse('index'))
+        # The user, its permissions and its groups' permissions.
+        self.assertEqual(len(queries), 3)
+
+    def test_user_permission_change_is_seen(self):
+        resp, _ = self.auth_queries(reverse('all-borrowed'))
+        self.assertEqual(resp.status_code, 403)
+
+        self.user.user_permissions.add(self.permission)
+
+        resp, _ = self.auth_queries(reverse('all-borrowed'))
+        self.assertEqual(resp.status_code, 200)
+
+    def test_group_permission_change_is_seen(self):
+        self.user.groups.add(self.group)
+        self.auth_queries(reverse('all-borrowed'))
+
+        self.group.permissions.add(self.permission)
+
+        resp, _ = self.auth_queries(reverse('all-borrowed'))
+        self.assertEqual(resp.status_code, 200)
+
+    def test_group_membership_change_is_seen(self):
+        self.group.permissions.add(self.permission)
+        self.auth_queries(reverse('all-borrowed'))
+
+        self.group.user_set.add(self.user)
+
+        resp, _ = self.auth_queries(reverse('all-borrowed'))
+        self.assertEqual(resp.status_code, 200)
+
+    def test_deactivated_user_is_logged_out(self):
+        self.auth_queries(reverse('index'))
+        self.user.is_active = False
+        self.user.save()
+
+        resp = self.client.get(reverse('my-borrowed'))
+        self.assertEqual(resp.status_code, 302)
+
+    @override_settings(AUTH_CACHE_TIMEOUT=0)
+    def test_bulk_deactivation_is_seen_once_the_entries_expire(self):
+        self.auth_queries(reverse('index'))
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+
+        resp = self.client.get(reverse('my-borrowed'))
+        self.assertEqual(resp.status_code, 302)
@@ -0,0 +1,53 @@
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from catalog import views
+from catalog.models import Author, Book
+
+
+class AuthorBooksTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = Author.objects.create(first_name='Prolific', last_name='Writer')
+        Book.objects.bulk_create([
+            Book(title='Book %03d' % number, summary='x' * 1000, author=cls.author, isbn13='978%010d' % number)
+            for number in range(45)
+        ])
+
+    def test_detail_shows_first_page_and_count(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('author-detail', args=[self.author.pk]))
+        self.assertContains(response, 'Books (45)')
+        self.assertEqual(len(response.context['books']), views.AUTHOR_BOOKS_PER_PAGE)
+        self.assertContains(response, 'Load more')
+        self.assertNotIn('x' * (views.SUMMARY_EXCERPT_LENGTH + 1), response.content.decode())
+
+        book_queries = [query['sql'] for query in queries if 'FROM "catalog_book"' in query['sql']]
+        self.assertEqual(len(book_queries), 1)
+        # The summary is only read through SUBSTR().
+        self.assertEqual(book_queries[0].count('"catalog_book"."summary"'), 1)
+        self.assertIn('SUBSTR("catalog_book"."summary"', book_queries[0])
+
+    def test_load_more_json(self):
+        url = reverse('author-books', args=[self.author.pk])
+        first = self.client.get(url, {'page': 2}).json()
+        self.assertEqual(first['books'][0]['title'], 'Book 020')
+        self.assertEqual(first['next_page'], 3)
+        self.assertEqual(len(first['books'][0]['summary']), views.SUMMARY_EXCERPT_LENGTH)
+
+        last = self.client.get(url, {'page': 3}).json()
+        self.assertEqual(len(last['books']), 5)
+        self.assertIsNone(last['next_page'])
+
+    def test_short_summaries_are_not_truncated(self):
+        author = Author.objects.create(first_name='Brief', last_name='Writer')
+        Book.objects.create(title='Short', summary='A short summary.', author=author)
+        response = self.client.get(reverse('author-detail', args=[author.pk]))
+        self.assertContains(response, 'A short summary.')
+        self.assertNotContains(response, 'Load more')
+
+    def test_unknown_author(self):
+        self.assertEqual(self.client.get(reverse('author-books', args=[999])).status_code, 404)
@@ -0,0 +1,66 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+
+from catalog.branches import transfer_copies
+from catalog.models import Author, Book, BookInstance, Branch, BranchTransfer
+
+
+class BranchScopeTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.central = Branch.objects.create(name='Central')
+        cls.north = Branch.objects.create(name='North')
+        author = Author.objects.create(first_name='John', last_name='Smith')
+        cls.book = Book.objects.create(title='Book Title', summary='Summary', author=author)
+        cls.central_copy = BookInstance.objects.create(book=cls.book, imprint='Imprint', status='a', branch=cls.central)
+        BookInstance.objects.create(book=cls.book, imprint='Imprint', status='m', branch=cls.central)
+        cls.north_copy = BookInstance.objects.create(book=cls.book, imprint='Imprint', status='o', branch=cls.north)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_index_counts_are_scoped_to_the_selected_branch(self):
+        resp = self.client.get(reverse('index'), {'branch': self.central.pk})
+        self.assertEqual((resp.context['num_instances'], resp.context['num_instances_available']), (2, 1))
+
+        # The selection is remembered in the session...
+        resp = self.client.get(reverse('index'))
+        self.assertEqual(resp.context['current_branch'], self.central)
+        self.assertEqual(resp.context['num_instances'], 2)
+
+        # ...until all branches are selected again.
+        resp = self.client.get(reverse('index'), {'branch': ''})
+        self.assertEqual(resp.context['num_instances'], 3)
+
+    def test_book_detail_lists_copies_of_the_branch(self):
+        resp = self.client.get(reverse('book-detail', kwargs={'pk': self.book.pk}), {'branch': self.north.pk})
+        self.assertEqual(list(resp.context['copies']), [self.north_copy])
+
+    def test_availability_filter_is_scoped_to_the_branch(self):
+        resp = self.client.get(reverse('books'), {'available': 1, 'branch': self.north.pk})
+        self.assertEqual(list(resp.context['book_list']), [])
+        self.assertEqual(resp.context['available_facet']['count'], 0)
+
+        resp = self.client.get(reverse('books'), {'available': 1, 'branch': self.central.pk})
+        self.assertEqual(list(resp.context['book_list']), [self.book])
+
+    def test_transfer_moves_copies_and_records_them(self):
+        librarian = User.objects.create(username='librarian')
+        moved = transfer_copies([self.central_copy.pk, self.north_copy.pk], self.north, librarian)
+
+        self.assertEqual(moved, 1)
+        self.central_copy.refresh_from_db()
+        self.assertEqual((self.central_copy.branch, self.central_copy.version), (self.north, 1))
+        transfer = BranchTransfer.objects.get()
+        self.assertEqual((transfer.from_branch, transfer.to_branch), (self.central, self.north))
+
+    def test_transfer_invalidates_facets(self):
+        self.client.get(reverse('books'), {'available': 1, 'branch': self.north.pk})
+        with self.captureOnCommitCallbacks(execute=True):
+            transfer_copies([self.central_copy.pk], self.north)
+
+        resp = self.client.get(reverse('books'), {'available': 1, 'branch': self.north.pk})
+        self.assertEqual(resp.context['available_facet']['count'], 1)
@@ -0,0 +1,181 @@
+import datetime
+import json
+import uuid
+
+from django.contrib.auth.models import Permission, User
+from django.db import connection
+from django.db.models import F
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from catalog.models import Author, Book, BookInstance, CirculationBatch, LoanEvent
+
+
+class CirculationBatchTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.librarian = User.objects.create_user(username='librarian', password='12345')
+        cls.librarian.user_permissions.add(Permission.objects.get(codename='can_mark_returned'))
+        cls.patron = User.objects.create_user(username='patron', password='12345')
+        author = Author.objects.create(first_name='John', last_name='Smith')
+        cls.book = Book.objects.create(title='Book Title', summary='Summary', author=author)
+
+    def setUp(self):
+        self.available = [
+            BookInstance.objects.create(book=self.book, imprint='Imprint', status='a') for _ in range(3)
+        ]
+        self.maintenance = BookInstance.objects.create(book=self.book, imprint='Imprint', status='m')
+        self.client.login(username='librarian', password='12345')
+
+    def post(self, **payload):
+        payload.setdefault('batch_key', str(uuid.uuid4()))
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse('circulation-batch'), json.dumps(payload),
+                                    content_type='application/json')
+
+    def test_checkout_batch(self):
+        ids = [str(copy.pk) for copy in self.available]
+        resp = self.post(action='checkout', borrower=self.patron.pk, copies=ids)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(all(result['ok'] for result in resp.json()['results'].values()))
+        self.assertEqual(BookInstance.objects.filter(status='o', borrower=self.patron).count(), 3)
+        self.assertEqual(LoanEvent.objects.filter(kind=LoanEvent.CHECKOUT).count(), 3)
+
+    def test_per_copy_errors(self):
+        missing = str(uuid.uuid4())
+        resp = self.post(action='checkout', borrower=self.patron.pk,
+                         copies=[str(self.available[0].pk), str(self.maintenance.pk), missing, 'junk'])
+
+        results = resp.json()['results']
+        self.assertTrue(results[str(self.available[0].pk)]['ok'])
+        self.assertEqual(results[str(self.maintenance.pk)]['error'], 'status is Maintenance')
+        self.assertEqual(results[missing]['error'], 'not found')
+        self.assertEqual(results['junk']['error'], 'invalid id')
+
+    def test_return_and_renew(self):
+        ids = [str(copy.pk) for copy in self.available]
+        self.post(action='checkout', borrower=self.patron.pk, copies=ids)
+
+        due_back = datetime.date.today() + datetime.timedelta(days=10)
+        resp = self.post(action='renew', copies=ids[:1], due_back=due_back.isoformat())
+        self.assertEqual(resp.json()['results'][ids[0]]['due_back'], due_back.isoformat())
+
+        self.post(action='return', copies=ids)
+        self.assertEqual(BookInstance.objects.filter(status='a', borrower__isnull=True).count(), 3)
+
+    def test_retry_with_same_key_is_not_processed_twice(self):
+        ids = [str(self.available[0].pk)]
+        first = self.post(batch_key='desk-1:42', action='checkout', borrower=self.patron.pk, copies=ids)
+        retry = self.post(batch_key='desk-1:42', action='checkout', borrower=self.patron.pk, copies=ids)
+
+        self.assertFalse(first.json()['replayed'])
+        self.assertTrue(retry.json()['replayed'])
+        self.assertEqual(retry.json()['results'], first.json()['results'])
+        self.assertEqual(LoanEvent.objects.count(), 1)
+        self.assertEqual(CirculationBatch.objects.count(), 1)
+
+    def test_batch_key_reused_for_another_batch_is_rejected(self):
+        ids = [str(copy.pk) for copy in self.available]
+        self.post(batch_key='desk-1:43', action='checkout', borrower=self.patron.pk, copies=ids[:1])
+        self.assertEqual(self.post(batch_key='desk-1:43', action='return', copies=ids[:1]).status_code, 400)
+        resp = self.post(batch_key='desk-1:43', action='checkout', borrower=self.patron.pk, copies=ids[1:])
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(BookInstance.objects.filter(status='o').count(), 1)
+
+    def test_batch_keys_are_per_user(self):
+        other = User.objects.create_user(username='other', password='12345')
+        other.user_permissions.add(Permission.objects.get(codename='can_mark_returned'))
+        self.post(batch_key='desk-1', action='checkout', borrower=self.patron.pk, copies=[str(self.available[0].pk)])
+        self.client.login(username='other', password='12345')
+        resp = self.post(batch_key='desk-1', action='checkout', borrower=self.patron.pk,
+                         copies=[str(self.available[1].pk)])
+
+        self.assertFalse(resp.json()['replayed'])
+        self.assertEqual(BookInstance.objects.filter(status='o').count(), 2)
+
+    def test_same_copy_in_two_spellings(self):
+        copy_id = str(self.available[0].pk)
+        spellings = [copy_id, copy_id.upper(), copy_id.replace('-', '')]
+        resp = self.post(action='checkout', borrower=self.patron.pk, copies=spellings)
+
+        results = resp.json()['results']
+        self.assertEqual(list(results), spellings)
+        self.assertTrue(all(result['ok'] for result in results.values()))
+        self.assertEqual(LoanEvent.objects.count(), 1)
+
+    def test_batch_uses_constant_number_of_queries(self):
+        # The first request also fills the user/permission cache.
+        self.post(action='checkout', borrower=self.patron.pk, copies=[str(self.available[0].pk)])
+        with CaptureQueriesContext(connection) as single:
+            self.post(action='checkout', borrower=self.patron.pk, copies=[str(self.available[1].pk)])
+
+        copies = [BookInstance(book=self.book, imprint='Imprint', status='a') for _ in range(100)]
+        BookInstance.objects.bulk_create(copies)
+        with self.assertNumQueries(len(single)):
+            resp = self.post(action='checkout', borrower=self.patron.pk, copies=[str(copy.pk) for copy in copies])
+        self.assertEqual(len(resp.json()['results']), 100)
+
+    def test_bad_requests(self):
+        self.assertEqual(self.post(action='steal', copies=[]).status_code, 400)
+        self.assertEqual(self.post(action='checkout', copies=[]).status_code, 400)
+        self.assertEqual(self.post(action='checkout', borrower=0, copies=[]).status_code, 400)
+        self.assertEqual(self.post(batch_key='k' * 65, action='return', copies=[]).status_code, 400)
+        for days in (-1, 29):
+            due_back = (datetime.date.today() + datetime.timedelta(days=days)).isoformat()
+            resp = self.post(action='renew', copies=[str(self.available[0].pk)], due_back=due_back)
+            self.assertEqual(resp.status_code, 400)
+
+    def test_permission_required(self):
+        self.client.login(username='patron', password='12345')
+        self.assertEqual(self.post(action='return', copies=[]).status_code, 403)
+
+    def test_versions_reject_copies_changed_since_read(self):
+        ids = [str(copy.pk) for copy in self.available]
+        results = self.post(action='checkout', borrower=self.patron.pk, copies=ids).json()['results']
+        seen = {copy_id: result['version'] for copy_id, result in results.items()}
+        self.assertEqual(set(seen.values()), {1})
+
+        # Another desk renews the first copy after this one read it.
+        self.post(action='renew', copies=ids[:1], due_back=datetime.date.today().isoformat())
+        due_back = datetime.date.today() + datetime.timedelta(days=10)
+        results = self.post(action='renew', copies=ids, due_back=due_back.isoformat(), versions=seen).json()['results']
+
+        self.assertEqual(results[ids[0]], {'ok': False, 'error': 'changed since read', 'version': 2})
+        self.assertEqual([results[copy_id]['version'] for copy_id in ids[1:]], [2, 2])
+        self.assertEqual(BookInstance.objects.get(pk=ids[0]).due_back, datetime.date.today())
+        self.assertEqual(BookInstance.objects.filter(due_back=due_back).count(), 2)
+        self.assertEqual(self.post(action='renew', copies=ids, versions=[1]).status_code, 400)
+        self.assertEqual(self.post(action='renew', copies=ids, versions={ids[0]: 'x'}).status_code, 400)
+
+    def test_save_increments_the_version(self):
+        copy = BookInstance.objects.get(pk=self.available[0].pk)
+        self.assertEqual(copy.version, 0)
+        copy.imprint = 'Other'
+        copy.save(update_fields=['imprint'])
+        self.assertEqual(BookInstance.objects.get(pk=copy.pk).version, 1)
+
+    def test_save_of_a_stale_copy_still_moves_the_version_on(self):
+        copy = BookInstance.objects.get(pk=self.available[0].pk)
+        # A batch moves the copy on after it was read
+        BookInstance.objects.filter(pk=copy.pk).update(version=F('version') + 1)
+        copy.imprint = 'Other'
+        copy.save(update_fields=['imprint'])
+        self.assertEqual(copy.version, 2)
+        self.assertEqual(BookInstance.objects.get(pk=copy.pk).version, 2)
+
+    def test_batch_of_copies_read_at_many_versions(self):
+        copies = BookInstance.objects.bulk_create(
+            BookInstance(book=self.book, imprint='Imprint', status='o', borrower=self.patron,
+                         due_back=datetime.date.today(), version=version)
+            for version in range(1001)
+        )
+        ids = [str(copy.pk) for copy in copies]
+        due_back = datetime.date.today() + datetime.timedelta(days=10)
+        resp = self.post(action='renew', copies=ids, due_back=due_back.isoformat())
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(all(result['ok'] for result in resp.json()['results'].values()))
+        self.assertEqual(BookInstance.objects.filter(due_back=due_back).count(), 1001)
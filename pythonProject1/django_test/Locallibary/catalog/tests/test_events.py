@@ -0,0 +1,119 @@
+import datetime
+
+from django.contrib.auth.models import User, Permission
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from catalog.models import Author, Genre, Book, BookInstance, LoanEvent, LoanRollup
+from django.utils import timezone
+
+from catalog.rollups import rollup_loan_events
+
+
+class LoanEventLogTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='borrower', password='12345')
+        cls.author = Author.objects.create(first_name='John', last_name='Smith')
+        cls.genre = Genre.objects.create(name='Fantasy')
+        cls.book = Book.objects.create(title='Book Title', summary='My book summary', author=cls.author)
+        cls.book.genre.set([cls.genre])
+
+    def checkout(self, copy, days=7):
+        copy.status = 'o'
+        copy.borrower = self.user
+        copy.due_back = datetime.date.today() + datetime.timedelta(days=days)
+        with self.captureOnCommitCallbacks(execute=True):
+            copy.save()
+
+    def test_new_available_copy_is_not_logged(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            BookInstance.objects.create(book=self.book, imprint='Imprint', status='a')
+        self.assertEqual(LoanEvent.objects.count(), 0)
+
+    def test_checkout_renewal_and_return_are_logged(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            copy = BookInstance.objects.create(book=self.book, imprint='Imprint', status='a')
+        self.checkout(copy)
+
+        copy = BookInstance.objects.get(pk=copy.pk)
+        copy.due_back += datetime.timedelta(days=7)
+        with self.captureOnCommitCallbacks(execute=True):
+            copy.save()
+
+        copy.status = 'a'
+        copy.borrower = None
+        with self.captureOnCommitCallbacks(execute=True):
+            copy.save()
+
+        kinds = list(LoanEvent.objects.values_list('kind', flat=True))
+        self.assertEqual(kinds, [LoanEvent.CHECKOUT, LoanEvent.RENEWAL, LoanEvent.RETURN])
+        self.assertEqual(LoanEvent.objects.first().borrower, self.user)
+
+    def test_event_is_written_in_the_transaction_of_the_change(self):
+        copy = BookInstance.objects.create(book=self.book, imprint='Imprint', status='a')
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                copy.status = 'o'
+                copy.borrower = self.user
+                copy.save()
+                self.assertEqual(LoanEvent.objects.count(), 1)
+                raise ValueError
+        self.assertEqual(LoanEvent.objects.count(), 0)
+
+        copy = BookInstance.objects.get(pk=copy.pk)
+        copy.status = 'o'
+        copy.borrower = self.user
+        copy.save()
+        self.assertEqual(LoanEvent.objects.count(), 1)
+
+    @override_settings(ROLLUP_SETTLE_SECONDS=0)
+    def test_rollup_is_incremental(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            copy = BookInstance.objects.create(book=self.book, imprint='Imprint', status='a')
+        self.checkout(copy)
+        self.assertEqual(rollup_loan_events(), 1)
+        self.assertEqual(rollup_loan_events(), 0)
+
+        copy.status = 'a'
+        with self.captureOnCommitCallbacks(execute=True):
+            copy.save()
+        self.checkout(copy)
+        self.assertEqual(rollup_loan_events(batch_size=1), 2)
+
+        for dimension, key in ((LoanRollup.BOOK, self.book.pk),
+                               (LoanRollup.GENRE, self.genre.pk),
+                               (LoanRollup.AUTHOR, self.author.pk)):
+            rollup = LoanRollup.objects.get(dimension=dimension, key=key)
+            self.assertEqual((rollup.checkouts, rollup.returns), (2, 1))
+
+    def test_rollup_waits_for_late_commits(self):
+        old = timezone.now() - datetime.timedelta(hours=1)
+        event = {'kind': LoanEvent.CHECKOUT, 'book_instance_id': BookInstance().id, 'book': self.book}
+        LoanEvent.objects.create(id=5, created=old, **event)
+        LoanEvent.objects.create(id=7, **event)
+        self.assertEqual(rollup_loan_events(), 1)
+
+        # The transaction that got id 6 commits only now.
+        LoanEvent.objects.create(id=6, **event)
+        self.assertEqual(rollup_loan_events(), 0)
+        LoanEvent.objects.filter(id__in=[6, 7]).update(created=old)
+        self.assertEqual(rollup_loan_events(), 2)
+        self.assertEqual(LoanRollup.objects.get(dimension=LoanRollup.BOOK, key=self.book.pk).checkouts, 3)
+
+    def test_report_reads_rollups(self):
+        librarian = User.objects.create_user(username='librarian', password='12345')
+        librarian.user_permissions.add(Permission.objects.get(codename='can_mark_returned'))
+        LoanRollup.objects.create(dimension=LoanRollup.GENRE, key=self.genre.pk,
+                                  day=datetime.date.today(), checkouts=3)
+        self.client.login(username='librarian', password='12345')
+
+        with CaptureQueriesContext(connection) as queries:
+            rows = self.client.get(reverse('loan-report')).context['rows']
+
+        self.assertFalse([query for query in queries if 'catalog_loanevent' in query['sql']])
+        self.assertEqual(rows[0]['name'], self.genre)
+        self.assertEqual(rows[0]['checkouts'], 3)
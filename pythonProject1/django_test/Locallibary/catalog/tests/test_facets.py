@@ -0,0 +1,91 @@
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+
+from catalog.models import Author, Book, BookInstance, Genre
+
+
+class BookListFacetTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.herbert = Author.objects.create(first_name='Frank', last_name='Herbert')
+        cls.austen = Author.objects.create(first_name='Jane', last_name='Austen')
+        cls.scifi = Genre.objects.create(name='Science Fiction')
+        cls.romance = Genre.objects.create(name='Romance')
+        cls.dune = Book.objects.create(title='Dune', summary='Summary', author=cls.herbert)
+        cls.dune.genre.set([cls.scifi])
+        cls.messiah = Book.objects.create(title='Dune Messiah', summary='Summary', author=cls.herbert)
+        cls.messiah.genre.set([cls.scifi])
+        cls.emma = Book.objects.create(title='Emma', summary='Summary', author=cls.austen)
+        cls.emma.genre.set([cls.romance])
+        BookInstance.objects.create(book=cls.dune, imprint='Imprint', status='a')
+        BookInstance.objects.create(book=cls.emma, imprint='Imprint', status='o')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_filters(self):
+        books = lambda **params: list(self.client.get(reverse('books'), params).context['book_list'])
+        self.assertEqual(books(genre=self.scifi.pk), [self.dune, self.messiah])
+        self.assertEqual(books(author=self.austen.pk), [self.emma])
+        self.assertEqual(books(available=1), [self.dune])
+        self.assertEqual(books(genre=self.romance.pk, available=1), [])
+        self.assertEqual(len(books(genre='junk')), 3)
+
+    def test_facet_counts(self):
+        resp = self.client.get(reverse('books'))
+        genres = {facet['name']: facet['count'] for facet in resp.context['genre_facets']}
+        authors = {facet['name']: facet['count'] for facet in resp.context['author_facets']}
+        self.assertEqual(genres, {'Science Fiction': 2, 'Romance': 1})
+        self.assertEqual(authors, {'Herbert, Frank': 2, 'Austen, Jane': 1})
+        self.assertEqual(resp.context['available_facet']['count'], 1)
+
+    def test_facet_counts_follow_filters(self):
+        resp = self.client.get(reverse('books'), {'author': self.herbert.pk})
+        self.assertEqual([facet['count'] for facet in resp.context['genre_facets']], [2])
+        self.assertIn('author=%d' % self.herbert.pk, resp.context['filter_query'])
+
+    def test_facets_are_cached_across_availability_changes(self):
+        self.client.get(reverse('books'))
+        copy = BookInstance.objects.get(book=self.emma)
+        copy.status = 'a'
+        copy.save()
+
+        # Another URL of the same filters misses the page cache but not the facet cache.
+        with self.assertNumQueries(2):
+            self.client.get(reverse('books'), {'page': 1})
+
+    def test_available_filter_follows_availability_changes(self):
+        self.client.get(reverse('books'), {'available': 1})
+        copy = BookInstance.objects.get(book=self.emma)
+        copy.status = 'a'
+        with self.captureOnCommitCallbacks(execute=True):
+            copy.save()
+
+        resp = self.client.get(reverse('books'), {'available': 1})
+        self.assertEqual(list(resp.context['book_list']), [self.dune, self.emma])
+        self.assertEqual(resp.context['available_facet']['count'], 2)
+        genres = {facet['name']: facet['count'] for facet in resp.context['genre_facets']}
+        self.assertEqual(genres, {'Science Fiction': 1, 'Romance': 1})
+
+    def test_available_count_is_invalidated_when_the_change_commits(self):
+        self.client.get(reverse('books'), {'available': 1})
+        copy = BookInstance.objects.get(book=self.emma)
+        copy.status = 'a'
+        with self.captureOnCommitCallbacks() as callbacks:
+            copy.save()
+        # Until then other requests cannot see the change, and counts cached meanwhile would hide it.
+        with self.assertNumQueries(0):
+            self.client.get(reverse('books'), {'available': 1})
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.client.get(reverse('books'), {'available': 1}).context['available_facet']['count'], 2)
+
+    def test_facets_are_invalidated_when_genres_change(self):
+        self.client.get(reverse('books'))
+        self.emma.genre.add(self.scifi)
+
+        resp = self.client.get(reverse('books'))
+        genres = {facet['name']: facet['count'] for facet in resp.context['genre_facets']}
+        self.assertEqual(genres['Science Fiction'], 3)
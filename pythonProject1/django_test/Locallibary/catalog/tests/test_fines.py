@@ -0,0 +1,85 @@
+import datetime
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.urls import reverse
+
+from catalog import fines
+from catalog.models import Author, Book, BookInstance, Fine, FineBalance, FineRate, Genre
+
+TODAY = datetime.date(2026, 3, 31)
+
+
+class FinesTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.patron = User.objects.create_user(username='patron', password='12345')
+        cls.other = User.objects.create_user(username='other', password='12345')
+        cls.rare = Genre.objects.create(name='Rare books')
+        cls.poetry = Genre.objects.create(name='Poetry')
+        author = Author.objects.create(first_name='John', last_name='Smith')
+        cls.book = Book.objects.create(title='Book', summary='Summary', author=author)
+        cls.rare_book = Book.objects.create(title='Rare', summary='Summary', author=author)
+        cls.rare_book.genre.set([cls.rare, cls.poetry])
+        FineRate.objects.create(daily_rate=Decimal('0.25'), grace_days=2, max_fine=Decimal('5.00'))
+        FineRate.objects.create(genre=cls.rare, daily_rate=Decimal('1.00'))
+        FineRate.objects.create(genre=cls.poetry, daily_rate=Decimal('0.10'))
+
+    def lend(self, book, days_overdue, borrower=None):
+        return BookInstance.objects.create(
+            book=book, imprint='Imprint', status='o', borrower=borrower or self.patron,
+            due_back=TODAY - datetime.timedelta(days=days_overdue),
+        )
+
+    def test_rates_grace_and_cap(self):
+        within_grace = self.lend(self.book, 2)
+        charged = self.lend(self.book, 10)
+        capped = self.lend(self.book, 100)
+        rare = self.lend(self.rare_book, 10)
+
+        self.assertEqual(fines.compute_fines(TODAY), 3)
+        amounts = dict(Fine.objects.values_list('book_instance_id', 'amount'))
+        self.assertNotIn(within_grace.pk, amounts)
+        self.assertEqual(amounts[charged.pk], Decimal('2.00'))
+        self.assertEqual(amounts[capped.pk], Decimal('5.00'))
+        # The highest rate among the book's genres applies.
+        self.assertEqual(amounts[rare.pk], Decimal('10.00'))
+
+    def test_rerun_updates_and_maintains_balance(self):
+        copy = self.lend(self.book, 4)
+        self.lend(self.book, 6, borrower=self.other)
+        fines.compute_fines(TODAY)
+        fines.compute_fines(TODAY + datetime.timedelta(days=2))
+
+        fine = Fine.objects.get(book_instance=copy)
+        self.assertEqual((fine.days_overdue, fine.amount), (6, Decimal('1.00')))
+        self.assertEqual(Fine.objects.count(), 2)
+        self.assertEqual(fines.outstanding_balance(self.patron), Decimal('1.00'))
+        self.assertEqual(fines.outstanding_balance(self.other), Decimal('1.50'))
+
+    def test_paid_fines_are_not_changed(self):
+        copy = self.lend(self.book, 4)
+        fines.compute_fines(TODAY)
+        self.assertEqual(fines.mark_paid(Fine.objects.filter(book_instance=copy)), 1)
+        self.assertEqual(fines.outstanding_balance(self.patron), Decimal('0'))
+
+        fines.compute_fines(TODAY + datetime.timedelta(days=5))
+        fine = Fine.objects.get(book_instance=copy)
+        self.assertEqual(fine.amount, Decimal('0.50'))
+        self.assertTrue(fine.paid)
+        self.assertEqual(FineBalance.objects.get(borrower=self.patron).outstanding, Decimal('0'))
+
+    def test_without_rates_nothing_is_charged(self):
+        FineRate.objects.all().delete()
+        self.lend(self.book, 30)
+        self.assertEqual(fines.compute_fines(TODAY), 0)
+        self.assertFalse(Fine.objects.exists())
+
+    def test_balance_shown_on_my_borrowed(self):
+        self.lend(self.book, 10)
+        fines.compute_fines(TODAY)
+        self.client.login(username='patron', password='12345')
+        response = self.client.get(reverse('my-borrowed'))
+        self.assertContains(response, 'Outstanding fines:</strong> 2.00')
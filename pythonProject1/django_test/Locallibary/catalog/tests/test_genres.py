@@ -0,0 +1,74 @@
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from catalog import genres
+from catalog.models import Author, Book, Genre
+
+
+class GenreRegistryTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.fantasy = Genre.objects.create(name='Fantasy')
+        cls.poetry = Genre.objects.create(name='Poetry')
+        author = Author.objects.create(first_name='John', last_name='Smith')
+        cls.books = []
+        for number in range(5):
+            book = Book.objects.create(title='Book %d' % number, summary='Summary', author=author)
+            book.genre.set([cls.fantasy, cls.poetry] if number % 2 else [cls.poetry])
+            cls.books.append(book)
+
+    def setUp(self):
+        genres.reset()
+
+    def test_loaded_once(self):
+        with self.assertNumQueries(1):
+            genres.genre_names()
+        with self.assertNumQueries(0):
+            self.assertEqual(genres.genre_names()[self.fantasy.pk], 'Fantasy')
+
+    def test_genre_changes_invalidate_the_registry(self):
+        genres.genre_names()
+        self.fantasy.name = 'High Fantasy'
+        self.fantasy.save()
+        self.assertEqual(genres.genre_names()[self.fantasy.pk], 'High Fantasy')
+
+        self.poetry.delete()
+        self.assertNotIn(self.poetry.pk, genres.genre_names())
+
+    def test_names_by_book_reads_only_the_through_table(self):
+        genres.genre_names()
+        with CaptureQueriesContext(connection) as queries:
+            names = genres.names_by_book([book.pk for book in self.books])
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('"catalog_genre"', queries[0]['sql'])
+        self.assertEqual(names[self.books[0].pk], ['Poetry'])
+        self.assertEqual(sorted(names[self.books[1].pk]), ['Fantasy', 'Poetry'])
+
+    def test_display_genre(self):
+        book = Book.objects.get(pk=self.books[0].pk)
+        self.assertEqual(book.display_genre(), 'Poetry')
+
+    def test_book_detail_lists_genres(self):
+        response = self.client.get(reverse('book-detail', args=[self.books[1].pk]))
+        self.assertContains(response, 'Fantasy, Poetry')
+
+    def test_admin_changelist_queries_do_not_grow_with_books(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.login(username='admin', password='password')
+        url = reverse('admin:catalog_book_changelist')
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as five_books:
+            response = self.client.get(url)
+        self.assertContains(response, 'Fantasy, Poetry')
+
+        author = Author.objects.get()
+        for number in range(5, 15):
+            Book.objects.create(title='Book %d' % number, summary='Summary', author=author).genre.set([self.fantasy])
+        with CaptureQueriesContext(connection) as fifteen_books:
+            self.client.get(url + '?genre=%d' % self.fantasy.pk)
+        self.assertEqual(len(fifteen_books), len(five_books))
+        self.assertFalse(any('"catalog_genre"' in query['sql'] for query in fifteen_books))
@@ -0,0 +1,91 @@
+import json
+
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError
+from django.test import TestCase
+from django.urls import reverse
+
+from catalog.isbn import normalize_isbn, validate_isbn
+from catalog.models import Author, Book
+
+
+class IsbnNormalizationTest(TestCase):
+
+    def test_isbn10_is_converted_to_isbn13(self):
+        self.assertEqual(normalize_isbn('0-306-40615-2'), '9780306406157')
+        self.assertEqual(normalize_isbn('080442957X'), '9780804429573')
+
+    def test_isbn13_with_separators(self):
+        self.assertEqual(normalize_isbn('978-0-306-40615-7'), '9780306406157')
+
+    def test_bad_checksum_is_rejected(self):
+        self.assertIsNone(normalize_isbn('9780306406158'))
+        self.assertIsNone(normalize_isbn('0306406153'))
+        self.assertIsNone(normalize_isbn('ABCDEFG'))
+        with self.assertRaises(ValidationError):
+            validate_isbn('9780306406158')
+
+
+class BookIsbnTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = Author.objects.create(first_name='John', last_name='Smith')
+        cls.book = Book.objects.create(title='Book Title', summary='Summary', isbn='0306406152', author=cls.author)
+
+    def test_normalized_isbn_is_stored(self):
+        self.assertEqual(self.book.isbn13, '9780306406157')
+
+    def test_duplicate_isbn_is_rejected(self):
+        other = Book(title='Other', summary='Summary', isbn='978-0306406157', author=self.author)
+        with self.assertRaises(ValidationError):
+            other.full_clean()
+        with self.assertRaises(IntegrityError):
+            other.save()
+
+    def test_hyphenated_isbn13_fits(self):
+        book = Book(title='Other', summary='Summary', isbn='978-0-8044-2957-3', author=self.author)
+        book.full_clean()
+        book.save()
+        self.assertEqual(Book.objects.get(pk=book.pk).isbn13, '9780804429573')
+
+    def test_legacy_duplicate_can_be_edited(self):
+        # As left by migration 0009: the second book of a duplicated ISBN has no isbn13.
+        Book.objects.bulk_create([Book(title='Duplicate', summary='Summary', isbn='0306406152', author=self.author)])
+        duplicate = Book.objects.get(title='Duplicate')
+        duplicate.title = 'Renamed'
+        duplicate.full_clean()
+        duplicate.save()
+        self.assertIsNone(Book.objects.get(pk=duplicate.pk).isbn13)
+
+        duplicate.isbn = '978-0306406157'
+        with self.assertRaises(ValidationError):
+            duplicate.full_clean()
+
+    def test_invalid_isbns_do_not_collide(self):
+        Book.objects.create(title='One', summary='Summary', isbn='ABCDEFG')
+        Book.objects.create(title='Two', summary='Summary', isbn='ABCDEFG')
+        self.assertEqual(Book.objects.filter(isbn13__isnull=True).count(), 2)
+
+    def test_resolver_redirects_to_book(self):
+        resp = self.client.get(reverse('isbn-resolve', kwargs={'isbn': '978-0-306-40615-7'}))
+        self.assertRedirects(resp, self.book.get_absolute_url())
+
+    def test_resolver_404_for_invalid_or_unknown_isbn(self):
+        self.assertEqual(self.client.get(reverse('isbn-resolve', kwargs={'isbn': '123'})).status_code, 404)
+        self.assertEqual(self.client.get(reverse('isbn-resolve', kwargs={'isbn': '9780804429573'})).status_code, 404)
+
+    def test_batch_resolves_in_one_query(self):
+        isbns = ['0306406152', '9780804429573', 'junk']
+        with self.assertNumQueries(1):
+            resp = self.client.post(reverse('isbn-resolve-batch'), json.dumps({'isbns': isbns}),
+                                    content_type='application/json')
+        results = resp.json()['results']
+        self.assertEqual(results['0306406152']['id'], self.book.pk)
+        self.assertEqual(results['0306406152']['url'], self.book.get_absolute_url())
+        self.assertIsNone(results['9780804429573'])
+        self.assertIsNone(results['junk'])
+
+    def test_batch_rejects_bad_payload(self):
+        resp = self.client.post(reverse('isbn-resolve-batch'), 'nope', content_type='application/json')
+        self.assertEqual(resp.status_code, 400)
@@ -0,0 +1,164 @@
+import threading
+import time
+from unittest import skipUnless
+
+from django.contrib.auth.models import Group
+from django.db import OperationalError, connection
+from django.db.models import F
+from django.test import TestCase, TransactionTestCase
+
+from catalog import circulation, limits
+from catalog.models import BookInstance, LoanCounter, LoanLimit
+from . import factories
+
+
+def checkout(borrower, copies):
+    results = circulation.apply_batch(circulation.CHECKOUT, [str(copy.pk) for copy in copies], borrower)
+    return [result.get('error') for result in results.values()]
+
+
+class LoanLimitTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.patron = factories.create_user('patron')
+        cls.staff = Group.objects.create(name='Staff')
+        cls.students = Group.objects.create(name='Students')
+        cls.book = factories.create_book()
+
+    def setUp(self):
+        self.copies = factories.create_copies(self.book, 6)
+
+    def loans(self):
+        return BookInstance.objects.filter(borrower=self.patron, status='o').count()
+
+    def counter(self):
+        return LoanCounter.objects.get(borrower=self.patron).active_loans
+
+    def test_limit_of_the_user(self):
+        self.assertIsNone(limits.loan_limit(self.patron))
+        LoanLimit.objects.create(max_loans=3)
+        self.assertEqual(limits.loan_limit(self.patron), 3)
+        LoanLimit.objects.create(group=self.students, max_loans=2)
+        LoanLimit.objects.create(group=self.staff, max_loans=10)
+        self.patron.groups.add(self.students)
+        self.assertEqual(limits.loan_limit(self.patron), 2)
+        self.patron.groups.add(self.staff)
+        self.assertEqual(limits.loan_limit(self.patron), 10)
+
+    def test_checkout_stops_at_the_limit(self):
+        LoanLimit.objects.create(max_loans=4)
+        self.assertEqual(checkout(self.patron, self.copies[:3]), [None, None, None])
+        self.assertEqual(
+            checkout(self.patron, self.copies[3:]), [None, 'loan limit reached', 'loan limit reached']
+        )
+        self.assertEqual(self.loans(), 4)
+        self.assertEqual(self.counter(), 4)
+        self.assertEqual(BookInstance.objects.get(pk=self.copies[5].pk).status, 'a')
+
+    def test_return_gives_loans_back(self):
+        LoanLimit.objects.create(max_loans=2)
+        checkout(self.patron, self.copies[:2])
+        circulation.apply_batch(circulation.RETURN, [str(self.copies[0].pk)])
+        self.assertEqual(self.counter(), 1)
+        self.assertEqual(checkout(self.patron, self.copies[2:4]), [None, 'loan limit reached'])
+        self.assertEqual(self.counter(), 2)
+
+    def test_counter_is_created_from_existing_loans(self):
+        LoanLimit.objects.create(max_loans=3)
+        BookInstance.objects.filter(pk__in=[copy.pk for copy in self.copies[:2]]).update(
+            status='o', borrower=self.patron
+        )
+        self.assertEqual(checkout(self.patron, self.copies[2:4]), [None, 'loan limit reached'])
+        self.assertEqual(self.counter(), 3)
+
+    def test_single_statement_rejects_a_stale_check(self):
+        LoanLimit.objects.create(max_loans=2)
+        checkout(self.patron, self.copies[:1])
+        # Another desk lends the last allowed copy between this desk's read and its update.
+        LoanCounter.objects.filter(borrower=self.patron).update(active_loans=2)
+        self.assertEqual(limits.take_loans(self.patron, 1), 0)
+        self.assertEqual(self.counter(), 2)
+
+    def test_remaining_room_from_a_stale_read_is_not_granted(self):
+        LoanLimit.objects.create(max_loans=3)
+        checkout(self.patron, self.copies[:1])
+        # A desk asking for more than is left reads the room for 2 more loans...
+        room = 3 - self.counter()
+        # ...and another desk lends a copy before its update.
+        LoanCounter.objects.filter(borrower=self.patron).update(active_loans=F('active_loans') + 1)
+
+        self.assertFalse(limits._take(self.patron.pk, room, 3))
+        self.assertEqual(self.counter(), 2)
+        self.assertEqual(limits.take_loans(self.patron, 5), 1)
+        self.assertEqual(self.counter(), 3)
+
+    def test_saved_changes_are_counted(self):
+        copy = BookInstance.objects.get(pk=self.copies[0].pk)
+        copy.status, copy.borrower = 'o', self.patron
+        copy.save()
+        self.assertEqual(self.counter(), 1)
+
+        other = factories.create_user()
+        copy.borrower = other
+        copy.save()
+        self.assertEqual(self.counter(), 0)
+        self.assertEqual(LoanCounter.objects.get(borrower=other).active_loans, 1)
+
+        copy.delete()
+        self.assertEqual(LoanCounter.objects.get(borrower=other).active_loans, 0)
+
+    def test_refresh_counters(self):
+        BookInstance.objects.filter(pk__in=[copy.pk for copy in self.copies[:3]]).update(
+            status='o', borrower=self.patron
+        )
+        LoanCounter.objects.create(borrower=self.patron, active_loans=7)
+        limits.refresh_counters([self.patron.pk])
+        self.assertEqual(self.counter(), 3)
+
+
+# SQLite runs one writer at a time, so the checkouts would never overlap; the stale reads they could race on
+# are covered deterministically by LoanLimitTest.
+@skipUnless(connection.vendor == 'postgresql', 'needs a database that runs concurrent writers')
+class ConcurrentCheckoutTest(TransactionTestCase):
+    LIMIT = 3
+    DESKS = 8
+
+    def setUp(self):
+        self.patron = factories.create_user('patron')
+        self.copies = factories.create_copies(factories.create_book(), self.DESKS)
+        LoanLimit.objects.create(max_loans=self.LIMIT)
+        LoanCounter.objects.create(borrower=self.patron)
+
+    def desk(self, copy, start, lent):
+        start.wait()
+        try:
+            for _ in range(50):
+                try:
+                    response, _ = circulation.process_batch(
+                        'desk-%s' % copy.pk, circulation.CHECKOUT, [str(copy.pk)], borrower=self.patron
+                    )
+                except OperationalError:
+                    # A deadlock or lock timeout is retried, as a desk would.
+                    time.sleep(0.01)
+                    continue
+                if response['results'][str(copy.pk)]['ok']:
+                    lent.append(copy.pk)
+                return
+        finally:
+            connection.close()
+
+    def test_limit_is_never_exceeded(self):
+        start = threading.Barrier(self.DESKS)
+        lent = []
+        desks = [threading.Thread(target=self.desk, args=(copy, start, lent)) for copy in self.copies]
+        for desk in desks:
+            desk.start()
+        for desk in desks:
+            desk.join()
+
+        on_loan = BookInstance.objects.filter(borrower=self.patron, status='o').count()
+        self.assertLessEqual(on_loan, self.LIMIT)
+        self.assertGreater(on_loan, 0)
+        self.assertEqual(on_loan, len(lent))
+        self.assertEqual(LoanCounter.objects.get(borrower=self.patron).active_loans, on_loan)
@@ -0,0 +1,175 @@
+import asyncio
+import json
+import threading
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from catalog import circulation, live
+from catalog.asgi import StreamingASGIHandler
+from catalog.models import Author, Book, BookInstance
+
+
+class BrokerTest(TestCase):
+
+    def setUp(self):
+        self.broker = live.Broker()
+
+    def test_fan_out_from_another_thread(self):
+        async def scenario():
+            subscriptions = [self.broker.subscribe('book:1') for _ in range(50)]
+            other = self.broker.subscribe('book:2')
+            publisher = threading.Thread(target=self.broker.publish, args=([('book:1', {'n': 1})],))
+            publisher.start()
+            publisher.join()
+            received = await asyncio.gather(*(asyncio.wait_for(s.get(), 1) for s in subscriptions))
+            return received, other.queue.qsize()
+
+        received, other_pending = asyncio.run(scenario())
+        self.assertEqual(received, [{'n': 1}] * 50)
+        self.assertEqual(other_pending, 0)
+
+    def test_close_unsubscribes(self):
+        async def scenario():
+            subscription = self.broker.subscribe('book:1', 'user:1')
+            self.assertEqual(self.broker.subscriber_count(), 1)
+            subscription.close()
+
+        asyncio.run(scenario())
+        self.assertEqual(self.broker.subscriber_count(), 0)
+        self.assertEqual(dict(self.broker._topics), {})
+
+    def test_slow_client_is_asked_to_reload(self):
+        async def scenario():
+            subscription = self.broker.subscribe('book:1')
+            self.broker.publish([('book:1', {'n': n}) for n in range(live.MAX_PENDING + 5)])
+            await asyncio.sleep(0)
+            return [subscription.queue.get_nowait() for _ in range(subscription.queue.qsize())]
+
+        pending = asyncio.run(scenario())
+        self.assertEqual(len(pending), live.MAX_PENDING)
+        self.assertIsNone(pending[-1])
+
+
+class PublishTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.patron = User.objects.create_user(username='patron', password='12345')
+        author = Author.objects.create(first_name='John', last_name='Smith')
+        cls.book = Book.objects.create(title='Book Title', summary='Summary', author=author)
+        cls.copy = BookInstance.objects.create(book=cls.book, imprint='Imprint', status='a')
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def received(self, subscription):
+        async def drain():
+            await asyncio.sleep(0)
+            return [subscription.queue.get_nowait() for _ in range(subscription.queue.qsize())]
+        return self.loop.run_until_complete(drain())
+
+    def test_save_publishes_after_commit(self):
+        book_sub = live.broker.subscribe(live.book_topic(self.book.pk), loop=self.loop)
+        user_sub = live.broker.subscribe(live.user_topic(self.patron.pk), loop=self.loop)
+        self.addCleanup(book_sub.close)
+        self.addCleanup(user_sub.close)
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.copy.status = 'o'
+            self.copy.borrower = self.patron
+            self.copy.save()
+            self.assertEqual(self.received(book_sub), [])
+
+        self.assertTrue(callbacks)
+        [message] = self.received(book_sub)
+        self.assertEqual(message['copy'], str(self.copy.pk))
+        self.assertEqual(message['status_display'], 'On loan')
+        self.assertEqual(self.received(user_sub), [message])
+
+    def test_unchanged_save_publishes_nothing(self):
+        book_sub = live.broker.subscribe(live.book_topic(self.book.pk), loop=self.loop)
+        self.addCleanup(book_sub.close)
+        with self.captureOnCommitCallbacks(execute=True):
+            BookInstance.objects.get(pk=self.copy.pk).save()
+        self.assertEqual(self.received(book_sub), [])
+
+    def test_batch_return_notifies_previous_borrower(self):
+        BookInstance.objects.filter(pk=self.copy.pk).update(status='o', borrower=self.patron)
+        user_sub = live.broker.subscribe(live.user_topic(self.patron.pk), loop=self.loop)
+        self.addCleanup(user_sub.close)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            circulation.process_batch('return-1', circulation.RETURN, [str(self.copy.pk)])
+
+        [message] = self.received(user_sub)
+        self.assertEqual(message['status'], 'a')
+
+
+class StreamViewTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create_user(username='patron', password='12345')
+        author = Author.objects.create(first_name='John', last_name='Smith')
+        cls.book = Book.objects.create(title='Book Title', summary='Summary', author=author)
+
+    def setUp(self):
+        cache.clear()
+
+    @override_settings(LIVE_STREAMS=True)
+    async def test_book_stream_under_asgi(self):
+        response = await self.async_client.get(reverse('book-availability-stream', args=[self.book.pk]))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        self.assertEqual(await anext(stream), b'retry: 3000\n\n')
+
+        first = asyncio.ensure_future(anext(stream))
+        await asyncio.sleep(0)
+        live.broker.publish([(live.book_topic(self.book.pk), {'copy': 'x', 'status': 'a'})])
+        frame = (await asyncio.wait_for(first, 1)).decode()
+        self.assertTrue(frame.startswith('event: copy\ndata: '))
+        self.assertEqual(json.loads(frame.split('data: ', 1)[1]), {'copy': 'x', 'status': 'a'})
+
+        # An ASGI server cancels the response when the client disconnects.
+        pending = asyncio.ensure_future(anext(stream))
+        await asyncio.sleep(0)
+        pending.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await pending
+        self.assertEqual(live.broker.subscriber_count(), 0)
+
+    @override_settings(LIVE_STREAMS=True)
+    async def test_unknown_book(self):
+        response = await self.async_client.get(reverse('book-availability-stream', args=[999]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_my_loans_stream_requires_login(self):
+        response = self.client.get(reverse('my-loans-stream'))
+        self.assertRedirects(response, '/accounts/login/?next=/catalog/mybooks/stream/', fetch_redirect_response=False)
+
+    def test_no_stream_without_asgi(self):
+        self.client.login(username='patron', password='12345')
+        self.assertEqual(self.client.get(reverse('my-loans-stream')).status_code, 204)
+        self.assertEqual(self.client.get(reverse('book-availability-stream', args=[self.book.pk])).status_code, 204)
+        self.assertEqual(live.broker.subscriber_count(), 0)
+
+    def test_pages_only_name_streams_under_asgi(self):
+        url = reverse('book-detail', args=[self.book.pk])
+        self.assertNotContains(self.client.get(url), 'data-stream')
+        cache.clear()
+        with self.settings(LIVE_STREAMS=True):
+            self.assertContains(self.client.get(url), 'data-stream')
+
+
+class StreamingASGIHandlerTest(SimpleTestCase):
+
+    def test_only_event_streams_skip_the_per_request_thread(self):
+        handler = StreamingASGIHandler()
+        self.assertTrue(handler.is_event_stream({'path': '/catalog/book/1/availability/'}))
+        self.assertTrue(handler.is_event_stream({'path': '/app/catalog/mybooks/stream/', 'root_path': '/app'}))
+        self.assertFalse(handler.is_event_stream({'path': '/catalog/books/'}))
+        self.assertFalse(handler.is_event_stream({'path': '/missing/'}))
@@ -0,0 +1,119 @@
+import datetime
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.test import TestCase
+from django.urls import reverse
+
+from catalog import metrics
+from catalog.models import Author, Book, BookInstance
+
+
+class MetricsTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        author = Author.objects.create(first_name='John', last_name='Smith')
+        book = Book.objects.create(title='Book Title', summary='Summary', author=author)
+        BookInstance.objects.create(book=book, imprint='Imprint', status='a')
+        BookInstance.objects.create(book=book, imprint='Imprint', status='o', due_back=datetime.date(2000, 1, 1))
+        BookInstance.objects.create(
+            book=book, imprint='Imprint', status='o', due_back=datetime.date.today() + datetime.timedelta(days=7)
+        )
+
+    def setUp(self):
+        cache.clear()
+        metrics.samples.clear()
+
+    def scrape(self):
+        with self.settings(METRICS_ALLOWED_IPS=['127.0.0.1']):
+            response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def test_requests_are_counted_per_url_name(self):
+        self.client.get(reverse('index'))
+        self.client.get(reverse('index'))
+        body = self.scrape()
+
+        self.assertIn('catalog_http_requests_total{view="index",method="GET",status="200"} 2', body)
+        self.assertIn('catalog_http_request_duration_seconds_bucket{view="index",le="+Inf"} 2', body)
+        self.assertIn('catalog_http_request_duration_seconds_count{view="index"} 2', body)
+        self.assertIn('catalog_db_queries_total{view="index"}', body)
+
+    def test_circulation_gauges(self):
+        body = self.scrape()
+        self.assertIn('catalog_copies_on_loan 2', body)
+        self.assertIn('catalog_copies_overdue 1', body)
+        self.assertIn('catalog_copies_available 1', body)
+
+    def test_gauges_are_cached_until_availability_changes(self):
+        metrics.circulation_gauges()
+        with self.assertNumQueries(0):
+            metrics.render()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            BookInstance.objects.filter(status='a').get().delete()
+        self.assertEqual(metrics.circulation_gauges()['catalog_copies_available'], 0)
+
+    def test_cache_hits_and_misses(self):
+        cache.get('missing')
+        cache.set('present', 1)
+        cache.get_many(['present', 'missing'])
+        collected = metrics.samples.collect()
+        self.assertEqual(collected[metrics.CACHE_REQUESTS, (('result', 'hit'),)], 1)
+        self.assertEqual(collected[metrics.CACHE_REQUESTS, (('result', 'miss'),)], 2)
+        self.assertEqual(caches['shared'].get('present'), 1)
+
+    def test_samples_of_finished_threads_are_kept(self):
+        thread = threading.Thread(target=metrics.samples.inc, args=('test_total', (), 3))
+        thread.start()
+        thread.join()
+        metrics.samples.inc('test_total')
+        self.assertEqual(metrics.samples.collect()['test_total', ()], 4)
+        self.assertEqual(metrics.samples.collect()['test_total', ()], 4)
+
+    def test_processes_are_aggregated_through_metrics_dir(self):
+        with tempfile.TemporaryDirectory() as directory, self.settings(METRICS_DIR=directory):
+            with open(os.path.join(directory, '1-1.json'), 'w') as file:
+                json.dump([[metrics.REQUESTS, [['view', 'books'], ['method', 'GET'], ['status', '200']], 5]], file)
+            metrics.record_request('books', 'GET', 200, 0.01)
+            body = self.scrape()
+            self.assertEqual(len(os.listdir(directory)), 2)
+        self.assertIn('catalog_http_requests_total{view="books",method="GET",status="200"} 6', body)
+
+    def test_exited_processes_are_folded_into_one_file(self):
+        exited = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'],
+                                capture_output=True, text=True, check=True)
+        dead_file = '%s-1.json' % exited.stdout.strip()
+        row = [metrics.REQUESTS, [['view', 'books'], ['method', 'GET'], ['status', '200']], 5]
+        with tempfile.TemporaryDirectory() as directory, self.settings(METRICS_DIR=directory):
+            for filename in (dead_file, metrics.RETIRED_FILENAME):
+                with open(os.path.join(directory, filename), 'w') as file:
+                    json.dump([row], file)
+            first = self.scrape()
+            files = sorted(os.listdir(directory))
+            second = self.scrape()
+        self.assertNotIn(dead_file, files)
+        self.assertIn(metrics.RETIRED_FILENAME, files)
+        self.assertEqual(len(files), 2)
+        for body in (first, second):
+            self.assertIn('catalog_http_requests_total{view="books",method="GET",status="200"} 10', body)
+
+    def test_only_allowed_addresses_and_staff_may_scrape(self):
+        with self.settings(METRICS_ALLOWED_IPS=['10.0.0.9']):
+            self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+            self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='10.0.0.9').status_code, 200)
+            User.objects.create_user(username='staff', password='12345', is_staff=True)
+            self.client.login(username='staff', password='12345')
+            self.assertEqual(self.client.get(reverse('metrics')).status_code, 200)
+
+    def test_loopback_may_not_scrape_by_default(self):
+        # Behind a reverse proxy on the same host, every request comes from loopback.
+        self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='127.0.0.1').status_code, 403)
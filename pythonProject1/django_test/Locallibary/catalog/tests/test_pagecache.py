@@ -0,0 +1,204 @@
+from django.contrib.auth.models import Group, Permission, User
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from catalog import branches, circulation, fines, pagecache
+from catalog.models import Author, Book, BookInstance, Branch, Fine
+from . import factories
+
+
+class SharedPageCacheTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.patron = User.objects.create_user(username='patron', password='12345')
+        cls.librarian = User.objects.create_user(username='librarian', password='12345')
+        cls.librarian.user_permissions.add(Permission.objects.get(codename='can_mark_returned'))
+        cls.author = Author.objects.create(first_name='John', last_name='Smith')
+        cls.book = Book.objects.create(title='Book', summary='Summary', author=cls.author)
+        cls.copy = BookInstance.objects.create(book=cls.book, imprint='Imprint', status='a')
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('book-detail', args=[self.book.pk])
+
+    def get(self, username=None, url=None):
+        self.client.logout()
+        if username:
+            self.client.login(username=username, password='12345')
+        response = self.client.get(url or self.url)
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def test_body_is_shared_and_navigation_is_personal(self):
+        anonymous = self.get()
+        patron = self.get('patron')
+        librarian = self.get('librarian')
+
+        self.assertIn('Login</a>', anonymous)
+        self.assertIn('?next=%s' % self.url, anonymous)
+        self.assertNotIn('User:', anonymous)
+        self.assertIn('User: patron', patron)
+        self.assertNotIn('All Borrowed', patron)
+        self.assertIn('User: librarian', librarian)
+        self.assertIn('All Borrowed', librarian)
+        for content in (anonymous, patron, librarian):
+            self.assertNotIn(pagecache.PLACEHOLDER, content)
+            self.assertIn('Summary', content)
+
+    def test_cached_page_matches_the_rendered_one(self):
+        rendered = self.get('patron')
+        self.assertEqual(self.get('patron'), rendered)
+
+    def test_hit_does_not_run_the_view(self):
+        self.get('librarian')
+        self.client.logout()
+        self.client.login(username='patron', password='12345')
+        self.client.get(self.url)
+        with self.assertNumQueries(0):
+            # The session and the user come from the cache.
+            self.client.get(self.url)
+
+    def test_availability_change_invalidates(self):
+        self.assertIn('Available', self.get('patron'))
+        self.copy.status = 'o'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.copy.save()
+        self.assertIn('On loan', self.get('patron'))
+
+    def test_loans_of_other_books_keep_the_page(self):
+        other = BookInstance.objects.create(book=Book.objects.create(title='Other', summary='Summary'), imprint='Imprint')
+        self.get()
+        other.status = 'o'
+        other.save()
+        with self.assertNumQueries(0):
+            self.client.get(self.url)
+
+    def test_query_string_is_part_of_the_key(self):
+        Book.objects.create(title='Other', summary='Summary', author=self.author)
+        books = reverse('books')
+        self.assertIn('Other', self.get('patron', books))
+        self.assertNotIn('Other', self.get('patron', books + '?author=0&genre=%d' % 0))
+
+    @override_settings(PAGE_CACHE_EDGE_INCLUDES=True)
+    def test_edge_includes(self):
+        self.client.login(username='patron', password='12345')
+        response = self.client.get(self.url)
+        self.assertEqual(response['Surrogate-Control'], 'content="ESI/1.0"')
+        include = '<esi:include src="%s?next=%s" />' % (reverse('user-nav'), self.url.replace('/', '%2F'))
+        self.assertIn(include, response.content.decode())
+        self.assertNotIn('User: patron', response.content.decode())
+
+        fragment = self.client.get(reverse('user-nav'), {'next': self.url})
+        self.assertIn('User: patron', fragment.content.decode())
+        self.assertIn('?next=%s' % self.url, fragment.content.decode())
+        self.assertIn('private', fragment['Cache-Control'])
+
+    def test_user_nav_rejects_external_next(self):
+        fragment = self.client.get(reverse('user-nav'), {'next': '//evil.example.com/'})
+        self.assertIn('?next=%s"' % reverse('index'), fragment.content.decode())
+
+
+class UserPageCacheTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.patron = factories.create_user('patron')
+        cls.other = factories.create_user('other')
+        cls.book = factories.create_book(title='Dune')
+        cls.copies = factories.create_copies(
+            cls.book, 3, status='o', borrower=cls.patron, due_back=lambda n: factories.due_in(n + 1)
+        )
+        cls.other_copy = factories.create_copy(cls.book, status='o', borrower=cls.other, due_back=factories.due_in(5))
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('my-borrowed')
+        self.client.login(username='patron', password=factories.PASSWORD)
+
+    def get(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_repeat_visit_runs_no_query(self):
+        first = self.get()
+        self.assertIn('private', first['Cache-Control'])
+        with self.assertNumQueries(0):
+            second = self.get()
+        self.assertEqual(second.content, first.content)
+
+    def test_pages_are_per_user(self):
+        self.get()
+        self.client.login(username='other', password=factories.PASSWORD)
+        content = self.get().content.decode()
+        self.assertIn('User: other', content)
+        self.assertEqual(content.count('Dune'), 1)
+
+    def test_return_invalidates(self):
+        self.assertEqual(self.get().content.decode().count('Dune'), 3)
+        with self.captureOnCommitCallbacks(execute=True):
+            circulation.apply_batch(circulation.RETURN, [str(self.copies[0].pk)])
+        self.assertEqual(self.get().content.decode().count('Dune'), 2)
+
+    def test_pages_are_invalidated_when_the_change_commits(self):
+        self.get()
+        with self.captureOnCommitCallbacks() as callbacks:
+            circulation.apply_batch(circulation.RETURN, [str(self.copies[0].pk)])
+        # Until then other requests cannot see the change, and a page cached meanwhile would hide it.
+        with self.assertNumQueries(0):
+            self.client.get(self.url)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.get().content.decode().count('Dune'), 2)
+
+    def test_saved_copy_invalidates_old_and_new_borrower(self):
+        self.get()
+        copy = BookInstance.objects.get(pk=self.other_copy.pk)
+        copy.borrower = self.patron
+        with self.captureOnCommitCallbacks(execute=True):
+            copy.save()
+        self.assertEqual(self.get().content.decode().count('Dune'), 4)
+        with self.captureOnCommitCallbacks(execute=True):
+            copy.delete()
+        self.assertEqual(self.get().content.decode().count('Dune'), 3)
+
+    def test_other_users_changes_keep_the_page(self):
+        self.get()
+        circulation.apply_batch(circulation.RETURN, [str(self.other_copy.pk)])
+        with self.assertNumQueries(0):
+            self.client.get(self.url)
+
+    def test_transfer_invalidates(self):
+        branch = Branch.objects.create(name='Branch')
+        self.client.get(self.url, {'branch': branch.pk})
+        self.assertNotIn('Dune', self.get().content.decode())
+        with self.captureOnCommitCallbacks(execute=True):
+            branches.transfer_copies([self.copies[0].pk], branch)
+        self.assertEqual(self.get().content.decode().count('Dune'), 1)
+
+    def test_fines_invalidate(self):
+        self.get()
+        fine = Fine.objects.create(
+            book_instance=self.copies[0], borrower=self.patron, due_back=factories.due_in(-3), days_overdue=3,
+            amount='1.50', computed_on=factories.due_in(0),
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            fines.refresh_balances()
+        self.assertIn('1.50', self.get().content.decode())
+        with self.captureOnCommitCallbacks(execute=True):
+            fines.mark_paid(Fine.objects.filter(pk=fine.pk))
+        self.assertNotIn('1.50', self.get().content.decode())
+
+    def test_group_permission_change_invalidates(self):
+        group = Group.objects.create(name='Librarians')
+        group.user_set.add(self.patron)
+        self.assertNotIn('All Borrowed', self.get().content.decode())
+        group.permissions.add(Permission.objects.get(codename='can_mark_returned'))
+        self.assertIn('All Borrowed', self.get().content.decode())
+
+    def test_anonymous_visitor_is_redirected(self):
+        self.client.logout()
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 302)
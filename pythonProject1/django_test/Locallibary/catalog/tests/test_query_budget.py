@@ -0,0 +1,108 @@
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.test import TestCase
+
+from catalog import querybudget, urls
+from catalog.models import Author, Book
+
+
+class QueryBudgetTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        for n in range(3):
+            author = Author.objects.create(first_name='First', last_name='Author %d' % n)
+            Book.objects.create(title='Book %d' % n, summary='Summary', author=author)
+
+    def setUp(self):
+        cache.clear()
+
+    def render_books(self, last='Book 2'):
+        # Without select_related('author'), as a regressed BookListView would.
+        return render_to_string('catalog/book_list.html', {'book_list': Book.objects.filter(title__lte=last)})
+
+    def test_log_reports_the_template_line(self):
+        with querybudget.QueryLog() as log:
+            self.render_books()
+        self.assertEqual(len(log), 4)
+        report = log.report()
+        self.assertIn('3 x SELECT', report)
+        self.assertIn('"catalog_author"', report)
+        self.assertIn('3 x from catalog/book_list.html:13 {{ book.author }}', report)
+        self.assertIn('1 x from catalog/book_list.html:8 {% if book_list %}', log.report(log.counts()))
+
+    def test_code_origin_outside_templates(self):
+        with querybudget.QueryLog() as log:
+            list(Book.objects.all())
+        self.assertRegex(log.queries[0].origin, r'^catalog/tests/test_query_budget\.py:\d+ in ')
+
+    def test_templates_are_restored(self):
+        with querybudget.QueryLog():
+            with querybudget.QueryLog() as inner:
+                self.render_books()
+        self.assertEqual(len(inner), 4)
+        with querybudget.QueryLog() as log:
+            pass
+        self.render_books()
+        self.assertEqual(querybudget._tracking['count'], 0)
+        self.assertEqual(len(log), 0)
+
+    def test_budget_as_context_manager(self):
+        with querybudget.query_budget(4):
+            self.render_books()
+        with self.assertRaisesMessage(querybudget.QueryBudgetExceeded, '4 queries run, the budget is 3.'):
+            with querybudget.query_budget(3):
+                self.render_books()
+
+    def test_budget_as_decorator(self):
+        @querybudget.query_budget(1)
+        def count_books():
+            return Book.objects.count()
+
+        self.assertEqual(count_books(), 3)
+
+        @querybudget.query_budget(1)
+        def titles():
+            return [book.title for book in Book.objects.all()] + [Book.objects.count()]
+
+        with self.assertRaises(querybudget.QueryBudgetExceeded):
+            titles()
+
+    def test_growth_is_reported(self):
+        with querybudget.QueryLog() as small:
+            self.render_books('Book 0')
+        with querybudget.QueryLog() as large:
+            self.render_books()
+        with self.assertRaises(querybudget.QueryBudgetExceeded) as caught:
+            querybudget.check_growth(small, large, 'books')
+        message = str(caught.exception)
+        self.assertIn('books runs 2 queries against the small data and 4 against the large data.', message)
+        self.assertIn('3 x from catalog/book_list.html:13 {{ book.author }}', message)
+        self.assertNotIn('"catalog_book"."title"', message)
+
+        logs = []
+        for last in ('Book 0', 'Book 2'):
+            with querybudget.QueryLog() as log:
+                books = Book.objects.filter(title__lte=last).select_related('author')
+                render_to_string('catalog/book_list.html', {'book_list': books})
+            logs.append(log)
+        querybudget.check_growth(*logs)
+
+    def test_normalize(self):
+        self.assertEqual(
+            querybudget.normalize('SELECT 1 WHERE id IN (%s, %s, %s) LIMIT 10 OFFSET 20'),
+            'SELECT 1 WHERE id IN (%s, ...) LIMIT %s OFFSET %s',
+        )
+
+
+class QueryBudgetSweepTest(TestCase):
+
+    def test_every_url_is_swept_or_skipped(self):
+        swept = set(querybudget.sweep_requests(querybudget.seed(1)))
+        names = {pattern.name for pattern in urls.urlpatterns}
+        self.assertEqual(names - swept - set(querybudget.SKIPPED), set())
+
+    def test_no_query_count_grows_with_the_data(self):
+        results = querybudget.sweep()
+        self.assertEqual(len(results), len(urls.urlpatterns) - len(querybudget.SKIPPED))
+        self.assertEqual(querybudget.failures(results), [])
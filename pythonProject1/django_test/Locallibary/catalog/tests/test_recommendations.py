@@ -0,0 +1,69 @@
+import uuid
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from catalog.models import Author, Book, BookRecommendation, LoanEvent
+from catalog.recommendations import build_recommendations, recommended_books
+
+
+@override_settings(ROLLUP_SETTLE_SECONDS=0)
+class RecommendationTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [User.objects.create(username='patron%d' % number) for number in range(3)]
+        author = Author.objects.create(first_name='John', last_name='Smith')
+        cls.books = [Book.objects.create(title=title, summary='Summary', author=author) for title in 'ABCD']
+
+    def borrow(self, user, *books):
+        LoanEvent.objects.bulk_create([
+            LoanEvent(kind=LoanEvent.CHECKOUT, book_instance_id=uuid.uuid4(), book=book, borrower=user)
+            for book in books
+        ])
+
+    def test_neighbours_ranked_by_shared_borrowers(self):
+        a, b, c, d = self.books
+        self.borrow(self.users[0], a, b)
+        self.borrow(self.users[1], a, b, c)
+        self.borrow(self.users[2], d)
+
+        build_recommendations(full=True)
+
+        self.assertEqual(recommended_books(a), [b, c])
+        self.assertEqual(recommended_books(d), [])
+        self.assertEqual(BookRecommendation.objects.get(book=a, position=1).score, 2)
+
+    def test_top_k_limits_neighbours(self):
+        a, b, c, d = self.books
+        self.borrow(self.users[0], a, b, c, d)
+
+        build_recommendations(full=True, top_k=2)
+
+        self.assertEqual(BookRecommendation.objects.filter(book=a).count(), 2)
+
+    def test_incremental_refresh_only_touches_new_borrowers_books(self):
+        a, b, c, d = self.books
+        self.borrow(self.users[0], a, b)
+        self.borrow(self.users[1], c, d)
+        build_recommendations()
+        self.assertEqual(build_recommendations(), 0)
+
+        self.borrow(self.users[0], c)
+        written = build_recommendations()
+
+        # Only the first patron's books are recomputed: a and b get 2 neighbours, c gets 3.
+        self.assertEqual(written, 7)
+        self.assertEqual(recommended_books(c), [a, b, d])
+        self.assertEqual(recommended_books(d), [c])
+
+    def test_book_detail_shows_recommendations(self):
+        a, b, c, d = self.books
+        self.borrow(self.users[0], a, b)
+        build_recommendations(full=True)
+
+        resp = self.client.get(reverse('book-detail', kwargs={'pk': a.pk}))
+
+        self.assertEqual(resp.context['recommended_books'], [b])
+        self.assertContains(resp, 'also borrowed')
@@ -0,0 +1,67 @@
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from catalog.models import Author, Book, BookTerm, Genre
+from catalog.similarity import build_similarity, similar_books, term_id, vectorize
+
+
+class SimilarityTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = Author.objects.create(first_name='John', last_name='Smith')
+        cls.space = Genre.objects.create(name='Science Fiction')
+        cls.poetry = Genre.objects.create(name='Poetry')
+
+    def create_book(self, title, summary, genre):
+        book = Book.objects.create(title=title, summary=summary, author=self.author)
+        book.genre.set([genre])
+        return book
+
+    def test_vector_is_normalised(self):
+        vector = vectorize('Dune', 'Spice, desert and spice worms', ['Science Fiction'])
+        self.assertAlmostEqual(sum(weight * weight for weight in vector.values()), 1.0)
+        self.assertEqual(vectorize('', 'a the of', []), {})
+
+    def test_most_similar_book_comes_first(self):
+        dune = self.create_book('Dune', 'Desert planet, spice and giant sand worms.', self.space)
+        messiah = self.create_book('Dune Messiah', 'The desert planet emperor and the spice.', self.space)
+        sonnets = self.create_book('Sonnets', 'Love poems about summer days.', self.poetry)
+        build_similarity()
+
+        self.assertEqual(similar_books(dune)[0], messiah)
+        self.assertNotIn(dune, similar_books(dune))
+        self.assertNotIn(sonnets, similar_books(dune))
+
+    def test_saving_a_book_refreshes_its_postings(self):
+        book = self.create_book('Dune', 'Desert planet.', self.space)
+        terms = set(BookTerm.objects.filter(book=book).values_list('term', flat=True))
+
+        book.summary = 'Ocean world.'
+        book.save()
+
+        self.assertNotEqual(set(BookTerm.objects.filter(book=book).values_list('term', flat=True)), terms)
+
+    def test_book_detail_shows_similar_books(self):
+        dune = self.create_book('Dune', 'Desert planet, spice and giant sand worms.', self.space)
+        messiah = self.create_book('Dune Messiah', 'The desert planet emperor and the spice.', self.space)
+
+        resp = self.client.get(reverse('book-detail', kwargs={'pk': dune.pk}))
+
+        self.assertEqual(resp.context['similar_books'], [messiah])
+        self.assertContains(resp, 'More like this')
+
+    def test_common_genre_is_not_a_query_term(self):
+        summary = ' '.join('word%d' % number for number in range(30))
+        dune = self.create_book('Dune', summary, self.space)
+        for number in range(20):
+            self.create_book('Other %d' % number, 'Filler %d text' % number, self.space)
+        build_similarity()
+
+        with CaptureQueriesContext(connection) as queries:
+            similar_books(dune)
+        [scores] = [query['sql'] for query in queries if 'SUM(' in query['sql']]
+        self.assertNotIn(str(term_id('genre:science fiction')), scores)
+        self.assertIn(str(term_id('word1')), scores)
@@ -0,0 +1,83 @@
+import gzip
+import os
+import re
+import tempfile
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from catalog.models import Author, Book
+
+
+def locations(content):
+    return re.findall(r'<loc>([^<]+)</loc>', content)
+
+
+@override_settings(SITEMAP_URLS_PER_FILE=2)
+class SitemapTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.authors = [Author.objects.create(first_name='First', last_name='Author %d' % n) for n in range(3)]
+        cls.books = [
+            Book.objects.create(title='Book %d' % n, summary='Summary', author=cls.authors[0]) for n in range(5)
+        ]
+
+    def setUp(self):
+        cache.clear()
+
+    def get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def expected_urls(self):
+        return {'http://testserver' + book.get_absolute_url() for book in self.books} | {
+            'http://testserver' + author.get_absolute_url() for author in self.authors
+        }
+
+    def test_index_and_files_cover_every_page(self):
+        files = locations(self.get(reverse('sitemap-index')))
+        urls = []
+        for file_url in files:
+            with self.assertNumQueries(1):
+                file_urls = locations(self.get(file_url.replace('http://testserver', '')))
+            self.assertLessEqual(len(file_urls), 2)
+            urls.extend(file_urls)
+        self.assertEqual(len(urls), 8)
+        self.assertEqual(set(urls), self.expected_urls())
+
+    def test_lastmod_follows_modifications(self):
+        book = self.books[0]
+        book.title = 'Renamed'
+        book.save(update_fields=['title'])
+        book.refresh_from_db()
+        number = (book.pk - 1) // 2 + 1
+        content = self.get(reverse('sitemap-section', args=['books', number]))
+        self.assertIn(
+            '<loc>http://testserver%s</loc><lastmod>%s</lastmod>' % (
+                book.get_absolute_url(), book.updated.isoformat(timespec='seconds')
+            ),
+            content,
+        )
+
+    def test_unknown_section(self):
+        self.assertEqual(self.client.get(reverse('sitemap-section', args=['genres', 1])).status_code, 404)
+
+    def test_build_sitemaps_writes_gzipped_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            open(os.path.join(directory, 'sitemap-books-999.xml.gz'), 'w').close()
+            call_command('build_sitemaps', directory, base_url='http://testserver/', stdout=open(os.devnull, 'w'))
+
+            with open(os.path.join(directory, 'sitemap.xml')) as file:
+                files = locations(file.read())
+            self.assertTrue(all(url.startswith('http://testserver/sitemaps/sitemap-') for url in files))
+            self.assertNotIn('sitemap-books-999.xml.gz', os.listdir(directory))
+
+            urls = set()
+            for file_url in files:
+                with gzip.open(os.path.join(directory, file_url.rsplit('/', 1)[1]), 'rt') as file:
+                    urls.update(locations(file.read()))
+        self.assertEqual(urls, self.expected_urls())
@@ -0,0 +1,132 @@
+import os
+import shutil
+import tempfile
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from catalog import snapshot
+from catalog.models import Author, Book, BookInstance
+
+
+class SnapshotTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.authors = [Author.objects.create(first_name='First', last_name='Author %d' % n) for n in range(2)]
+        # Titles out of pk order, with duplicates, across three list pages.
+        cls.books = [
+            Book.objects.create(title='Book %02d' % (24 - n // 2), summary='Summary %d' % n, author=cls.authors[n % 2])
+            for n in range(25)
+        ]
+
+    def setUp(self):
+        cache.clear()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def read(self, filename):
+        with open(os.path.join(self.directory, filename), encoding='utf-8') as file:
+            return file.read()
+
+    def detail_files(self):
+        files = set()
+        for kind in ('book', 'author'):
+            root = os.path.join(self.directory, 'catalog', kind)
+            if os.path.isdir(root):
+                files.update('%s/%s' % (kind, pk) for pk in os.listdir(root))
+        return files
+
+    def remove_detail_files(self):
+        for kind in ('book', 'author'):
+            shutil.rmtree(os.path.join(self.directory, 'catalog', kind))
+
+    def test_full_snapshot(self):
+        result = snapshot.snapshot(self.directory, chunk_size=10)
+        self.assertEqual(result, (1 + 3 + 25 + 2, 0, []))
+        self.assertEqual(
+            self.detail_files(),
+            {'book/%d' % book.pk for book in self.books} | {'author/%d' % author.pk for author in self.authors},
+        )
+        book = self.books[7]
+        self.assertIn('Summary 7', self.read('catalog/book/%d/index.html' % book.pk))
+        self.assertIn('Author 1', self.read('catalog/author/%d/index.html' % self.authors[1].pk))
+        self.assertIn('<strong>Books:</strong> 25', self.read('catalog/index.html'))
+
+    def test_list_pages_match_the_view(self):
+        snapshot.snapshot(self.directory)
+        for number in (1, 2, 3):
+            response = self.client.get('/catalog/books/', {'page': number})
+            content = self.read(snapshot.list_page_filename(number))
+            page_books = list(response.context['page_obj'])
+            self.assertEqual(content.count('<a href="/catalog/book/'), len(page_books))
+            for book in page_books:
+                self.assertIn('/catalog/book/%d/' % book.pk, content)
+            positions = [content.index('/catalog/book/%d/' % book.pk) for book in page_books]
+            self.assertEqual(positions, sorted(positions))
+        self.assertFalse(os.path.exists(os.path.join(self.directory, snapshot.list_page_filename(4))))
+
+    @override_settings(ROLLUP_SETTLE_SECONDS=0)
+    def test_incremental_renders_changed_objects_only(self):
+        snapshot.snapshot(self.directory)
+        self.remove_detail_files()
+
+        changed = self.books[3]
+        changed.summary = 'New summary'
+        changed.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            BookInstance.objects.create(book=self.books[10], imprint='Imprint', status='o')
+
+        result = snapshot.snapshot(self.directory, incremental=True)
+        self.assertEqual(self.detail_files(), {
+            'book/%d' % changed.pk, 'book/%d' % self.books[10].pk, 'author/%d' % changed.author_id,
+        })
+        self.assertIn('New summary', self.read('catalog/book/%d/index.html' % changed.pk))
+        self.assertEqual(result.rendered, 1 + 3 + 2 + 1)
+
+        # Nothing changed since.
+        self.remove_detail_files()
+        snapshot.snapshot(self.directory, incremental=True)
+        self.assertEqual(self.detail_files(), set())
+
+    def test_incremental_without_previous_snapshot_is_full(self):
+        result = snapshot.snapshot(self.directory, incremental=True)
+        self.assertEqual(result.rendered, 1 + 3 + 25 + 2)
+
+    def test_failures_are_reported(self):
+        orphan = Book.objects.create(title='Orphan', summary='Summary')
+        with self.assertLogs('catalog.snapshot', 'ERROR'):
+            result = snapshot.snapshot(self.directory)
+        self.assertEqual(result.failed, ['/catalog/book/%d/' % orphan.pk])
+
+    def test_failed_pages_are_retried_by_the_next_incremental_snapshot(self):
+        orphan = Book.objects.create(title='Orphan', summary='Summary')
+        with self.assertLogs('catalog.snapshot', 'ERROR'):
+            snapshot.snapshot(self.directory)
+        self.remove_detail_files()
+        with self.assertLogs('catalog.snapshot', 'ERROR'):
+            result = snapshot.snapshot(self.directory, incremental=True)
+        self.assertEqual(result.failed, ['/catalog/book/%d/' % orphan.pk])
+
+        # update() leaves `updated` alone: only the recorded failure brings the page back.
+        Book.objects.filter(pk=orphan.pk).update(author=self.authors[0])
+        snapshot.snapshot(self.directory, incremental=True)
+        self.assertEqual(self.detail_files(), {'book/%d' % orphan.pk})
+
+    def test_renamed_author_rerenders_their_books(self):
+        snapshot.snapshot(self.directory)
+        self.remove_detail_files()
+        author = self.authors[1]
+        author.last_name = 'Renamed'
+        author.save()
+
+        snapshot.snapshot(self.directory, incremental=True)
+        expected = {'book/%d' % book.pk for book in self.books if book.author_id == author.pk}
+        self.assertEqual(self.detail_files(), expected | {'author/%d' % author.pk})
+        self.assertIn('Renamed', self.read('catalog/book/%d/index.html' % self.books[1].pk))
+
+    def test_command(self):
+        call_command('snapshot_site', self.directory, '--chunk-size', '5', stdout=open(os.devnull, 'w'))
+        self.assertTrue(os.path.exists(os.path.join(self.directory, 'catalog', 'books', 'page-3.html')))
+        self.assertTrue(os.path.exists(os.path.join(self.directory, snapshot.STATE_FILE)))
@@ -0,0 +1,120 @@
+import csv
+import io
+import os
+import tempfile
+import uuid
+
+from django.contrib.auth.models import Permission, User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+
+from catalog import archive, stocktake
+from catalog.models import Author, Book, BookInstance, Branch, Stocktake
+
+
+class StocktakeTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.librarian = User.objects.create_user(username='librarian', password='12345')
+        cls.librarian.user_permissions.add(Permission.objects.get(codename='can_mark_returned'))
+        cls.patron = User.objects.create_user(username='patron', password='12345')
+        cls.main = Branch.objects.create(name='Main')
+        cls.north = Branch.objects.create(name='North')
+        author = Author.objects.create(first_name='John', last_name='Smith')
+        cls.book = Book.objects.create(title='Book', summary='Summary', author=author)
+
+        def copy(status, branch=None):
+            return BookInstance.objects.create(book=cls.book, imprint='Imprint', status=status, branch=branch or cls.main)
+        cls.shelved = copy('a')
+        cls.reserved = copy('r')
+        cls.missing = copy('a')
+        cls.lent = copy('o')
+        cls.lent_and_scanned = copy('o')
+        cls.repairing = copy('m')
+        cls.elsewhere = copy('a', cls.north)
+        cls.withdrawn = copy('m')
+        archive.archive_copies(BookInstance.objects.filter(pk=cls.withdrawn.pk))
+        cls.unknown = uuid.uuid4()
+
+    def scan_lines(self):
+        return [
+            str(self.shelved.pk), str(self.reserved.pk).upper(), '', str(self.shelved.pk), 'not a uuid',
+            self.lent_and_scanned.pk.hex, str(self.elsewhere.pk), str(self.withdrawn.pk), str(self.unknown),
+        ]
+
+    def test_load_and_reconcile_branch(self):
+        inventory = Stocktake.objects.create(branch=self.main)
+        invalid = stocktake.load_scans(inventory, [line.encode() + b'\r\n' for line in self.scan_lines()], chunk_size=2)
+        self.assertEqual(invalid, 1)
+        inventory.refresh_from_db()
+        self.assertEqual(inventory.scanned, 6)
+
+        self.assertEqual(list(stocktake.missing_copies(inventory)), [self.missing])
+        self.assertEqual({scan.copy_id for scan in stocktake.unexpected_scans(inventory)},
+                         {self.withdrawn.pk, self.unknown})
+        self.assertEqual(set(stocktake.mismatched_copies(inventory)), {self.lent_and_scanned, self.elsewhere})
+
+        stocktake.reconcile(inventory)
+        inventory.refresh_from_db()
+        self.assertEqual((inventory.missing, inventory.unexpected, inventory.mismatched), (1, 2, 2))
+        self.assertIsNotNone(inventory.reconciled)
+
+    def test_whole_library_and_incremental_uploads(self):
+        inventory = Stocktake.objects.create()
+        stocktake.load_scans(inventory, [str(self.shelved.pk), str(self.reserved.pk)])
+        stocktake.load_scans(inventory, [str(self.shelved.pk), str(self.elsewhere.pk)])
+        inventory.refresh_from_db()
+        self.assertEqual(inventory.scanned, 3)
+        self.assertEqual(list(stocktake.missing_copies(inventory)), [self.missing])
+        self.assertEqual(list(stocktake.mismatched_copies(inventory)), [])
+
+    def test_report(self):
+        inventory = Stocktake.objects.create(branch=self.main)
+        stocktake.load_scans(inventory, self.scan_lines())
+        rows = list(csv.reader(io.StringIO(''.join(stocktake.report_csv(inventory, batch=2)))))
+        self.assertEqual(tuple(rows[0]), stocktake.REPORT_HEADER)
+        self.assertCountEqual(rows[1:], [
+            ['missing', str(self.missing.pk), 'Book', 'Available', 'Main'],
+            ['mismatched', str(self.lent_and_scanned.pk), 'Book', 'On loan', 'Main'],
+            ['mismatched', str(self.elsewhere.pk), 'Book', 'Available', 'North'],
+            ['unexpected', str(self.withdrawn.pk), '', 'Archived', ''],
+            ['unexpected', str(self.unknown), '', 'Unknown', ''],
+        ])
+
+    def test_upload_and_download(self):
+        upload = lambda: SimpleUploadedFile('scans.txt', '\n'.join(self.scan_lines()).encode())
+        self.client.login(username='patron', password='12345')
+        self.assertEqual(self.client.post(reverse('stocktake-upload'), {'file': upload()}).status_code, 403)
+
+        self.client.login(username='librarian', password='12345')
+        resp = self.client.post(reverse('stocktake-upload'), {'file': upload(), 'branch': self.main.pk})
+        self.assertEqual(resp.status_code, 200)
+        result = resp.json()
+        self.assertEqual((result['scanned'], result['invalid_lines'], result['missing'], result['unexpected'],
+                          result['mismatched']), (6, 1, 1, 2, 2))
+
+        resp = self.client.get(result['report'])
+        self.assertEqual(resp['Content-Type'], 'text/csv')
+        self.assertEqual(len(b''.join(resp.streaming_content).decode().splitlines()), 6)
+
+        self.assertEqual(self.client.post(reverse('stocktake-upload'), {'branch': self.main.pk}).status_code, 400)
+        self.assertEqual(
+            self.client.post(reverse('stocktake-upload'), {'file': upload(), 'stocktake': 999}).status_code, 400
+        )
+
+    def test_command(self):
+        directory = tempfile.mkdtemp()
+        scan_file = os.path.join(directory, 'scans.txt')
+        report = os.path.join(directory, 'report.csv')
+        with open(scan_file, 'w') as file:
+            file.write('\n'.join(self.scan_lines()))
+        call_command('stocktake', scan_file, '--branch', str(self.main.pk), '--report', report,
+                     stdout=open(os.devnull, 'w'))
+        with open(report) as file:
+            self.assertEqual(len(file.readlines()), 6)
+        os.remove(scan_file)
+        os.remove(report)
+        os.rmdir(directory)
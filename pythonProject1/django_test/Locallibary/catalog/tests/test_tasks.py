@@ -0,0 +1,135 @@
+import datetime
+import time
+
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from catalog import tasks
+from catalog.models import PeriodicTask, Task
+
+calls = []
+
+
+@tasks.task
+def remember(value):
+    calls.append(value)
+
+
+@tasks.task
+def explode():
+    raise RuntimeError('boom')
+
+
+@tasks.task
+def remember_lock():
+    time.sleep(0.3)
+    calls.append(Task.objects.get().locked_at)
+
+
+class TaskQueueTest(TestCase):
+
+    def setUp(self):
+        calls.clear()
+
+    def test_enqueued_task_is_run_once(self):
+        tasks.enqueue(remember, 'hello')
+        self.assertEqual(tasks.work('test', once=True), 1)
+        self.assertEqual(calls, ['hello'])
+        self.assertEqual(Task.objects.get().status, Task.DONE)
+        self.assertEqual(tasks.work('test', once=True), 0)
+
+    def test_unknown_task_is_rejected(self):
+        with self.assertRaises(KeyError):
+            tasks.enqueue('catalog.tasks.missing')
+
+    def test_claimed_task_is_not_claimed_again(self):
+        tasks.enqueue(remember, 1)
+        self.assertEqual(len(tasks.claim('first')), 1)
+        self.assertEqual(tasks.claim('second'), [])
+        self.assertEqual(Task.objects.get().locked_by, 'first')
+
+    def test_future_task_waits(self):
+        tasks.enqueue(remember, 1, run_at=timezone.now() + datetime.timedelta(hours=1))
+        self.assertEqual(tasks.work('test', once=True), 0)
+
+    def test_failure_is_retried_with_backoff(self):
+        tasks.enqueue(explode, max_attempts=2)
+        tasks.work('test', once=True)
+
+        task = Task.objects.get()
+        self.assertEqual((task.status, task.attempts), (Task.QUEUED, 1))
+        self.assertGreater(task.run_at, timezone.now())
+        self.assertIn('boom', task.last_error)
+
+        Task.objects.update(run_at=timezone.now())
+        tasks.work('test', once=True)
+        self.assertEqual(Task.objects.get().status, Task.FAILED)
+
+    def test_dedup_key_keeps_one_pending_task(self):
+        first = tasks.enqueue(remember, 1, dedup_key='same')
+        second = tasks.enqueue(remember, 2, dedup_key='same')
+        self.assertEqual(first.pk, second.pk)
+
+        tasks.work('test', once=True)
+        tasks.enqueue(remember, 3, dedup_key='same')
+        self.assertEqual(Task.objects.count(), 2)
+
+    def test_periodic_task_is_enqueued_when_due(self):
+        PeriodicTask.objects.create(name='hourly', task=remember.task_name, args=['tick'], interval=3600)
+        tasks.work('test', once=True)
+        tasks.work('test', once=True)
+
+        self.assertEqual(calls, ['tick'])
+        self.assertGreater(PeriodicTask.objects.get().next_run, timezone.now())
+
+    def test_stale_running_task_is_requeued(self):
+        tasks.enqueue(remember, 1)
+        tasks.claim('dead')
+        Task.objects.update(locked_at=timezone.now() - tasks.LOCK_TIMEOUT - datetime.timedelta(seconds=1))
+
+        self.assertEqual(tasks.requeue_stale(), 1)
+        self.assertEqual(tasks.work('test', once=True), 1)
+
+    def test_stale_task_without_attempts_left_fails(self):
+        tasks.enqueue(remember, 1, max_attempts=1)
+        tasks.claim('dead')
+        Task.objects.update(locked_at=timezone.now() - tasks.LOCK_TIMEOUT - datetime.timedelta(seconds=1))
+
+        self.assertEqual(tasks.requeue_stale(), 1)
+        task = Task.objects.get()
+        self.assertEqual((task.status, task.attempts, task.locked_by), (Task.FAILED, 1, ''))
+        self.assertEqual(tasks.work('test', once=True), 0)
+
+    def test_heartbeat_keeps_the_lock(self):
+        tasks.enqueue(remember, 1)
+        [claimed] = tasks.claim('alive')
+        Task.objects.update(locked_at=timezone.now() - tasks.LOCK_TIMEOUT - datetime.timedelta(seconds=1))
+
+        self.assertTrue(tasks.heartbeat(claimed))
+        self.assertEqual(tasks.requeue_stale(), 0)
+
+    def test_outcome_is_only_recorded_by_the_lock_holder(self):
+        tasks.enqueue(remember, 1)
+        [presumed_dead] = tasks.claim('slow')
+        Task.objects.update(locked_at=timezone.now() - tasks.LOCK_TIMEOUT - datetime.timedelta(seconds=1))
+        tasks.requeue_stale()
+        tasks.claim('other')
+
+        self.assertFalse(tasks.heartbeat(presumed_dead))
+        self.assertFalse(tasks.run(presumed_dead))
+        task = Task.objects.get()
+        self.assertEqual((task.status, task.locked_by), (Task.RUNNING, 'other'))
+
+
+@override_settings(TASK_HEARTBEAT_INTERVAL=0.05)
+class TaskHeartbeatTest(TransactionTestCase):
+
+    def setUp(self):
+        calls.clear()
+
+    def test_running_task_refreshes_its_lock(self):
+        tasks.enqueue(remember_lock)
+        [claimed] = tasks.claim('test')
+        claimed_at = claimed.locked_at
+        self.assertTrue(tasks.run(claimed))
+        self.assertGreater(calls[0], claimed_at)
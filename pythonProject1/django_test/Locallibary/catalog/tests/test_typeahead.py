@@ -0,0 +1,83 @@
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from catalog import typeahead
+from catalog.models import Author, Book
+from catalog.typeahead import PrefixIndex
+
+
+class PrefixIndexTest(TestCase):
+
+    def test_search_is_case_insensitive_and_ordered(self):
+        index = PrefixIndex([('Dune', 1), ('dune messiah', 2), ('Duma Key', 3), ('Emma', 4)])
+        self.assertEqual(index.search('DUN'), [('Dune', 1), ('dune messiah', 2)])
+        self.assertEqual(index.search('du', limit=1), [('Duma Key', 3)])
+        self.assertEqual(index.search(''), [])
+
+    def test_max_entries_bounds_the_index(self):
+        index = PrefixIndex([('Title %d' % number, number) for number in range(1, 11)], max_entries=5)
+        self.assertEqual(len(index), 5)
+
+    def test_authors_get_room_in_a_full_index(self):
+        Book.objects.bulk_create([Book(title='Book %d' % number, summary='Summary') for number in range(10)])
+        Author.objects.create(first_name='Frank', last_name='Herbert')
+        index = PrefixIndex(typeahead.catalog_entries(8), max_entries=8)
+        self.assertEqual(len(index), 8)
+        self.assertEqual(len(index.search('herbert')), 1)
+        self.assertEqual(len(index.search('book')), 6)
+
+
+@override_settings(TYPEAHEAD_REFRESH_SECONDS=0)
+class TypeaheadViewTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = Author.objects.create(first_name='Frank', last_name='Herbert')
+        cls.book = Book.objects.create(title='Dune', summary='Summary', author=cls.author)
+
+    def setUp(self):
+        typeahead.reset()
+
+    def search(self, query):
+        return self.client.get(reverse('typeahead'), {'q': query}).json()['results']
+
+    def test_titles_and_authors_are_suggested(self):
+        self.assertEqual(self.search('du'), [{'label': 'Dune', 'kind': 'book', 'url': self.book.get_absolute_url()}])
+        self.assertEqual(self.search('herb')[0]['url'], self.author.get_absolute_url())
+        self.assertEqual(self.search('frank h')[0]['label'], 'Frank Herbert')
+
+    def test_index_is_refreshed_after_changes(self):
+        self.search('x')
+        Book.objects.create(title='Dune Messiah', summary='Summary', author=self.author)
+        self.assertEqual(len(self.search('dune')), 2)
+
+    def test_index_is_not_rebuilt_per_request(self):
+        self.search('du')
+        with self.assertNumQueries(0):
+            self.search('dun')
+
+    def test_failed_rebuild_is_not_retried_per_request(self):
+        index = typeahead.get_index()
+        typeahead._state['built_at'] -= 60
+        Book.objects.create(title='Dune Messiah', summary='Summary', author=self.author)
+        with self.settings(TYPEAHEAD_REFRESH_SECONDS=30, TYPEAHEAD_MAX_ENTRIES='broken'):
+            with self.assertRaises(TypeError):
+                typeahead.get_index()
+            with self.assertNumQueries(0):
+                self.assertIs(typeahead.get_index(), index)
+
+
+@override_settings(TYPEAHEAD_REFRESH_SECONDS=0, TYPEAHEAD_BACKGROUND_REBUILD=True)
+class TypeaheadRebuildTest(TransactionTestCase):
+
+    def setUp(self):
+        typeahead.reset()
+
+    def test_stale_index_is_served_while_rebuilding(self):
+        Book.objects.create(title='Dune', summary='Summary')
+        first = typeahead.get_index()
+        Book.objects.create(title='Dune Messiah', summary='Summary')
+
+        self.assertIs(typeahead.get_index(), first)
+        typeahead._state['rebuild'].join()
+        self.assertEqual(len(typeahead.get_index().search('dune')), 2)
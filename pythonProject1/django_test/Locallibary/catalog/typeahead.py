@@ -0,0 +1,142 @@
+"""
+In-process prefix index for the title/author typeahead.
+
+All book titles and author names are kept in one sorted list of casefolded
+keys, so a prefix query is a binary search plus a short scan. The index is
+built lazily on the first query in each process and rebuilt when the
+"typeahead" cache version is bumped (Book/Author saves and deletes), at most
+once per TYPEAHEAD_REFRESH_SECONDS so bursts of edits do not cause rebuild
+storms. A rebuild runs in a background thread while requests keep using the
+old index; only the very first build of a process is done in the request.
+
+TYPEAHEAD_MAX_ENTRIES bounds its memory. Up to half of it is reserved for
+author names, so a catalog with more books than the bound still suggests
+authors.
+"""
+import bisect
+import threading
+import time
+from array import array
+
+from django.conf import settings
+from django.db import connection
+
+from .cache import get_version
+from .models import Author, Book
+
+VERSION_NAME = 'typeahead'
+
+MAX_LABEL_LENGTH = 100
+
+
+def normalize(text):
+    return ' '.join(text.casefold().split())
+
+
+class PrefixIndex:
+    """
+    Sorted array of (key, label, ref) triples; ref > 0 is a book pk, ref < 0 is minus an author pk.
+    """
+    def __init__(self, entries, max_entries=None):
+        triples = []
+        for label, ref in entries:
+            if max_entries is not None and len(triples) >= max_entries:
+                break
+            key = normalize(label)
+            if key:
+                triples.append((key, label[:MAX_LABEL_LENGTH], ref))
+        triples.sort()
+        self.keys = [key for key, _, _ in triples]
+        self.labels = [label for _, label, _ in triples]
+        self.refs = array('q', (ref for _, _, ref in triples))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def search(self, prefix, limit=10):
+        """
+        Returns up to `limit` (label, ref) pairs whose key starts with `prefix`, in key order.
+        """
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        results = []
+        seen = set()
+        position = bisect.bisect_left(self.keys, prefix)
+        while position < len(self.keys) and len(results) < limit and self.keys[position].startswith(prefix):
+            ref = self.refs[position]
+            if ref not in seen:
+                seen.add(ref)
+                results.append((self.labels[position], ref))
+            position += 1
+        return results
+
+
+def catalog_entries(max_entries=None):
+    """
+    Yields (label, ref) pairs for all books and authors (at most `max_entries`), streaming from the database.
+    """
+    authors = Author.objects.order_by('id').values_list('id', 'last_name', 'first_name')
+    books = Book.objects.order_by('id').values_list('id', 'title')
+    if max_entries is not None:
+        # Every author is indexed under two labels.
+        authors = authors[:max_entries // 4]
+    count = 0
+    for pk, last_name, first_name in authors.iterator(chunk_size=10000):
+        # Authors are found both as "last, first" (as in Author.__str__) and as "first last".
+        label = '%s, %s' % (last_name, first_name)
+        yield label, -pk
+        yield '%s %s' % (first_name, last_name), -pk
+        count += 2
+    if max_entries is not None:
+        books = books[:max(max_entries - count, 0)]
+    for pk, title in books.iterator(chunk_size=10000):
+        yield title, pk
+
+
+_lock = threading.Lock()
+_state = {'index': None, 'version': None, 'built_at': 0.0, 'rebuild': None}
+
+
+def _build(version, in_thread=False):
+    # Called with _lock held; releases it. A failed build counts as an attempt too, so the stale
+    # index is served for another TYPEAHEAD_REFRESH_SECONDS instead of every request retrying.
+    try:
+        max_entries = getattr(settings, 'TYPEAHEAD_MAX_ENTRIES', 2000000)
+        index = PrefixIndex(catalog_entries(max_entries), max_entries)
+        _state.update(index=index, version=version)
+    finally:
+        _state['built_at'] = time.monotonic()
+        _lock.release()
+        if in_thread:
+            connection.close()
+
+
+def get_index():
+    """
+    Returns the process-wide index, building it if it is missing and starting a rebuild if it is stale.
+    """
+    version = get_version(VERSION_NAME)
+    index = _state['index']
+    refresh = getattr(settings, 'TYPEAHEAD_REFRESH_SECONDS', 30)
+    if index is not None and (
+        _state['version'] == version or time.monotonic() - _state['built_at'] < refresh
+    ):
+        return index
+
+    # While another thread rebuilds, keep serving the stale index instead of waiting.
+    if not _lock.acquire(blocking=index is None):
+        return index
+    if _state['index'] is not index:
+        _lock.release()
+        return _state['index']
+    if index is None or not getattr(settings, 'TYPEAHEAD_BACKGROUND_REBUILD', True):
+        _build(version)
+        return _state['index']
+    _state['rebuild'] = threading.Thread(target=_build, args=(version, True), name='typeahead-rebuild', daemon=True)
+    _state['rebuild'].start()
+    return index
+
+
+def reset():
+    _state.update(index=None, version=None, built_at=0.0, rebuild=None)
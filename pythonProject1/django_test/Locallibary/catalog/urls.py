@@ -1,13 +1,27 @@
 from django.urls import path
 from . import views
+from .pagecache import book_detail_versions, book_list_versions, shared_page, user_page
 
 urlpatterns = [
     path('', views.index, name='index'),
-    path('books/', views.BookListView.as_view(), name='books'),
-    path('book/<int:pk>/', views.BookDetailView.as_view(), name='book-detail'),
+    path('books/', shared_page(views.BookListView.as_view(), book_list_versions), name='books'),
+    path('book/<int:pk>/', shared_page(views.BookDetailView.as_view(), book_detail_versions), name='book-detail'),
+    path('book/<int:pk>/availability/', views.book_availability_stream, name='book-availability-stream'),
     path('book/<uuid:pk>/renew/', views.renew_book_librarian, name='renew-book-librarian'),
     path('authors/', views.AuthorListView.as_view(), name='authors'),
-    path('author/<int:pk>/', views.AuthorDetailView.as_view(), name='author-detail'),
-    path('mybooks/', views.LoanedBooksByUserListView.as_view(), name='my-borrowed'),
+    path('author/<int:pk>/', shared_page(views.AuthorDetailView.as_view()), name='author-detail'),
+    path('author/<int:pk>/books/', views.author_books_json, name='author-books'),
+    path('mybooks/', user_page(views.LoanedBooksByUserListView.as_view()), name='my-borrowed'),
+    path('mybooks/stream/', views.my_loans_stream, name='my-loans-stream'),
     path('all-borrowed/', views.AllBorrowedBooksListView.as_view(), name='all-borrowed'),
+    path('isbn/resolve/', views.resolve_isbn_batch, name='isbn-resolve-batch'),
+    path('isbn/<str:isbn>/', views.resolve_isbn, name='isbn-resolve'),
+    path('typeahead/', views.typeahead_search, name='typeahead'),
+    path('circulation/batch/', views.circulation_batch, name='circulation-batch'),
+    path('user-nav/', views.user_nav, name='user-nav'),
+    path('stocktake/', views.stocktake_upload, name='stocktake-upload'),
+    path('stocktake/<int:pk>/report.csv', views.stocktake_report, name='stocktake-report'),
+    path('sitemap.xml', views.sitemap_index, name='sitemap-index'),
+    path('sitemap-<str:section>-<int:number>.xml', views.sitemap_section, name='sitemap-section'),
+    path('reports/loans/', views.loan_report, name='loan-report'),
 ]
\ No newline at end of file
@@ -1,17 +1,42 @@
+import asyncio
 from django.views import generic
 from django.shortcuts import render, get_object_or_404
-from django.http import HttpResponseRedirect
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseRedirect, JsonResponse, HttpResponseBadRequest, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+import json
+from urllib.parse import urlencode
 from django.urls import reverse
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
 from django.contrib.auth.decorators import permission_required
+from django.contrib.auth.views import redirect_to_login
+from django.contrib.auth.models import User
 import datetime
-from .models import Book, Author, BookInstance, Genre
+import uuid
+from django.core.exceptions import PermissionDenied
+from django.core.paginator import Paginator
+from django.db.models import Count, Sum
+from django.db.models.functions import Substr
+from django.utils.cache import patch_cache_control
+from django.utils.http import url_has_allowed_host_and_scheme
+from django.utils.text import Truncator
+from .models import Book, Author, BookInstance, Branch, Genre, LoanRollup, Stocktake
 from .forms import RenewBookForm
+from .fines import outstanding_balance
+from .genres import names_by_book
+from .isbn import normalize_isbn
+from .recommendations import recommended_books
+from .similarity import similar_books
+from . import circulation, facets, live, metrics, pagecache, sitemaps, stocktake, typeahead
+from .asgi import event_stream, event_streams_enabled
+from .branches import current_branch, scope_copies
 
 def index(request):
+    branch = current_branch(request)
     num_books = Book.objects.all().count()
-    num_instances = BookInstance.objects.all().count()
-    num_instances_available = BookInstance.objects.filter(status__exact='a').count()
+    num_instances = scope_copies(BookInstance.objects.all(), branch).count()
+    num_instances_available = scope_copies(BookInstance.objects.filter(status__exact='a'), branch).count()
     num_authors = Author.objects.count()  # The 'all()' is implied by default.
 
     # Number of visits to this view, as counted in the session variable.
@@ -32,19 +57,121 @@ def index(request):
     )
 
 class BookListView(generic.ListView):
+    """
+    Generic class-based view listing books, filterable by genre, author and availability,
+    with facet counts for each filter option.
+    """
     model = Book
     paginate_by = 10
 
+    def get_queryset(self):
+        self.filters = facets.parse_filters(self.request.GET, current_branch(self.request))
+        return facets.filter_books(Book.objects.select_related('author'), self.filters).order_by('title', 'id')
+
+    def filter_query(self, **changes):
+        params = {
+            'genre': self.filters['genre'],
+            'author': self.filters['author'],
+            'available': 1 if self.filters['available'] else None,
+        }
+        params.update(changes)
+        return urlencode({name: value for name, value in params.items() if value is not None})
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        counts = facets.facet_counts(self.filters)
+        context['filters'] = self.filters
+        context['filter_query'] = self.filter_query()
+        context['genre_facets'] = [
+            {'name': name, 'count': count, 'selected': pk == self.filters['genre'],
+             'query': self.filter_query(genre=None if pk == self.filters['genre'] else pk)}
+            for pk, name, count in counts['genre']
+        ]
+        context['author_facets'] = [
+            {'name': name, 'count': count, 'selected': pk == self.filters['author'],
+             'query': self.filter_query(author=None if pk == self.filters['author'] else pk)}
+            for pk, name, count in counts['author']
+        ]
+        context['available_facet'] = {
+            'count': counts['available'], 'selected': self.filters['available'],
+            'query': self.filter_query(available=None if self.filters['available'] else 1),
+        }
+        return context
+
 class BookDetailView(generic.DetailView):
     model = Book
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['copies'] = scope_copies(self.object.bookinstance_set.all(), current_branch(self.request))
+        if self.request.GET.get('archived'):
+            context['archived_copies'] = scope_copies(self.object.archived_copies.all(), current_branch(self.request))
+        context['genre_names'] = names_by_book([self.object.pk])[self.object.pk]
+        context['recommended_books'] = recommended_books(self.object)
+        context['similar_books'] = similar_books(self.object)
+        context['live_streams'] = event_streams_enabled()
+        return context
+
 class AuthorListView(generic.ListView):
     model = Author
     paginate_by = 10
 
+# Books per page of an author's bibliography, and the characters of each summary shown there.
+AUTHOR_BOOKS_PER_PAGE = 20
+SUMMARY_EXCERPT_LENGTH = 300
+
+
+def author_books(author_id):
+    """
+    Returns the books of an author with only their id, title and the start of the summary loaded.
+    """
+    # One character more than shown, so truncatechars can tell whether the summary was cut.
+    return Book.objects.filter(author_id=author_id).only('id', 'title').annotate(
+        summary_excerpt=Substr('summary', 1, SUMMARY_EXCERPT_LENGTH + 1)
+    ).order_by('title', 'id')
+
+
+def author_books_page(author_id, book_count, page_number):
+    paginator = Paginator(author_books(author_id), AUTHOR_BOOKS_PER_PAGE)
+    # The count is already known from the author query.
+    paginator.count = book_count
+    return paginator.get_page(page_number)
+
+
 class AuthorDetailView(generic.DetailView):
+    """
+    Generic class-based view for an author, with their books paginated.
+    """
     model = Author
 
+    def get_queryset(self):
+        return Author.objects.annotate(book_count=Count('book'))
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        page = author_books_page(self.object.pk, self.object.book_count, self.request.GET.get('page'))
+        context['page_obj'] = page
+        context['books'] = page.object_list
+        context['excerpt_length'] = SUMMARY_EXCERPT_LENGTH
+        return context
+
+
+def author_books_json(request, pk):
+    """
+    Returns one page of an author's books as JSON for the "load more" button.
+    """
+    author = get_object_or_404(Author.objects.annotate(book_count=Count('book')).only('id'), pk=pk)
+    page = author_books_page(author.pk, author.book_count, request.GET.get('page'))
+    book_url = url_template('book-detail')
+    return JsonResponse({
+        'books': [
+            {'title': book.title, 'url': book_url % book.pk,
+             'summary': Truncator(book.summary_excerpt).chars(SUMMARY_EXCERPT_LENGTH)}
+            for book in page
+        ],
+        'next_page': page.next_page_number() if page.has_next() else None,
+    })
+
 class LoanedBooksByUserListView(LoginRequiredMixin, generic.ListView):
     """
     Generic class-based view listing books on loan to current user.
@@ -54,7 +181,17 @@ class LoanedBooksByUserListView(LoginRequiredMixin, generic.ListView):
     paginate_by = 10
 
     def get_queryset(self):
-        return BookInstance.objects.filter(borrower=self.request.user).filter(status__exact='o').order_by('due_back')
+        copies = (
+            BookInstance.objects.filter(borrower=self.request.user).filter(status__exact='o')
+            .select_related('book').order_by('due_back')
+        )
+        return scope_copies(copies, current_branch(self.request))
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['outstanding_fines'] = outstanding_balance(self.request.user)
+        context['live_streams'] = event_streams_enabled()
+        return context
 
 class AllBorrowedBooksListView(PermissionRequiredMixin, generic.ListView):
     """
@@ -67,14 +204,17 @@ class AllBorrowedBooksListView(PermissionRequiredMixin, generic.ListView):
     permission_required = 'catalog.can_mark_returned'
 
     def get_queryset(self):
-        return BookInstance.objects.filter(status__exact='o').order_by('due_back')
+        copies = BookInstance.objects.filter(status__exact='o').select_related('book', 'borrower').order_by('due_back')
+        return scope_copies(copies, current_branch(self.request))
 
 @permission_required('catalog.can_mark_returned')
 def renew_book_librarian(request, pk):
     """
-    View function for renewing a specific BookInstance by librarian
+    View function for renewing a specific BookInstance by librarian.
+    The new due date is written only if the copy is still at the version the form was shown with,
+    and the form's token makes a repeated submit return the first result.
     """
-    book_inst = get_object_or_404(BookInstance, pk=pk)
+    book_inst = get_object_or_404(BookInstance.objects.select_related('book', 'borrower'), pk=pk)
 
     # If this is a POST request then process the Form data
     if request.method == 'POST':
@@ -84,16 +224,323 @@ def renew_book_librarian(request, pk):
 
         # Check if the form is valid:
         if form.is_valid():
-            # process the data in form.cleaned_data as required (here we just write it to the model due_back field)
-            book_inst.due_back = form.cleaned_data['renewal_date']
-            book_inst.save()
+            # Write only due_back (and the version) with a conditional UPDATE, not a save() of every field
+            version = form.cleaned_data['version']
+            try:
+                response, replayed = circulation.process_batch(
+                    'renew:%s' % (form.cleaned_data['token'] or uuid.uuid4().hex), circulation.RENEW, [str(pk)],
+                    user=request.user, due_back=form.cleaned_data['renewal_date'],
+                    versions=None if version is None else {str(pk): version},
+                )
+                # A token replayed from the form of another copy carries that copy's result, not this one's
+                result = response['results'].get(str(pk)) or {'ok': False, 'error': 'form already used'}
+            except circulation.BatchError:
+                result = {'ok': False, 'error': 'form already used'}
+            if result['ok']:
+                # redirect to a new URL:
+                return HttpResponseRedirect(reverse('all-borrowed') )
 
-            # redirect to a new URL:
-            return HttpResponseRedirect(reverse('all-borrowed') )
+            # Show the copy as it is now, keeping the date entered, to submit again
+            book_inst.refresh_from_db()
+            data = request.POST.copy()
+            data.update({'version': book_inst.version, 'token': uuid.uuid4().hex})
+            form = RenewBookForm(data)
+            form.is_valid()
+            if result['error'] == 'changed since read':
+                form.add_error(None, 'The copy was changed by someone else meanwhile, check it and submit again.')
+            elif result['error'] == 'form already used':
+                form.add_error(None, 'This form was already submitted for another copy, check it and submit again.')
+            else:
+                form.add_error(None, 'The copy cannot be renewed: %s.' % result['error'])
 
     # If this is a GET (or any other method) create the default form.
     else:
         proposed_renewal_date = datetime.date.today() + datetime.timedelta(weeks=3)
-        form = RenewBookForm(initial={'renewal_date': proposed_renewal_date,})
+        form = RenewBookForm(initial={
+            'renewal_date': proposed_renewal_date, 'version': book_inst.version, 'token': uuid.uuid4().hex,
+        })
+
+    return render(request, 'catalog/book_renew_librarian.html', {'form': form, 'bookinst':book_inst})
+
+
+REPORT_DIMENSIONS = {
+    LoanRollup.BOOK: Book,
+    LoanRollup.GENRE: Genre,
+    LoanRollup.AUTHOR: Author,
+}
+
+
+@permission_required('catalog.can_mark_returned')
+def loan_report(request):
+    """
+    View function for circulation totals per book, genre or author over a date range.
+    Reads only the daily rollups, never the event log itself.
+    """
+    dimension = request.GET.get('dimension', LoanRollup.GENRE)
+    if dimension not in REPORT_DIMENSIONS:
+        dimension = LoanRollup.GENRE
+    today = datetime.date.today()
+    try:
+        end = datetime.date.fromisoformat(request.GET.get('end', ''))
+    except ValueError:
+        end = today
+    try:
+        start = datetime.date.fromisoformat(request.GET.get('start', ''))
+    except ValueError:
+        start = end - datetime.timedelta(days=30)
+
+    rows = list(
+        LoanRollup.objects.filter(dimension=dimension, day__range=(start, end))
+        .values('key')
+        .annotate(checkouts=Sum('checkouts'), returns=Sum('returns'), renewals=Sum('renewals'))
+        .order_by('-checkouts', 'key')[:100]
+    )
+    names = REPORT_DIMENSIONS[dimension].objects.in_bulk([row['key'] for row in rows])
+    for row in rows:
+        row['name'] = names.get(row['key'], '#%s' % row['key'])
+
+    return render(request, 'catalog/loan_report.html', {
+        'rows': rows,
+        'dimension': dimension,
+        'dimensions': LoanRollup.DIMENSION,
+        'start': start,
+        'end': end,
+    })
+
+
+def resolve_isbn(request, isbn):
+    """
+    Redirects an ISBN-10 or ISBN-13 (with or without hyphens) to the detail page of its book.
+    """
+    isbn13 = normalize_isbn(isbn)
+    if isbn13 is None:
+        raise Http404('Invalid ISBN')
+    book = get_object_or_404(Book.objects.only('id'), isbn13=isbn13)
+    return HttpResponseRedirect(book.get_absolute_url())
+
+
+MAX_ISBN_BATCH = 10000
+
+URL_PLACEHOLDER = 987654321
+
+
+def url_template(name):
+    """
+    Returns the URL pattern `name` as a %-format string taking the pk, so many URLs can be built without reverse().
+    """
+    return reverse(name, args=[URL_PLACEHOLDER]).replace(str(URL_PLACEHOLDER), '%s')
+
+
+@csrf_exempt
+@require_POST
+def resolve_isbn_batch(request):
+    """
+    Resolves a JSON list of ISBNs ({"isbns": [...]}) to books with a single IN query.
+    Each input ISBN maps to {"isbn", "id", "title", "url"} or null when it is invalid or unknown.
+    """
+    try:
+        isbns = json.loads(request.body)['isbns']
+    except (ValueError, KeyError, TypeError):
+        return HttpResponseBadRequest('Expected a JSON object with an "isbns" list')
+    if not isinstance(isbns, list) or len(isbns) > MAX_ISBN_BATCH:
+        return HttpResponseBadRequest('"isbns" must be a list of at most %d items' % MAX_ISBN_BATCH)
+
+    normalized = {isbn: normalize_isbn(isbn) for isbn in map(str, isbns)}
+    book_url = url_template('book-detail')
+    books = {
+        isbn13: {'isbn': isbn13, 'id': pk, 'title': title, 'url': book_url % pk}
+        for pk, isbn13, title in Book.objects.filter(isbn13__in={v for v in normalized.values() if v})
+        .values_list('id', 'isbn13', 'title')
+    }
+    return JsonResponse({'results': {isbn: books.get(isbn13) for isbn, isbn13 in normalized.items()}})
+
+
+def typeahead_search(request):
+    """
+    Returns JSON suggestions of book titles and author names starting with the `q` parameter.
+    """
+    book_url = url_template('book-detail')
+    author_url = url_template('author-detail')
+    results = [
+        {'label': label, 'kind': 'book', 'url': book_url % ref} if ref > 0
+        else {'label': label, 'kind': 'author', 'url': author_url % -ref}
+        for label, ref in typeahead.get_index().search(request.GET.get('q', ''))
+    ]
+    return JsonResponse({'results': results})
+
+
+@require_POST
+@permission_required('catalog.can_mark_returned', raise_exception=True)
+def circulation_batch(request):
+    """
+    Checks out, returns or renews a batch of scanned copies:
+    {"batch_key": "...", "action": "checkout|return|renew", "copies": [uuid, ...],
+     "borrower": user id (checkout only), "due_back": "YYYY-MM-DD" (optional),
+     "versions": {uuid: version last seen, ...} (optional)}.
+    Responds with a result per copy, including its new version; copies changed since the given version
+    are not touched. Repeating a batch_key of the same user returns the stored response.
+    """
+    try:
+        payload = json.loads(request.body)
+        batch_key = str(payload['batch_key'])
+        action = payload['action']
+        copies = payload['copies']
+        due_back = datetime.date.fromisoformat(payload['due_back']) if payload.get('due_back') else None
+        versions = payload.get('versions')
+    except (ValueError, KeyError, TypeError):
+        return HttpResponseBadRequest('Expected JSON with "batch_key", "action" and "copies"')
+    if not isinstance(copies, list):
+        return HttpResponseBadRequest('"copies" must be a list')
+    if versions is not None and not isinstance(versions, dict):
+        return HttpResponseBadRequest('"versions" must be an object')
+
+    borrower = None
+    if payload.get('borrower') is not None:
+        borrower = User.objects.filter(pk=payload['borrower'], is_active=True).first()
+        if borrower is None:
+            return HttpResponseBadRequest('Unknown borrower')
+
+    try:
+        response, replayed = circulation.process_batch(
+            batch_key, action, copies, user=request.user, borrower=borrower, due_back=due_back, versions=versions
+        )
+    except circulation.BatchError as error:
+        return HttpResponseBadRequest(str(error))
+    return JsonResponse(dict(response, replayed=replayed))
+
+
+@require_POST
+@permission_required('catalog.can_mark_returned', raise_exception=True)
+def stocktake_upload(request):
+    """
+    Adds an uploaded scan file ("file": one copy UUID per line) to a stocktake and reconciles it.
+    Starts a stocktake of the "branch" (or of all branches) unless "stocktake" names one to add to.
+    """
+    upload = request.FILES.get('file')
+    if upload is None:
+        return HttpResponseBadRequest('Expected a scan file in "file"')
+    try:
+        if request.POST.get('stocktake'):
+            inventory = Stocktake.objects.get(pk=request.POST['stocktake'])
+        else:
+            branch = Branch.objects.get(pk=request.POST['branch']) if request.POST.get('branch') else None
+            inventory = Stocktake.objects.create(branch=branch, created_by=request.user)
+    except (ValueError, Stocktake.DoesNotExist, Branch.DoesNotExist):
+        return HttpResponseBadRequest('Unknown stocktake or branch')
+
+    stocktake.load_scans(inventory, upload)
+    stocktake.reconcile(inventory)
+    return JsonResponse({
+        'stocktake': inventory.pk,
+        'scanned': inventory.scanned,
+        'invalid_lines': inventory.invalid_lines,
+        'missing': inventory.missing,
+        'unexpected': inventory.unexpected,
+        'mismatched': inventory.mismatched,
+        'report': reverse('stocktake-report', args=[inventory.pk]),
+    })
+
+
+@permission_required('catalog.can_mark_returned', raise_exception=True)
+def stocktake_report(request, pk):
+    """
+    Streams the discrepancies of a stocktake as a CSV download.
+    """
+    inventory = get_object_or_404(Stocktake, pk=pk)
+    response = StreamingHttpResponse(stocktake.report_csv(inventory), content_type='text/csv')
+    response['Content-Disposition'] = 'attachment; filename="stocktake-%d.csv"' % inventory.pk
+    return response
+
+
+async def _event_stream(topic):
+    """
+    Yields SSE frames for the messages published to `topic`.
+    """
+    heartbeat = getattr(settings, 'LIVE_HEARTBEAT_SECONDS', 15)
+    # Subscribed here rather than in the view: the stream may be consumed on another event loop.
+    subscription = live.broker.subscribe(topic)
+    try:
+        yield 'retry: 3000\n\n'
+        while True:
+            try:
+                message = await asyncio.wait_for(subscription.get(), heartbeat)
+            except asyncio.TimeoutError:
+                yield ': keep-alive\n\n'
+            else:
+                if message is None:
+                    yield 'event: reload\ndata: {}\n\n'
+                    return
+                yield 'event: copy\ndata: %s\n\n' % json.dumps(message)
+    finally:
+        subscription.close()
 
-    return render(request, 'catalog/book_renew_librarian.html', {'form': form, 'bookinst':book_inst})
\ No newline at end of file
+
+def _event_stream_response(request, topic):
+    if not event_streams_enabled():
+        # 204 tells EventSource clients (of pages rendered before a switch to WSGI) not to reconnect.
+        return HttpResponse(status=204)
+    response = StreamingHttpResponse(_event_stream(topic), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@event_stream
+async def book_availability_stream(request, pk):
+    """
+    Streams status changes of the copies of a book as Server-Sent Events.
+    """
+    if not await Book.objects.filter(pk=pk).aexists():
+        raise Http404('Book does not exist')
+    return _event_stream_response(request, live.book_topic(pk))
+
+
+@event_stream
+async def my_loans_stream(request):
+    """
+    Streams status changes of the copies on loan to the current user as Server-Sent Events.
+    """
+    user = await request.auser()
+    if not user.is_authenticated:
+        return redirect_to_login(request.get_full_path())
+    return _event_stream_response(request, live.user_topic(user.pk))
+
+
+def prometheus_metrics(request):
+    """
+    Operational metrics in the Prometheus text format, for the Prometheus server and staff users.
+    """
+    if not metrics.can_scrape(request):
+        raise PermissionDenied
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def sitemap_index(request):
+    """
+    Sitemap index listing one sitemap file per range of book and author ids.
+    """
+    def file_url(section, number):
+        return request.build_absolute_uri(reverse('sitemap-section', args=[section, number]))
+    return StreamingHttpResponse(sitemaps.render_index(file_url), content_type='application/xml')
+
+
+def sitemap_section(request, section, number):
+    """
+    One sitemap file of book or author detail URLs, streamed from the database.
+    """
+    if section not in sitemaps.SECTIONS or number < 1:
+        raise Http404('No such sitemap')
+    template = request.build_absolute_uri(url_template(sitemaps.SECTIONS[section][1]))
+    return StreamingHttpResponse(sitemaps.render_section(section, number, template), content_type='application/xml')
+
+
+def user_nav(request):
+    """
+    The user navigation of the sidebar, included by an edge cache into pages cached by @shared_page.
+    """
+    next_path = request.GET.get('next', '')
+    if not next_path.startswith('/') or not url_has_allowed_host_and_scheme(next_path, allowed_hosts=None):
+        next_path = reverse('index')
+    response = HttpResponse(pagecache.render_user_nav(request, next_path))
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
\ No newline at end of file